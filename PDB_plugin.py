@@ -27,11 +27,21 @@ USAGE
     PDB_Analysis_Molecules pdb_id
     PDB_Analysis_Domains pdb_id
     PDB_Analysis_Validation pdb_id
+    PDB_Batch_Analysis pdb_ids [, method [, output_dir [, processes
+                       [, output_format ]]]]
+    PDB_Cache_Structures pdb_ids
+    PDB_Memory [ pdb_id [, method [, top ]]]
+    PDB_Profile pdb_id [, method [, output_file ]]
+    PDB_Render_Images pdb_ids [, views [, output_dir [, width [, height
+                      [, processes ]]]]]
+    PDB_Update_Index file_name
     count_chains selection
 
 ARGUMENTS
 
     pdb_id = string: 4-character PDB entry ID
+    pdb_ids = string: space separated PDB entry IDs or name of file with IDs
+    file_name = string: file with a PDB entry ID and title per line
     selection = string: selection-expression or name-pattern {default: (all)}.
 
 EXAMPLES
@@ -56,50 +66,53 @@ NOTES
 
 from __future__ import print_function
 
+from collections import deque
 from collections import namedtuple
+from collections import OrderedDict
+import atexit
+import contextlib
+import copy
 import datetime
+import email.utils
+import functools
+import glob
+import gzip
+import hashlib
 import importlib  # needs at least python 2.7
+import io
 import json  # parsing the input
 import logging
+import mmap
 import os
+import pickle
 import random
 import re
 import socket
+import struct
 import sys
+import tempfile
+import threading
 import time
+import weakref
 
 import pymol
 import pymol.plugins
-from pymol import cmd
-from pymol import stored
+import pymol.util
 
 # ftp site
 _EBI_FTP = ('ftp://ftp.ebi.ac.uk/pub/databases/pdb/data/structures/divided/'
             'mmCIF/%s/%s.cif.gz')
 # clean mmcif
 _UPDATED_FTP = 'https://www.ebi.ac.uk/pdbe/static/entry/%s_updated.cif.gz'
+_UPDATED_BCIF = 'https://www.ebi.ac.uk/pdbe/entry-files/download/%s.bcif'
 _EMPTY_PDB_NUM = frozenset(['', '.', '?', None])
 
 
-def clear_analysis_data():
-    # Note that pymol.stored is just a convenient global variable where this
-    # data is attached to. It is not necessary to have it there for interaction
-    # with pymol.
-
-    # --- inputs from PDB API
-    stored.molecules = {}  # get_molecules()
-    Sequences.clear()
-
-    # --- results of analysis
-    stored.polymer_count = 0  # Molecules()._process_molecules()
-    stored.ca_p_only_segments = set()  # Molecules()._process_molecules()
-
-
 def extendaa(*arg, **kw):
     """Wrapper across cmd.extendaa that also adds new command to pymol.cmd."""
 
     def wrapper(func):
-        _self = kw.get('_self', cmd)
+        _self = kw.get('_self', pymol.cmd)
         name = func.__name__
         setattr(_self, name, func)
         return _self.extendaa(*arg, **kw)(func)
@@ -107,13 +120,575 @@ def extendaa(*arg, **kw):
     return wrapper
 
 
+class Profiler(object):
+    """Collects hierarchical phase timings and counters of an analysis.
+
+    Everything is a no-op unless profiling was started. Phases are only timed
+    in the thread that started profiling; counters can be incremented from any
+    thread, e.g. by background downloads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None  # thread that started profiling
+        self._start = None
+        self._stack = []  # currently open phases, outermost first
+        self._counters = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    @property
+    def timing(self):
+        """Whether phases of the current thread are timed."""
+        return threading.current_thread() is self._thread
+
+    @staticmethod
+    def _new_phase(name):
+        return {'name': name, 'seconds': 0.0, 'calls': 0, 'phases': []}
+
+    def start(self):
+        """Starts profiling, discarding previously collected data."""
+        self._stack = [self._new_phase('total')]
+        self._counters = OrderedDict()
+        self._start = time.time()
+        self._thread = threading.current_thread()
+
+    def stop(self):
+        """Stops profiling and returns the collected report.
+
+        Format:
+          <report> = dict('phases': <phase>, 'counters': dict(<name>: <count>))
+            <phase> = dict(name: string, seconds: float, calls: int,
+                           phases: list(<phase>)) in order of first call
+        """
+        root = self._stack[0]
+        root['seconds'] = time.time() - self._start
+        root['calls'] = 1
+        self._thread = None
+        with self._lock:
+            counters = OrderedDict(self._counters)
+        return {'phases': root, 'counters': counters}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times the enclosed block as a sub-phase of the current phase."""
+        if not self.timing:
+            yield
+            return
+        parent = self._stack[-1]
+        for phase in parent['phases']:
+            if phase['name'] == name:
+                break
+        else:
+            phase = self._new_phase(name)
+            parent['phases'].append(phase)
+        self._stack.append(phase)
+        start = time.time()
+        try:
+            yield
+        finally:
+            phase['seconds'] += time.time() - start
+            phase['calls'] += 1
+            self._stack.pop()
+
+    def timed(self, name):
+        """Decorator that times each call of the function as phase name."""
+
+        def decorator(func):
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name, amount=1):
+        """Adds amount to counter name."""
+        if self._thread is None:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    @staticmethod
+    def format_report(report):
+        """Returns the report as a human readable table."""
+        total = report['phases']['seconds'] or 1e-9
+        lines = ['%-40s %9s %6s %6s' % ('phase', 'seconds', 'calls', 'share')]
+
+        def add_phase(phase, depth):
+            lines.append('%-40s %9.3f %6d %5.1f%%' %
+                         ('  ' * depth + phase['name'], phase['seconds'],
+                          phase['calls'], 100.0 * phase['seconds'] / total))
+            for sub_phase in phase['phases']:
+                add_phase(sub_phase, depth + 1)
+
+        add_phase(report['phases'], 0)
+        if report['counters']:
+            lines.append('%-40s %9s' % ('counter', 'count'))
+            # Individual PyMOL commands go after the summary counters.
+            for name, value in sorted(report['counters'].items(),
+                                      key=lambda item:
+                                      (item[0].startswith('cmd.'), item[0])):
+                lines.append('%-40s %9d' % (name, value))
+        return '\n'.join(lines)
+
+
+profiler = Profiler()  # started by PDB_Profile
+
+
+class _CmdProxy(object):
+    """Stands in for pymol.cmd and passes the PyMOL commands issued in a
+    thread to the observers installed in that thread.
+
+    Observers are called with (name, args, kwargs) before each command. As
+    they are per thread, overlapping analyses, e.g. of several AnalysisTasks,
+    and the GUI's own commands don't see each other's commands.
+    """
+
+    def __init__(self, cmd):
+        self._cmd = cmd
+        self._local = threading.local()
+
+    @property
+    def observers(self):
+        """Returns the observers of the current thread."""
+        return getattr(self._local, 'observers', ())
+
+    @contextlib.contextmanager
+    def observe(self, observer):
+        """Passes the commands issued in this thread meanwhile to observer."""
+        observers = self.observers
+        self._local.observers = observers + (observer,)
+        try:
+            yield
+        finally:
+            self._local.observers = observers
+
+    def __getattr__(self, name):
+        attr = getattr(self._cmd, name)
+        observers = self.observers
+        if not observers or not callable(attr) or isinstance(attr, type):
+            return attr
+
+        def command(*args, **kwargs):
+            for observer in observers:
+                observer(name, args, kwargs)
+            return attr(*args, **kwargs)
+
+        return command
+
+
+cmd = _CmdProxy(pymol.cmd)  # all PyMOL commands of the plugin go through it
+
+
+def _count_command(name, args, kwargs):
+    """Counts a PyMOL command in the profile (see _CmdProxy.observe)."""
+    profiler.count('pymol commands')
+    profiler.count('cmd.' + name)
+
+
+class _CommandRecorder(object):
+    """Records the PyMOL commands it observes (see _CmdProxy.observe).
+
+    Only commands which change what is shown are recorded; queries such as
+    count_atoms or get_coords are left out.
+    """
+
+    COMMANDS = frozenset([
+        'color', 'create', 'delete', 'disable', 'enable', 'hide',
+        'load_coordset', 'pseudoatom', 'select', 'set', 'set_color', 'show',
+        'transform_object'
+    ])
+
+    def __init__(self):
+        self.commands = []  # list of (name, args, kwargs)
+
+    def __call__(self, name, args, kwargs):
+        if name in self.COMMANDS:
+            self.commands.append((name, args, kwargs))
+
+
+class RateLimiter(object):
+    """Limits the rate and concurrency of requests to the PDB API.
+
+    A token bucket allows bursts of up to burst requests and rate requests
+    per second on average; at most max_concurrent requests to a host are in
+    flight at once. When the server asks to slow down (HTTP 429 or 503), the
+    rate is halved and requests pause for the Retry-After time; the rate
+    recovers gradually with successful requests.
+
+    Processes sharing the limits, such as batch workers, each get a share of
+    the rate and a semaphore shared_slots, which all their requests in flight
+    together hold.
+
+    Args:
+        rate: Maximum requests per second.
+        burst: Maximum number of requests sent without delay.
+        max_concurrent: Maximum concurrent requests per host.
+    """
+
+    min_rate = 0.5  # requests per second when slowed down
+    backoff = 1.0  # pause in seconds after throttling without Retry-After
+    max_retry_after = 60.0
+
+    def __init__(self, rate=10.0, burst=10, max_concurrent=4):
+        self._condition = threading.Condition()
+        self._active = {}  # host -> number of requests in flight
+        self._blocked_until = 0
+        self.shared_slots = None  # semaphore shared with other processes
+        self.set_limits(rate, burst, max_concurrent)
+
+    def set_limits(self, rate, burst, max_concurrent):
+        with self._condition:
+            self.rate = max(float(rate), self.min_rate)
+            self.burst = max(burst, 1)
+            self.max_concurrent = max(max_concurrent, 1)
+            self._current_rate = self.rate
+            self._tokens = float(self.burst)
+            self._refill_time = time.time()
+            self._condition.notify_all()
+
+    @staticmethod
+    def _get_host(url):
+        match = re.match(r'\w+://([^/?#]*)', url)
+        return match.group(1) if match else ''
+
+    def _refill(self, now):
+        self._tokens = min(
+            self.burst,
+            self._tokens + (now - self._refill_time) * self._current_rate)
+        self._refill_time = now
+
+    def _get_delay(self, host, now):
+        """Returns seconds to wait before a request to host.
+
+        Returns 0 if the request may be sent now, or None to wait for a
+        request in flight to finish.
+        """
+        if self._active.get(host, 0) >= self.max_concurrent:
+            return None  # wait for a request to finish
+        delay = self._blocked_until - now
+        if self._tokens < 1:
+            delay = max(delay, (1 - self._tokens) / self._current_rate)
+        return max(delay, 0)
+
+    @contextlib.contextmanager
+    def request(self, url):
+        """Context of a request to url; waits until it may be sent."""
+        host = self._get_host(url)
+        with self._condition:
+            while True:
+                now = time.time()
+                self._refill(now)
+                delay = self._get_delay(host, now)
+                if delay == 0:
+                    break
+                profiler.count('api request delays')
+                AnalysisTask.check_cancelled()
+                # Wake up regularly to notice cancelled analyses.
+                self._condition.wait(min(delay or 0.5, 0.5))
+            self._tokens -= 1
+            self._active[host] = self._active.get(host, 0) + 1
+        try:
+            if self.shared_slots is None:
+                yield
+            else:
+                self._acquire_shared_slot()
+                try:
+                    yield
+                finally:
+                    self.shared_slots.release()
+        finally:
+            with self._condition:
+                self._active[host] -= 1
+                self._condition.notify_all()
+
+    def _acquire_shared_slot(self):
+        """Waits until the processes sharing the limits have a slot free."""
+        # Wake up regularly to notice cancelled analyses.
+        while not self.shared_slots.acquire(True, 0.5):
+            profiler.count('api request delays')
+            AnalysisTask.check_cancelled()
+
+    def succeeded(self):
+        """Recovers the rate after a successful request."""
+        with self._condition:
+            if self._current_rate < self.rate:
+                self._refill(time.time())
+                self._current_rate = min(self.rate,
+                                         self._current_rate + self.rate / 10)
+
+    def throttled(self, retry_after=None):
+        """Slows down after the server rejected a request as too many.
+
+        Args:
+            retry_after: Value of the Retry-After header, in seconds or as
+                HTTP date, if any.
+        """
+        delay = self._parse_retry_after(retry_after)
+        if delay is None:
+            delay = self.backoff
+        delay = min(delay, self.max_retry_after)
+        logging.debug('PDB API throttled; pausing %.1f s' % delay)
+        profiler.count('api throttled')
+        with self._condition:
+            now = time.time()
+            self._refill(now)
+            self._current_rate = max(self.min_rate, self._current_rate / 2)
+            self._blocked_until = max(self._blocked_until, now + delay)
+
+    @staticmethod
+    def _parse_retry_after(retry_after):
+        """Returns the Retry-After header value in seconds or None."""
+        if not retry_after:
+            return None
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+        date = email.utils.parsedate_tz(retry_after)
+        if date is None:
+            return None
+        return max(email.utils.mktime_tz(date) - time.time(), 0)
+
+
+api_rate_limiter = RateLimiter()  # configured by initialize()
+
+
+class NoResponseError(IOError):
+    """Raised when a server didn't respond after several tries."""
+
+
+class _MirrorStats(object):
+    """Latency and error statistics of a mirror."""
+
+    def __init__(self, url, index):
+        self.url = url
+        self.index = index  # position in the configured list
+        self.latencies = deque(maxlen=50)  # seconds of recent responses
+        self.latency = None  # exponentially weighted average seconds
+        self.error_rate = 0.0  # exponentially weighted share of failures
+        self.failed_until = 0  # mirror is tried last until this time
+
+
+class Mirrors(object):
+    """Equivalent servers for URLs starting with the canonical root URL.
+
+    Requests go to the fastest healthy mirror first and fail over to the
+    others. After a failure, a mirror is tried last for a while, the longer
+    the more of its recent requests failed. With a hedge_percentile set, a
+    request which takes longer than that percentile of the fastest mirror's
+    response times is repeated at the next mirror; the first response wins.
+
+    Args:
+        canonical: Root URL of the URLs built by the plugin.
+        urls: Root URLs of the mirrors; defaults to [canonical].
+    """
+
+    min_samples = 5  # response times needed before requests are hedged
+    cooldown = 30  # seconds a failing mirror is avoided at most
+    weight = 0.2  # weight of new samples in the averages
+
+    def __init__(self, canonical, urls=None):
+        self.canonical = canonical.rstrip('/')
+        self.hedge_percentile = 0  # 0 disables hedging
+        self._lock = threading.Lock()
+        self.set_urls(urls)
+
+    def set_urls(self, urls):
+        """Sets the mirror root URLs; resets their statistics."""
+        urls = [url.rstrip('/') for url in urls or [] if url]
+        if not urls:
+            urls = [self.canonical]
+        with self._lock:
+            self._mirrors = [_MirrorStats(url, i) for i, url in enumerate(urls)]
+
+    @property
+    def urls(self):
+        return [mirror.url for mirror in self._mirrors]
+
+    def _get_order(self):
+        """Returns the mirrors, fastest healthy ones first.
+
+        Mirrors without measured response times are tried early once.
+        """
+        now = time.time()
+        with self._lock:
+            return sorted(self._mirrors,
+                          key=lambda m:
+                          (m.failed_until > now, m.latency or 0, m.index))
+
+    def _record(self, mirror, seconds, ok):
+        with self._lock:
+            mirror.error_rate += self.weight * (
+                (0 if ok else 1) - mirror.error_rate)
+            if ok:
+                mirror.latencies.append(seconds)
+                mirror.latency = seconds if mirror.latency is None else (
+                    mirror.latency + self.weight * (seconds - mirror.latency))
+            else:
+                # The more requests failed recently, the longer it's avoided.
+                mirror.failed_until = (time.time() +
+                                       self.cooldown * mirror.error_rate)
+
+    def get_hedge_delay(self, mirror):
+        """Returns seconds before a request to mirror is hedged, or None."""
+        with self._lock:
+            latencies = sorted(mirror.latencies)
+        if not self.hedge_percentile or len(latencies) < self.min_samples:
+            return None
+        return latencies[int(self.hedge_percentile / 100.0 *
+                             (len(latencies) - 1))]
+
+    def _fetch_from(self, mirror, path, read):
+        start = time.time()
+        try:
+            data = read(mirror.url + path)
+        except Exception:
+            self._record(mirror, time.time() - start, False)
+            raise
+        self._record(mirror, time.time() - start, True)
+        return data
+
+    def fetch(self, url, read):
+        """Returns read(<mirror url>) of url from the first mirror that works.
+
+        Raises the error of the last mirror if all of them fail.
+        """
+        path = url[len(self.canonical):]
+        order = self._get_order()
+        error = None
+        delay = self.get_hedge_delay(order[0])
+        if delay is not None and len(order) > 1:
+            try:
+                return self._fetch_hedged(path, read, order[:2], delay)
+            except Exception as e:
+                error = e
+            order = order[2:]
+        for mirror in order:
+            if error is not None:
+                logging.warning('%s failed: %s; trying %s' %
+                                (url, error, mirror.url))
+                profiler.count('mirror failovers')
+            try:
+                return self._fetch_from(mirror, path, read)
+            except Exception as e:
+                error = e
+        raise error
+
+    def _fetch_hedged(self, path, read, mirrors, delay):
+        """Fetches path from mirrors[0], or mirrors[1] if it is too slow."""
+        condition = threading.Condition()
+        outcomes = []  # (data, error)
+
+        def fetch(mirror):
+            try:
+                outcome = (self._fetch_from(mirror, path, read), None)
+            except Exception as e:
+                outcome = (None, e)
+            with condition:
+                outcomes.append(outcome)
+                condition.notify_all()
+
+        def start(mirror):
+            thread = threading.Thread(target=fetch,
+                                      args=(mirror,),
+                                      name='Mirrors')
+            thread.daemon = True  # a losing request may still be running
+            thread.start()
+
+        with condition:
+            start(mirrors[0])
+            condition.wait(delay)
+            if not outcomes or outcomes[0][1] is not None:
+                logging.debug('hedging %s at %s' % (path, mirrors[1].url))
+                profiler.count('hedged requests')
+                start(mirrors[1])
+                while len(outcomes) < 2 and all(e for _, e in outcomes):
+                    condition.wait()
+            for data, error in outcomes:
+                if error is None:
+                    return data
+            raise error
+
+    @staticmethod
+    def find(url):
+        """Returns the Mirrors of url, or None."""
+        for mirrors in (api_mirrors, file_mirrors):
+            if url.startswith(mirrors.canonical + '/'):
+                return mirrors
+        return None
+
+
+api_mirrors = Mirrors('https://www.ebi.ac.uk/pdbe/api')  # see initialize()
+file_mirrors = Mirrors('https://www.ebi.ac.uk/pdbe')  # see initialize()
+
+
+def _read_raw_file(file_path):
+    """Returns the contents of a local file or URL as stored, e.g. gzipped."""
+    if '://' not in file_path:
+        with open(file_path, 'rb') as file:
+            return file.read()
+    try:
+        urlopen = importlib.import_module('urllib.request').urlopen
+    except ImportError:  # python 2.x
+        urlopen = importlib.import_module('urllib2').urlopen
+    response = urlopen(file_path, None, 60)
+    try:
+        return response.read()
+    finally:
+        response.close()
+
+
+def _read_file(file_path):
+    """Returns (contents, compressed) of a local file or URL.
+
+    contents are uncompressed; compressed are the bytes as read if the file is
+    gzip compressed, else None.
+    """
+    mirrors = Mirrors.find(file_path)
+    if mirrors is None:
+        raw = _read_raw_file(file_path)
+    else:
+        raw = mirrors.fetch(file_path, lambda url: _read_raw_file(url))
+    if raw[:2] != b'\x1f\x8b':  # gzip magic number
+        return raw, None
+    return gzip.GzipFile(fileobj=io.BytesIO(raw)).read(), raw
+
+
+class _Flight(object):
+    """A request in flight, whose result identical requests wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.data = None  # copy of the result, made only for waiters
+        self.error = None
+        self.cancelled = False  # the analysis of the requester was cancelled
+
+
 class PdbFetcher(object):
     """Downloads PDB json data from URLs.
 
     This class tries to use one of several libraries to get the data, depending
     on which are installed on the system.
+
+    Requests for a URL which is already being fetched, by any fetcher in any
+    thread, wait for that download instead of repeating it. If the analysis
+    which started the download is cancelled, the waiting requests download it
+    themselves instead.
     """
 
+    _THROTTLED_CODES = (429, 503)  # too many requests, service unavailable
+    _flights = {}  # url -> _Flight
+    _flights_lock = threading.Lock()
+    coalesced_requests = 0  # requests served by another request's download
+
     def __init__(self):
         self._modules = {}  # Modules loaded by this class - like sys.modules.
         self._fetcher = None  # Fetcher method to use for get_data.
@@ -158,26 +733,100 @@ class PdbFetcher(object):
         """Returns PDB data from the given URL."""
         logging.debug(description)
         url = self._quote(url)
-        return self._fetcher(url, description, **kw)
+        while True:
+            AnalysisTask.check_cancelled()
+            with PdbFetcher._flights_lock:
+                flight = PdbFetcher._flights.get(url)
+                in_flight = flight is not None
+                if in_flight:
+                    flight.waiters += 1
+                    PdbFetcher.coalesced_requests += 1
+                else:
+                    flight = PdbFetcher._flights[url] = _Flight()
+            if not in_flight:
+                break
+            data = self._wait_for_flight(flight, description)
+            if not flight.cancelled:
+                return data
+            # Try again, possibly leading the next flight.
+        data = None
+        try:
+            data = self._fetch(url, description, **kw)
+            return data
+        except AnalysisCancelled:
+            # Only this analysis is cancelled, not those waiting for it.
+            flight.cancelled = True
+            raise
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with PdbFetcher._flights_lock:
+                del PdbFetcher._flights[url]
+                waiters = flight.waiters  # no more can join now
+            if waiters:
+                # Callers may modify their data; waiters get own copies.
+                flight.data = copy.deepcopy(data)
+            flight.done.set()
+
+    def _fetch(self, url, description, **kw):
+        """Fetches url from its fastest mirror; returns {} without response."""
+        mirrors = Mirrors.find(url)
+        try:
+            if mirrors is None:
+                return self._fetcher(url, description, **kw)
+            return mirrors.fetch(
+                url,
+                lambda mirror_url: self._fetcher(mirror_url, description, **kw))
+        except NoResponseError as e:
+            logging.error(str(e))
+            return {}
+
+    @staticmethod
+    def _wait_for_flight(flight, description):
+        """Returns a copy of the data fetched by flight.
+
+        Returns None if flight was cancelled.
+        """
+        logging.debug('waiting for %s request in flight' % description)
+        profiler.count('coalesced api requests')
+        flight.done.wait()
+        if flight.cancelled:
+            return None
+        if flight.error is not None:
+            raise flight.error
+        return copy.deepcopy(flight.data)
 
     @staticmethod
     def _quote(url):
         """Returns URL with space escaped."""
         return url.replace(' ', '%20')
 
-    def _get_data_with_requests(self, url, description):
-        """Uses requests module to fetch and return data from the PDB URL."""
-        requests = self._modules['requests']
-        response = requests.get(url=url, timeout=60)
-        if response.status_code == 200:
-            data = response.json()
-        elif response.status_code == 404:
-            data = {}
-        else:
-            logging.debug('%d %s' % (response.status_code, response.reason))
-            data = {}
+    def _get_data_with_requests(self, url, description, limit=5):
+        """Uses requests module to fetch and return data from the PDB URL.
 
-        return data
+        Requests rejected as too many or failing with a server error are
+        retried up to limit times in total.
+        """
+        requests = self._modules['requests']
+        for tries in range(1, limit + 1):
+            profiler.count('api requests')
+            with api_rate_limiter.request(url):
+                response = requests.get(url=url, timeout=60)
+            if response.status_code == 200:
+                api_rate_limiter.succeeded()
+                profiler.count('api bytes', len(response.content))
+                return response.json()
+            logging.debug('%d %s, try %d' %
+                          (response.status_code, response.reason, tries))
+            if response.status_code in self._THROTTLED_CODES:
+                api_rate_limiter.throttled(response.headers.get('Retry-After'))
+            elif response.status_code < 500:
+                return {}  # e.g. 404 for entries without such data
+            else:
+                # A failing endpoint doesn't slow down the other requests.
+                time.sleep(api_rate_limiter.backoff)
+        raise NoResponseError('No response from the %s API' % description)
 
     def _get_data_with_urllib(self,
                               url,
@@ -196,8 +845,11 @@ class PdbFetcher(object):
         logging.debug(url)
         date = datetime.datetime.now().strftime('%Y,%m,%d  %H:%M')
         for tries in range(1, limit + 1):
+            profiler.count('api requests')
             try:
-                response = urllib2_request.urlopen(url, None, 60)
+                with api_rate_limiter.request(url):
+                    response = urllib2_request.urlopen(url, None, 60)
+                    contents = response.read()
             except urllib2_error.HTTPError as e:
                 logging.debug(
                     '%s HTTP API error - %s, error code - %s, try %d' %
@@ -206,6 +858,9 @@ class PdbFetcher(object):
                 if e.code == 404:
                     data_response = True
                     break
+                elif e.code in self._THROTTLED_CODES:
+                    api_rate_limiter.throttled((e.headers or
+                                                {}).get('Retry-After'))
                 else:
                     # logging.debug(entry_url)
                     time.sleep(random.randint(sleep_min, sleep_max))
@@ -226,12 +881,14 @@ class PdbFetcher(object):
                 logging.debug(
                     'received a response from the %s API after %d tries' %
                     (description, tries))
-                data = json.load(response)
+                api_rate_limiter.succeeded()
+                profiler.count('api bytes', len(contents))
+                data = json.loads(contents)
                 data_response = True
                 break
 
         if not data_response:
-            logging.error('No response from the %s API' % description)
+            raise NoResponseError('No response from the %s API' % description)
 
         return data
 
@@ -251,7 +908,14 @@ class PdbApi(object):
                  pretty=False):
         self._server_root = server_root.rstrip('/')
         self._url_suffix = '?pretty=true' if pretty else ''
-        self._fetcher = PdbFetcher()
+        self._pdb_fetcher = None
+
+    @property
+    def _fetcher(self):
+        """The PdbFetcher, created on first use to keep plugin startup fast."""
+        if self._pdb_fetcher is None:
+            self._pdb_fetcher = PdbFetcher()
+        return self._pdb_fetcher
 
     def get_summary(self, pdbid):
         """Returns a summary dictionary of the PDB entry.
@@ -356,6 +1020,471 @@ class PdbApi(object):
 pdb = PdbApi()
 
 
+class StructureCache(object):
+    """Local cache of downloaded structure files.
+
+    Files are stored gzip compressed as <pdbid>_<revision>_<hash>.<format>.gz,
+    where format is the structure file format (cif or bcif) prefixed by the
+    source of the file (see get_format()), revision is the entry's revision
+    date from the PDB summary and hash is a content hash of the uncompressed
+    file. Gzipped downloads are stored just as they arrived. A cached file is
+    only used for the same revision of the entry and if its contents still
+    match the hash. The least recently used files are evicted when the total
+    size of the cache exceeds max_bytes.
+
+    Args:
+        path: Cache directory; None disables the cache.
+        max_bytes: Maximum total size of all cached files.
+    """
+
+    def __init__(self, path=None, max_bytes=1000 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_revision(summary, pdbid):
+        """Returns the revision date from the summary of the PDB entry."""
+        try:
+            return str(summary[pdbid][0]['revision_date'])
+        except Exception:
+            return 'unknown'
+
+    @staticmethod
+    def get_format(url, format):
+        """Returns the format to cache files of format from url under.
+
+        Files of the same entry from other sources, e.g. the archive instead
+        of the updated files of PDBe, are cached separately.
+        """
+        return '%s.%s' % (hashlib.sha1(url.encode()).hexdigest()[:8], format)
+
+    @staticmethod
+    def _get_hash(contents):
+        return hashlib.sha1(contents).hexdigest()[:16]
+
+    def _get_files(self, pattern='*'):
+        if not self.path:
+            return []
+        return glob.glob(os.path.join(self.path, pattern + '.gz'))
+
+    def get_file(self, pdbid, revision, format):
+        """Returns the path of the cached file or None if not cached."""
+        files = self._get_files('%s_%s_*.%s' % (pdbid, revision, format))
+        return files[0] if files else None
+
+    def read(self, pdbid, revision, format):
+        """Returns the uncompressed file contents or None if not cached."""
+        file_path = self.get_file(pdbid, revision, format)
+        if not file_path:
+            return None
+        try:
+            contents = cmd.file_read(file_path)
+        except Exception as e:
+            logging.debug('failed to read cached %s: %s' % (file_path, e))
+            contents = None
+        expected_hash = os.path.basename(file_path).split('.')[0].split('_')[-1]
+        if contents is None or self._get_hash(contents) != expected_hash:
+            logging.warning('Removing corrupt cache file %s' % file_path)
+            self._remove(file_path)
+            return None
+        try:
+            os.utime(file_path, None)  # mark as recently used
+        except OSError:
+            pass  # evicted meanwhile; the contents are still good
+        logging.debug('structure cache hit: %s' % file_path)
+        return contents
+
+    def remove(self, pdbid, revision, format):
+        """Removes the cached file, e.g. if its contents can't be used."""
+        file_path = self.get_file(pdbid, revision, format)
+        if file_path:
+            self._remove(file_path)
+
+    def store(self, pdbid, revision, contents, format, compressed=None):
+        """Stores the file contents of the PDB entry.
+
+        Args:
+            contents: Uncompressed file contents.
+            compressed: The same contents gzip compressed, e.g. as downloaded,
+                which are stored as they are; None to compress contents.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            try:
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+                # Remove other revisions of the entry.
+                for file_path in self._get_files('%s_*.%s' % (pdbid, format)):
+                    self._remove(file_path)
+                file_name = '%s_%s_%s.%s.gz' % (
+                    pdbid, revision, self._get_hash(contents), format)
+                # Write to a temporary file first so readers never see a
+                # partially written file.
+                fd, temp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as file:
+                    if compressed is not None:
+                        file.write(compressed)
+                    else:
+                        # Written after each download or analysis, so fast.
+                        with gzip.GzipFile(fileobj=file,
+                                           mode='wb',
+                                           compresslevel=1) as gz:
+                            gz.write(contents)
+                os.rename(temp_path, os.path.join(self.path, file_name))
+                self._evict()
+            except Exception as e:
+                logging.warning('Failed to cache structure of %s: %s' %
+                                (pdbid, e))
+
+    def _evict(self):
+        """Removes least recently used files while the cache is too large."""
+        files = [(os.path.getmtime(f), os.path.getsize(f), f)
+                 for f in self._get_files()]
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, file_path in sorted(files):
+            if total_bytes <= self.max_bytes:
+                break
+            logging.debug('evicting %s from structure cache' % file_path)
+            self._remove(file_path)
+            total_bytes -= size
+
+    @staticmethod
+    def _remove(file_path):
+        try:
+            os.unlink(file_path)
+        except OSError:
+            pass
+
+
+structure_cache = StructureCache()  # configured by initialize()
+snapshot_cache = StructureCache()  # configured by initialize()
+
+
+class StructureDownload(object):
+    """Reads a structure file in the background and loads it into PyMOL.
+
+    The file is read (and decompressed) in a separate thread, so the download
+    overlaps with fetching the PDB API data needed for the analysis.
+    Only loading the contents into PyMOL happens in the calling thread.
+
+    Args:
+        file_path: Local file name or URL of the structure file.
+        cache: Optional StructureCache to read from and store to.
+        cache_key: (pdbid, revision) of the structure in the cache.
+        format: Format of the structure file, 'cif' or 'bcif'.
+        fallback_path: Optional mmCIF file name or URL which is read instead
+            if reading or decoding file_path fails.
+    """
+
+    FORMATS = ('cif', 'bcif')
+    preferred_format = 'cif'  # format of structures downloaded from PDBe
+
+    def __init__(self,
+                 file_path,
+                 cache=None,
+                 cache_key=None,
+                 format='cif',
+                 fallback_path=None):
+        self._sources = [(file_path, format)]
+        if fallback_path:
+            self._sources.append((fallback_path, 'cif'))
+        self._file_path = file_path
+        self._format = format
+        self._cache = cache
+        self._cache_key = cache_key
+        self._contents = None
+        self._compressed = None  # gzipped contents as downloaded, if any
+        self._error = None
+        self._contents_read = threading.Event()
+        self._thread = threading.Thread(target=self._read,
+                                        name='StructureDownload')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def format(self):
+        """Format of the file that was actually read."""
+        self._contents_read.wait()
+        return self._format
+
+    def _read(self):
+        store = self._read_sources(self._sources)
+        self._contents_read.set()
+        if store:
+            # Done after contents_read so it doesn't delay loading.
+            self._store()
+
+    def _read_sources(self, sources):
+        """Reads the first source that works; returns True to cache it."""
+        for file_path, format in sources:
+            self._file_path = file_path
+            self._format = format
+            self._error = None
+            try:
+                return self._read_source()
+            except Exception as e:
+                logging.warning('reading %s failed: %s' % (file_path, e))
+                self._error = e
+        return False
+
+    def _store(self):
+        pdbid, revision, format = self._get_cache_key()
+        self._cache.store(pdbid, revision, self._contents, format,
+                          self._compressed)
+        self._compressed = None
+
+    def _get_cache_key(self):
+        """Returns (pdbid, revision, format) of the current source."""
+        return self._cache_key + (StructureCache.get_format(
+            self._file_path, self._format),)
+
+    def _read_source(self):
+        """Reads the current source; returns True if it should be cached."""
+        use_cache = self._cache is not None and self._cache_key is not None
+        self._contents = None
+        self._compressed = None
+        if use_cache:
+            self._contents = self._cache.read(*self._get_cache_key())
+        if self._contents is None:
+            self._contents, self._compressed = _read_file(self._file_path)
+            profiler.count('structure bytes', len(self._compressed or
+                                                  self._contents))
+        else:
+            profiler.count('structure cache hits')
+            use_cache = False  # cache hit; nothing to store
+        return use_cache
+
+    def wait(self):
+        """Waits until the file contents are read."""
+        while not self._contents_read.wait(0.1):
+            AnalysisTask.check_cancelled()
+
+    @profiler.timed('structure load')
+    def load(self, object_name):
+        """Waits for the file contents and loads them as object_name."""
+        self.wait()
+        if self._error is not None:
+            raise self._error
+        logging.debug('loading %d bytes from %s' %
+                      (len(self._contents), self._file_path))
+        BinaryCif.discard(object_name)
+        store = False
+        if self._format == 'bcif':
+            try:
+                if BinaryCif.load(self._contents, object_name):
+                    return
+                # e.g. PyMOL builds without msgpack-c only print an error.
+                logging.warning("PyMOL can't read BinaryCIF files; using "
+                                "mmCIF")
+                BinaryCif.use_native_reader = False  # for later downloads
+            except Exception as e:
+                logging.warning('loading %s failed: %s' % (self._file_path, e))
+            store = self._read_fallback()
+        cmd.load_raw(self._contents, self._format, object_name)
+        if store:
+            self._store()
+
+    def _read_fallback(self):
+        """Reads the mmCIF fallback after PyMOL couldn't load BinaryCIF.
+
+        Returns True if the mmCIF file should be cached.
+        """
+        self._thread.join()  # may still be caching the BinaryCIF file
+        if self._cache is not None and self._cache_key is not None:
+            self._cache.remove(*self._get_cache_key())
+        if len(self._sources) < 2:
+            raise IOError('PyMOL failed to load %s' % self._file_path)
+        store = self._read_sources(self._sources[1:])
+        if self._error is not None:
+            raise self._error
+        return store
+
+
+class BinaryCif(object):
+    """Loads BinaryCIF structure files and decodes their assembly data.
+
+    Objects are built with PyMOL's own BinaryCIF reader; without one, mmCIF
+    files are downloaded instead. Some PyMOL builds have a reader which can't
+    read anything, which is only noticed when loading the first file.
+
+    Not all PyMOL versions keep the data items of BinaryCIF files, which
+    Assemblies needs. For those, the assembly categories are decoded here,
+    only once they are asked for. BinaryCIF stores each mmCIF data item as a
+    column of binary encoded values, described at
+    https://github.com/molstar/BinaryCIF. The columnar encodings are decoded
+    with numpy array operations. msgpack is used to read the file and is only
+    needed when BinaryCIF files are actually loaded.
+
+    Args:
+        contents: Uncompressed contents of the BinaryCIF file.
+    """
+
+    # ByteArray type codes -> little endian numpy dtypes.
+    _BYTE_ARRAY_TYPES = {
+        1: '<i1',
+        2: '<i2',
+        3: '<i4',
+        4: '<u1',
+        5: '<u2',
+        6: '<u4',
+        32: '<f4',
+        33: '<f8',
+    }
+    # mask values of a column: 0 = value present, 1 = '.', 2 = '?'
+    _MASK_VALUES = ('', '.', '?')
+    # Loaded objects by PyMOL object name, for access to their data items.
+    _loaded = {}
+    # Categories read by Assemblies; the only ones decoded.
+    _ASSEMBLY_CATEGORIES = ('pdbx_struct_assembly', 'pdbx_struct_assembly_gen',
+                            'pdbx_struct_oper_list')
+    # BinaryCIF files are only downloaded if PyMOL can read them.
+    use_native_reader = hasattr(cmd.loadable, 'bcif')
+
+    def __init__(self, contents):
+        self._contents = contents  # until the categories are decoded
+        self._categories = None  # category name -> {column name: column}
+
+    def _get_categories(self):
+        """Returns the assembly categories, unpacking them on first use."""
+        if self._categories is None:
+            msgpack = importlib.import_module('msgpack')
+            data = msgpack.unpackb(self._contents, raw=False)
+            self._contents = None
+            self._categories = {}
+            for category in data['dataBlocks'][0]['categories']:
+                name = category['name'].lstrip('_').lower()
+                if name in self._ASSEMBLY_CATEGORIES:
+                    self._categories[name] = dict(
+                        (column['name'], column)
+                        for column in category['columns'])
+        return self._categories
+
+    @classmethod
+    def is_available(cls):
+        """True if PyMOL and the packages needed can read BinaryCIF files."""
+        # Building objects without PyMOL's reader is slower than loading the
+        # mmCIF file instead.
+        if not cls.use_native_reader:
+            return False
+        try:
+            importlib.import_module('msgpack')
+            importlib.import_module('numpy')
+            return True
+        except ImportError:
+            return False
+
+    @classmethod
+    def get(cls, object_name):
+        """Returns the BinaryCif an object was built from or None."""
+        return cls._loaded.get(object_name)
+
+    @classmethod
+    def discard(cls, object_name):
+        """Forgets the BinaryCif data of an object which is being replaced."""
+        cls._loaded.pop(object_name, None)
+
+    @classmethod
+    def decode(cls, encoded):
+        """Returns the numpy array of an encoded data item column."""
+        numpy = importlib.import_module('numpy')
+        data = encoded['data']
+        for encoding in reversed(encoded['encoding']):
+            kind = encoding['kind']
+            if kind == 'ByteArray':
+                data = numpy.frombuffer(data,
+                                        cls._BYTE_ARRAY_TYPES[encoding['type']])
+            elif kind == 'FixedPoint':
+                data = data / float(encoding['factor'])
+            elif kind == 'IntervalQuantization':
+                step = ((encoding['max'] - encoding['min']) /
+                        float(encoding['numSteps'] - 1))
+                data = encoding['min'] + step * data
+            elif kind == 'RunLength':
+                data = numpy.repeat(data[0::2], data[1::2])
+            elif kind == 'Delta':
+                data = numpy.cumsum(data, dtype='i8') + encoding['origin']
+            elif kind == 'IntegerPacking':
+                data = cls._unpack_integers(data, encoding)
+            elif kind == 'StringArray':
+                strings = encoding['stringData']
+                offsets = cls.decode({
+                    'data': encoding['offsets'],
+                    'encoding': encoding['offsetEncoding']
+                })
+                # Index -1 denotes an empty string; append it at the end.
+                values = numpy.array([
+                    strings[start:end]
+                    for start, end in zip(offsets[:-1], offsets[1:])
+                ] + [''],
+                                     dtype=object)
+                indices = cls.decode({
+                    'data': data,
+                    'encoding': encoding['dataEncoding']
+                })
+                data = values[indices]
+            else:
+                raise ValueError('unknown BinaryCIF encoding %s' % kind)
+        return data
+
+    @staticmethod
+    def _unpack_integers(data, encoding):
+        """Decodes IntegerPacking: runs of limit values add up to one value."""
+        numpy = importlib.import_module('numpy')
+        if not len(data):
+            return data.astype('i4')
+        if encoding['isUnsigned']:
+            is_limit = data == numpy.iinfo(data.dtype).max
+        else:
+            is_limit = ((data == numpy.iinfo(data.dtype).max) |
+                        (data == numpy.iinfo(data.dtype).min))
+        ends = numpy.flatnonzero(~is_limit)
+        starts = numpy.concatenate(([0], ends[:-1] + 1))
+        return numpy.add.reduceat(data.astype('i4'), starts)
+
+    def get_array(self, key, dtype='s'):
+        """Returns a data item column like pymol's cif_get_array or None.
+
+        Args:
+            key: mmCIF data item name, e.g. '_atom_site.cartn_x'.
+            dtype: 's' for strings, 'i' for integers or 'f' for floats.
+        """
+        category, _, name = key.lstrip('_').lower().partition('.')
+        columns = self._get_categories().get(category, {})
+        column = next((c for n, c in columns.items() if n.lower() == name),
+                      None)
+        if column is None:
+            return None
+        values = self.decode(column['data'])
+        if dtype == 'i':
+            return [int(x) for x in values]
+        if dtype == 'f':
+            return [float(x) for x in values]
+        values = [str(x) for x in values]
+        if column.get('mask'):
+            for i, mask in enumerate(self.decode(column['mask'])):
+                if mask:
+                    values[i] = self._MASK_VALUES[mask]
+        return values
+
+    @classmethod
+    def load(cls, contents, object_name):
+        """Loads BinaryCIF file contents as PyMOL object object_name.
+
+        Returns False if PyMOL didn't create the object, e.g. since it was
+        built without BinaryCIF support.
+        """
+        cmd.delete(object_name)
+        cmd.load_raw(contents, 'bcif', object_name)
+        if object_name not in cmd.get_names('objects'):
+            return False
+        if not cmd.get_assembly_ids(object_name):
+            # PyMOL didn't keep the data items; decode them when needed.
+            cls._loaded[object_name] = cls(contents)
+        return True
+
+
 class Presentation(object):
     """Manage PyMOL presentation properties."""
 
@@ -446,61 +1575,294 @@ class Presentation(object):
         cmd.set('sphere_transparency', transparency, selection)
 
 
-def get_polymer_display_type(segment_id, molecule_type, length):
-    """Returns display type depending on molecule complexity."""
-    # Start with it being cartoon - then change as needed.
-    display_type = 'cartoon'
-    if stored.polymer_count > 50:
-        display_type = 'ribbon'
-    elif segment_id in stored.ca_p_only_segments:
-        logging.debug('set ribbon trace on')
-        cmd.set('ribbon_trace_atoms', 1)
-        display_type = 'ribbon'
-    elif 'polypeptide' in molecule_type and length < 20:
-        display_type = 'sticks'
-    elif 'nucleotide' in molecule_type and length < 3:
-        display_type = 'sticks'
-    elif 'saccharide' in molecule_type:
-        display_type = 'sticks'
-
-    # logging.debug(
-    #     'segment_id: %s, molecule_type: %s, length: %s, display_type: %s' %
-    #     (segment_id, molecule_type, length, display_type))
-    return display_type
-
+class AnalysisContext(object):
+    """Data of one analysis of a PDB entry.
 
-class Sequences(object):
-    """Polymer sequences."""
+    Each analysis has its own context, so several entries can be analyzed at
+    the same time, e.g. in threads, without affecting each other.
 
-    Residue = namedtuple('Residue',
-                         'chain_id pdb_num pdb_residue_num is_observed')
-    Range = namedtuple('Range', 'chain_id start_residue_num end_residue_num')
+    Attributes:
+        pdbid: PDB entry ID.
+        molecules: Molecule data from PdbApi.get_molecules().
+        sequences: Sequences of the entry's polymers.
+        polymer_count: Number of polymer molecules of the entry.
+        atom_count: Estimated number of polymer atoms of the entry.
+        ca_p_only_segments: IDs of the segments which only have CA and/or P
+            atom positions.
+        detail_level: Level of detail (see LevelOfDetail) of the entry's
+            polymers, once chosen.
+    """
 
-    # TODO(r2r): For refactoring purposes temporarily moved stored.sequences
-    # into a Sequences class-level object. This should really be instance-level.
-    _sequences = {}  # get_sequences() reformatted by Sequences()._build()
-    """Stores polymer sequence data.
+    _contexts = weakref.WeakSet()  # contexts in use, for memory accounting
+    # The analysis drops its contexts when done; the last one is kept for
+    # reporting its memory afterwards (see get_memory_report).
+    _last = None
 
-    Format:
-      <sequences> = dict(<segment_id>: <residues>)
-        <residues> = dict(<residue_num>: <residue>)
-          <residue_num> = sequential numeric residue id within this sequence
-          <residue> = namedtuple
-            chain_id: PyMOL chain name
-            pdb_num: PDB residue number (excluding insertion codes)
-            pdb_residue_num: PyMOL residue number (including insertion codes),
-                             i.e. 'resi' in selections
-            is_observed: bool TODO(r2r): exact meaning unclear
+    def __init__(self, pdbid):
+        self.pdbid = pdbid
+        self.molecules = {}
+        self.sequences = None
+        self.polymer_count = 0
+        self.atom_count = 0
+        self.ca_p_only_segments = set()
+        self.detail_level = None
+        self._contexts.add(self)
+        AnalysisContext._last = self
+
+
+class LevelOfDetail(object):
+    """Chooses polymer representations which keep the scene interactive.
+
+    The geometry of the scene is estimated from the atoms shown in each
+    representation times the geometry per atom of the representation (COSTS).
+    Polymers are shown at the most detailed level of LEVELS whose geometry,
+    added to that of the enabled objects, stays within budget. If redrawing
+    the scene still takes longer than max_redraw_time, adapt() steps the
+    detail of the objects created by the plugin down, and later polymers start
+    at that level until recover() finds redrawing fast again.
+
+    Redraw times are only measured in PyMOL's GUI thread, which does the
+    redrawing; timed from another thread, they would include how long the GUI
+    takes to get around to it. Analyses running in the background leave the
+    measurement to update(), which the GUI calls from its timer.
     """
 
-    def __init__(self, pdbid):
-        self._pdbid = pdbid
-        if not self._sequences:
-            self._build()
+    # Polymer representations from most to least detailed. 'trace' is a
+    # ribbon drawn straight from one CA/P atom to the next.
+    LEVELS = ('cartoon', 'ribbon', 'trace')
+    # Rough number of triangles or lines drawn per atom by default.
+    COSTS = {
+        'cartoon': 16.0,
+        'sticks': 16.0,
+        'spheres': 2.0,  # drawn as impostors
+        'ribbon': 1.0,
+        'lines': 1.0,
+        'trace': 0.125,
+    }
+    # Display types drawn as a representation with object settings.
+    DISPLAY_TYPES = {
+        'trace': ('ribbon', dict(ribbon_sampling=1)),
+        # Polymers with only CA and/or P atom positions.
+        'ca_p_ribbon': ('ribbon', dict(ribbon_trace_atoms=1)),
+    }
+    # Atoms per residue, for estimates from the PDB API data.
+    ATOMS_PER_RESIDUE = 8
+    # Set from preferences PDB_PLUGIN_GEOMETRY_BUDGET and
+    # PDB_PLUGIN_MAX_REDRAW_TIME by initialize().
+    budget = 2000000
+    max_redraw_time = 0.1  # seconds; 0 turns adapt() off
+    redraw_samples = 3  # the fastest one counts
+    # Share of max_redraw_time below which redrawing is fast enough for
+    # later polymers to start at full detail again.
+    recovery_share = 0.25
+    # PyMOL loads plugins in its GUI thread.
+    _gui_thread = threading.current_thread()
+
+    def __init__(self):
+        self.level = 0  # most detailed level allowed by redraw times
+        self._object_names = set()  # objects whose detail may be changed
+        self._lock = threading.Lock()  # guards level and _object_names
+        self._measure_requested = threading.Event()  # see update()
 
     @classmethod
-    def clear(cls):
-        cls._sequences = {}
+    def get_scene_cost(cls):
+        """Returns the estimated geometry of the enabled objects."""
+        # A trace is counted as the ribbon it is drawn as.
+        return sum(cost * cmd.count_atoms('enabled and rep %s' % rep)
+                   for rep, cost in cls.COSTS.items()
+                   if rep != 'trace')
+
+    @staticmethod
+    def get_drawn_atoms(name):
+        """Returns the number of atoms drawn for object name."""
+        # Only the current state is drawn, unless all_states is on.
+        atom_count = cmd.count_atoms(name)
+        if cmd.get_setting_boolean('all_states', name):
+            atom_count *= cmd.count_states(name)
+        return atom_count
+
+    def get_level(self, atom_count):
+        """Returns the level to show atom_count more polymer atoms at."""
+        scene_cost = self.get_scene_cost()
+        for level in range(self.level, len(self.LEVELS) - 1):
+            cost = atom_count * self.COSTS[self.LEVELS[level]]
+            if scene_cost + cost <= self.budget:
+                return level
+        return len(self.LEVELS) - 1
+
+    def get_representation(self, atom_count):
+        """Returns the representation to show atom_count polymer atoms in."""
+        return self.LEVELS[self.get_level(atom_count)]
+
+    @staticmethod
+    def show(display_type, selection):
+        """Shows a representation or one of DISPLAY_TYPES for selection.
+
+        The settings of a display type only apply to the objects of selection.
+        """
+        representation, settings = LevelOfDetail.DISPLAY_TYPES.get(
+            display_type, (display_type, {}))
+        cmd.show(representation, selection)
+        if not settings:
+            return
+        for name in cmd.get_object_list('(%s)' % selection):
+            for setting, value in settings.items():
+                cmd.set(setting, value, name)
+
+    def measure_redraw(self):
+        """Returns the time redrawing the scene takes in seconds."""
+        # The first redraw may include building the geometry.
+        times = []
+        for _ in range(self.redraw_samples):
+            start = time.time()
+            self._redraw()
+            times.append(time.time() - start)
+        return min(times)
+
+    @staticmethod
+    def _redraw():
+        cmd.refresh()
+        cmd.sync()
+
+    def _can_measure(self):
+        """True if redraw times can be measured in this thread.
+
+        Otherwise the measurement is left to the next update().
+        """
+        if threading.current_thread() is self._gui_thread:
+            return True
+        self._measure_requested.set()
+        return False
+
+    def track(self, object_names):
+        """Lets adapt() change the detail of the objects object_names."""
+        with self._lock:
+            self._object_names.update(object_names)
+
+    def recover(self):
+        """Lets later polymers start at full detail if redrawing is fast.
+
+        Returns the level of detail of the scene.
+        """
+        level = self.level
+        if level and self.max_redraw_time and self._can_measure():
+            redraw_time = self.measure_redraw()
+            if redraw_time <= self.max_redraw_time * self.recovery_share:
+                with self._lock:
+                    self.level = 0
+                logging.info('Redrawing took %.3f s; showing polymers as %s' %
+                             (redraw_time, self.LEVELS[0]))
+        return self.level
+
+    def adapt(self):
+        """Steps the detail of the scene down while redrawing is too slow.
+
+        Only the objects passed to track() are changed. Polymers shown in more
+        detail than the level of the scene, e.g. by replayed analysis plans,
+        are shown at that level first.
+
+        Returns the level of detail of the scene.
+        """
+        while True:
+            level = self.level
+            with _api_lock():
+                with self._lock:
+                    # Deleted objects may be replaced by the user's own.
+                    self._object_names.intersection_update(
+                        cmd.get_names('objects'))
+                    object_names = sorted(self._object_names)
+                for step_level in range(1, level + 1):
+                    self._step_down(step_level, object_names)
+            if (not self.max_redraw_time or level == len(self.LEVELS) - 1 or
+                    not self._can_measure()):
+                return level
+            redraw_time = self.measure_redraw()
+            if redraw_time <= self.max_redraw_time:
+                return level
+            with self._lock:
+                # Another analysis may have stepped down meanwhile.
+                if self.level == level:
+                    self.level += 1
+            logging.info('Redrawing took %.3f s; showing polymers as %s' %
+                         (redraw_time, self.LEVELS[self.level]))
+
+    def update(self):
+        """Measures redrawing for the analyses run outside the GUI thread.
+
+        Called regularly in the GUI thread; does nothing unless recover() or
+        adapt() asked for a measurement.
+        """
+        if not self._measure_requested.is_set():
+            return
+        self._measure_requested.clear()
+        self.recover()
+        self.adapt()
+
+    def _step_down(self, level, object_names):
+        """Shows polymers of object_names at level instead of the previous."""
+        if not object_names:
+            return
+        previous = self.LEVELS[level - 1]
+        representation = self.LEVELS[level]
+        cmd.select('_detail_step',
+                   'rep %s and (%s)' % (previous, ' '.join(object_names)))
+        if representation != 'trace':  # a trace is drawn as a ribbon
+            cmd.hide(previous, '_detail_step')
+        self.show(representation, '_detail_step')
+        cmd.delete('_detail_step')
+
+
+level_of_detail = LevelOfDetail()
+
+
+def get_polymer_display_type(context, segment_id, molecule_type, length):
+    """Returns display type depending on molecule complexity."""
+    if segment_id in context.ca_p_only_segments:
+        display_type = 'ca_p_ribbon'
+    elif 'polypeptide' in molecule_type and length < 20:
+        display_type = 'sticks'
+    elif 'nucleotide' in molecule_type and length < 3:
+        display_type = 'sticks'
+    elif 'saccharide' in molecule_type:
+        display_type = 'sticks'
+    else:
+        # Other polymers get the most detailed representation the geometry
+        # budget allows for the whole entry.
+        if context.detail_level is None:
+            context.detail_level = level_of_detail.get_level(
+                context.atom_count)
+        display_type = LevelOfDetail.LEVELS[context.detail_level]
+
+    # logging.debug(
+    #     'segment_id: %s, molecule_type: %s, length: %s, display_type: %s' %
+    #     (segment_id, molecule_type, length, display_type))
+    return display_type
+
+
+class Sequences(object):
+    """Polymer sequences."""
+
+    Residue = namedtuple('Residue',
+                         'chain_id pdb_num pdb_residue_num is_observed')
+    Range = namedtuple('Range', 'chain_id start_residue_num end_residue_num')
+
+    def __init__(self, pdbid):
+        self._pdbid = pdbid
+        # get_sequences() reformatted by _build().
+        #
+        # Format:
+        #   <sequences> = dict(<segment_id>: <residues>)
+        #     <residues> = dict(<residue_num>: <residue>)
+        #       <residue_num> = sequential numeric residue id within this
+        #                       sequence
+        #       <residue> = namedtuple
+        #         chain_id: PyMOL chain name
+        #         pdb_num: PDB residue number (excluding insertion codes)
+        #         pdb_residue_num: PyMOL residue number (including insertion
+        #                          codes), i.e. 'resi' in selections
+        #         is_observed: bool TODO(r2r): exact meaning unclear
+        self._sequences = {}
+        self._build()
 
     @staticmethod
     def get_pdb_residue_num(pdb_num, pdb_insertion_code):
@@ -513,6 +1875,7 @@ class Sequences(object):
         pdb_residue_num = pdb_residue_num.replace('-', '\\-')
         return pdb_residue_num
 
+    @profiler.timed('sequences')
     def _build(self):
         """Builds a dictionary of sequence residues."""
         data = pdb.get_sequences(self._pdbid)
@@ -597,8 +1960,7 @@ class Sequences(object):
                 return (None, None)
         return (start_residue_num, end_residue_num)
 
-    @classmethod
-    def get_ranges(cls, segment_id, start_residue_num, end_residue_num):
+    def get_ranges(self, segment_id, start_residue_num, end_residue_num):
         """Returns contiguous residue ranges present in the sequence.
 
         Pymol doesn't cope with non-contiguous ranges.
@@ -607,11 +1969,11 @@ class Sequences(object):
         If it jumps then a separate residue range is generated.
         """
         ranges = []
-        if segment_id not in cls._sequences:
+        if segment_id not in self._sequences:
             return ranges
 
-        sequence = cls._sequences[segment_id]
-        start_residue_num, end_residue_num = cls._get_trimmed_range(
+        sequence = self._sequences[segment_id]
+        start_residue_num, end_residue_num = self._get_trimmed_range(
             sequence, start_residue_num, end_residue_num)
         # logging.debug('start_residue_num: %s, end_residue_num: %s' %
         #               (start_residue_num, end_residue_num))
@@ -640,7 +2002,7 @@ class Sequences(object):
             if not range_start_residue:
                 range_start_residue = current_residue
             if next_pdb_num in _EMPTY_PDB_NUM:
-                cls._append_range(range_start_residue, current_residue, ranges)
+                self._append_range(range_start_residue, current_residue, ranges)
                 range_start_residue = None
                 continue
 
@@ -648,12 +2010,12 @@ class Sequences(object):
             if pdb_num_jump > 1 or pdb_num_jump < 0:
                 # logging.debug('numbering not contiguous, jump %d - '
                 #               'store as range' % pdb_num_jump)
-                cls._append_range(range_start_residue, current_residue, ranges)
+                self._append_range(range_start_residue, current_residue, ranges)
                 range_start_residue = None
 
         # Append the last open range (if any) until end of residues of interst.
-        cls._append_range(range_start_residue, sequence[end_residue_num],
-                          ranges)
+        self._append_range(range_start_residue, sequence[end_residue_num],
+                           ranges)
         # logging.debug(ranges)
 
         return ranges
@@ -689,6 +2051,7 @@ class Validation(object):
             self._ramachandran_data = pdb.get_ramachandran_validation(
                 self._pdbid)
 
+    @profiler.timed('validation show')
     def show(self):
         if self._val_data:
             logging.debug('There is validation for this entry')
@@ -768,15 +2131,17 @@ class Validation(object):
                         rng)
                     selections.append(selection)
 
-                display_type = get_polymer_display_type(segment_id,
+                display_type = get_polymer_display_type(self._molecules.context,
+                                                        segment_id,
                                                         'polypeptide', length)
                 pymol_selection = ' or '.join(['(%s)' % x for x in selections])
-                cmd.show(display_type, pymol_selection)
+                LevelOfDetail.show(display_type, pymol_selection)
 
-        self._clear_outlier_tally()
-        self._check_geometric_validation_outliers()
-        self._check_ramachandran_validation_outliers()
-        self._display_outlier_tally()
+        with profiler.phase('validation tally'):
+            self._clear_outlier_tally()
+            self._check_geometric_validation_outliers()
+            self._check_ramachandran_validation_outliers()
+            self._display_outlier_tally()
         cmd.enable(self._pdbid)
 
     def _clear_outlier_tally(self):
@@ -794,42 +2159,65 @@ class Validation(object):
 
 
 class Molecules(object):
-    """Analyze and visualize molecules."""
+    """Analyze and visualize molecules.
 
-    def __init__(self, pdbid):
+    Args:
+        pdbid: PDB entry ID.
+        context: AnalysisContext of the analysis; a new one by default.
+    """
+
+    def __init__(self, pdbid, context=None):
         self._pdbid = pdbid
-        # Analysis depends on some globally available data; load it.
-        if not stored.molecules:
-            stored.molecules = pdb.get_molecules(pdbid)
+        self._context = context if context is not None else AnalysisContext(
+            pdbid)
+        # Analysis depends on some data of the entry; load it.
+        if not self._context.molecules:
+            self._context.molecules = pdb.get_molecules(pdbid)
         self._process_molecules()
-        self._sequences = Sequences(pdbid)
+        if self._context.sequences is None:
+            self._context.sequences = Sequences(pdbid)
+        self._sequences = self._context.sequences
 
     @property
     def pdbid(self):
         return self._pdbid
 
+    @property
+    def context(self):
+        return self._context
+
     @property
     def sequences(self):
         return self._sequences
 
     @property
     def molecules(self):
-        return stored.molecules.get(self._pdbid, [])
+        return self._context.molecules.get(self._pdbid, [])
+
+    @property
+    def has_nucleotides(self):
+        """True if any molecule of the entry is a nucleic acid polymer."""
+        return any('nucleotide' in molecule['molecule_type']
+                   for molecule in self.molecules)
 
     def _process_molecules(self):
         """Generate derivative data from raw molecules.
 
         * Creates ca_p_only_segments set which contains all segment_ids that
           only have CA and/or P atom positions available in location data.
-        * Creates a global count of polymers in the data.
+        * Counts the polymers and estimates their atoms.
         """
-        for molecule in stored.molecules.get(self._pdbid, []):
+        for molecule in self.molecules:
             # add ca only list
             if molecule['ca_p_only']:
                 for segment_id in molecule['in_struct_asyms']:
-                    stored.ca_p_only_segments.add(segment_id)
+                    self._context.ca_p_only_segments.add(segment_id)
             if molecule['molecule_type'] not in ['Water', 'Bound']:
-                stored.polymer_count += 1
+                self._context.polymer_count += 1
+                atoms = 1 if molecule['ca_p_only'] else (
+                    LevelOfDetail.ATOMS_PER_RESIDUE)
+                self._context.atom_count += (atoms * molecule['length'] *
+                                             len(molecule['in_struct_asyms']))
 
     def _process_molecule(self, molecule):
         """Returns the display type and selection criteria for the molecule."""
@@ -848,7 +2236,8 @@ class Molecules(object):
                 # TODO(r2r): Computing a display_type per segment is rather
                 # useless if we only return a single display_type for the whole
                 # molecule. The display_type of the last segment wins.
-                display_type = get_polymer_display_type(segment_id,
+                display_type = get_polymer_display_type(self._context,
+                                                        segment_id,
                                                         molecule_type, length)
                 # logging.debug(segment_id)
                 ranges = self._sequences.get_ranges(segment_id, 1, length)
@@ -858,11 +2247,12 @@ class Molecules(object):
 
         return display_type, selections
 
+    @profiler.timed('molecules show')
     def show(self):
         logging.debug('Display molecules')
         cmd.set('cartoon_transparency', 0.3, self._pdbid)
         cmd.set('ribbon_transparency', 0.3, self._pdbid)
-        for molecule in stored.molecules.get(self._pdbid, []):
+        for molecule in self.molecules:
             if molecule['molecule_type'] == 'Water':
                 continue  # Don't show water.
 
@@ -882,14 +2272,15 @@ class Molecules(object):
             object_name = object_name[:250]
             # logging.debug(object_name)
 
-            display_type, selections = self._process_molecule(molecule)
-
-            pymol_selection = ' or '.join(['(%s)' % x for x in selections])
+            with profiler.phase('selection building'):
+                display_type, selections = self._process_molecule(molecule)
+                pymol_selection = ' or '.join(['(%s)' % x for x in selections])
             logging.debug(pymol_selection)
-            cmd.select('temp_select', pymol_selection)
-            cmd.create(object_name, 'temp_select')
+            with profiler.phase('create objects'):
+                cmd.select('temp_select', pymol_selection)
+                cmd.create(object_name, 'temp_select')
             # logging.debug(display_type)
-            cmd.show(display_type, object_name)
+            LevelOfDetail.show(display_type, object_name)
 
             # Color by molecule.
             Presentation.set_object_color(int(molecule['entity_id']),
@@ -898,29 +2289,408 @@ class Molecules(object):
         cmd.delete('temp_select')
 
 
+class Assemblies(object):
+    """Generates the assemblies of an entry from its already loaded object.
+
+    The assembly generators (pdbx_struct_assembly_gen) and symmetry operators
+    (pdbx_struct_oper_list) are read from the mmCIF data PyMOL keeps in memory
+    for the loaded object (see cif_keepinmemory). Each symmetry copy is then
+    created from the loaded object and its coordinates transformed in place,
+    without reading or parsing the mmCIF file again.
+
+    The copies made by one operator go into their own object state, matching
+    what PyMOL produces when loading a file with the 'assembly' setting.
+
+    Assemblies are only built as long as all built assemblies together stay
+    within atom_budget (atoms times states). Others get a small, disabled
+    placeholder object instead and are built when the placeholder is enabled
+    (see update()), unless they alone exceed the budget. Built assemblies which
+    are not enabled are dropped again, least recently enabled first, to make
+    room.
+
+    The registries of assembly objects are shared by the analyses running in
+    the background and the GUI's assembly watcher. They are only used while
+    holding _lock, which is taken after PyMOL's API lock wherever PyMOL
+    commands are issued with it held.
+    """
+
+    # Maximum total number of atom coordinates in built assemblies.
+    # Set from preference PDB_PLUGIN_ASSEMBLY_ATOM_BUDGET by initialize().
+    atom_budget = 5000000
+    # Registries of assembly objects across all entries:
+    # assembly_name -> (Assemblies, assembly_id, size)
+    _placeholders = {}
+    _built = OrderedDict()  # in order of least recently enabled first
+    # Assembly data of entries restored from snapshots, whose objects have no
+    # mmCIF data in PyMOL: pdbid -> (assembly_ids, generators, operators)
+    _restored = {}
+    _lock = threading.RLock()  # guards the registries above
+
+    def __init__(self, pdbid):
+        self._pdbid = pdbid
+        self._generators = {}  # assembly_id -> list((asym_ids, oper_expr))
+        self._operators = {}  # oper_id -> 4x4 homogenous matrix as list(16)
+        self._read_cif_data()
+        with self._lock:
+            restored = self._restored.get(pdbid)
+        if not self._generators and restored:
+            _, self._generators, self._operators = restored
+
+    def get_ids(self):
+        """Returns the list of assembly IDs of the entry."""
+        if BinaryCif.get(self._pdbid):
+            # Objects loaded from BinaryCIF may have no mmCIF data in PyMOL.
+            assembly_ids = self._get_cif_array('_pdbx_struct_assembly.id')
+        else:
+            assembly_ids = cmd.get_assembly_ids(self._pdbid)  # list or None
+        if not assembly_ids:
+            with self._lock:
+                restored = self._restored.get(self._pdbid)
+            if restored:
+                assembly_ids = restored[0]
+        return assembly_ids or []
+
+    def get_snapshot(self):
+        """Returns the assembly data and objects of the entry as plain data."""
+        objects = {}  # assembly_name -> (assembly_id, size, is_built)
+        with self._lock:
+            for registry in (self._placeholders, self._built):
+                for assembly_name, (assemblies, assembly_id,
+                                    size) in registry.items():
+                    if assemblies._pdbid == self._pdbid:
+                        objects[assembly_name] = (assembly_id, size, registry
+                                                  is self._built)
+        return {
+            'ids': list(self.get_ids()),
+            'generators': self._generators,
+            'operators': self._operators,
+            'objects': objects,
+        }
+
+    @classmethod
+    def restore_snapshot(cls, pdbid, snapshot):
+        """Registers the assemblies of an entry restored from a snapshot.
+
+        Assemblies which were built are built again (see _save_snapshot).
+        """
+        with cls._lock:
+            cls._restored[pdbid] = (snapshot['ids'], snapshot['generators'],
+                                    snapshot['operators'])
+        assemblies = cls(pdbid)
+        rebuild = []
+        with cls._lock:
+            for assembly_name, (assembly_id, size,
+                                is_built) in snapshot['objects'].items():
+                if is_built:
+                    rebuild.append((assembly_id, assembly_name))
+                else:
+                    cls._placeholders[assembly_name] = (assemblies,
+                                                        assembly_id, size)
+            watch = bool(cls._placeholders)
+        if watch:
+            _start_assembly_watcher()
+        for assembly_id, assembly_name in sorted(rebuild):
+            if not assemblies.show(assembly_id, assembly_name):
+                logging.warning('Failed to build assembly %s' % assembly_name)
+
+    @property
+    def has_operators(self):
+        """True if assemblies can be generated from the in-memory data."""
+        return bool(self._generators and self._operators)
+
+    def _get_cif_array(self, key, dtype='s'):
+        """Returns a data item column of the object's mmCIF data or None."""
+        binary_cif = BinaryCif.get(self._pdbid)
+        if binary_cif:
+            # Object was loaded from BinaryCIF.
+            return binary_cif.get_array(key, dtype)
+        try:
+            # Not available as cmd.cif_get_array in all PyMOL versions.
+            cif_get_array = importlib.import_module(
+                'pymol.querying').cif_get_array
+            return cif_get_array(self._pdbid, key, dtype)
+        except Exception:
+            logging.debug('pymol version does not support cif_get_array')
+            return None
+
+    def _read_cif_data(self):
+        """Reads assembly generators and operators from the mmCIF data."""
+        gen = '_pdbx_struct_assembly_gen.'
+        assembly_ids = self._get_cif_array(gen + 'assembly_id')
+        oper_exprs = self._get_cif_array(gen + 'oper_expression')
+        asym_id_lists = self._get_cif_array(gen + 'asym_id_list')
+        if not (assembly_ids and oper_exprs and asym_id_lists):
+            return
+        for assembly_id, oper_expr, asym_id_list in zip(assembly_ids,
+                                                        oper_exprs,
+                                                        asym_id_lists):
+            asym_ids = [x.strip() for x in asym_id_list.split(',')]
+            self._generators.setdefault(assembly_id, []).append(
+                (asym_ids, oper_expr))
+
+        oper = '_pdbx_struct_oper_list.'
+        oper_ids = self._get_cif_array(oper + 'id')
+        if not oper_ids:
+            return
+        columns = []
+        for i in range(1, 4):
+            for j in range(1, 4):
+                columns.append(
+                    self._get_cif_array(oper + 'matrix[%d][%d]' % (i, j), 'f'))
+            columns.append(self._get_cif_array(oper + 'vector[%d]' % i, 'f'))
+        if not all(columns):
+            return
+        for row, oper_id in enumerate(oper_ids):
+            matrix = [column[row] for column in columns]
+            self._operators[oper_id] = matrix + [0.0, 0.0, 0.0, 1.0]
+
+    @staticmethod
+    def _parse_oper_expression(oper_expr):
+        """Returns the list of operator ID tuples of an operator expression.
+
+        E.g. '(1-3)' -> [('1',), ('2',), ('3',)], and
+        '(X0)(1,2)' -> [('X0', '1'), ('X0', '2')].
+        """
+        groups = re.findall(r'\(([^)]*)\)', oper_expr)
+        if not groups:
+            groups = [oper_expr]
+        products = [()]
+        for group in groups:
+            oper_ids = []
+            for item in group.split(','):
+                item = item.strip()
+                bounds = item.split('-')
+                if (len(bounds) == 2 and bounds[0].isdigit() and
+                        bounds[1].isdigit()):
+                    oper_ids.extend(
+                        str(i) for i in range(int(bounds[0]),
+                                              int(bounds[1]) + 1))
+                elif item:
+                    oper_ids.append(item)
+            products = [
+                p + (oper_id,) for p in products for oper_id in oper_ids
+            ]
+        return products
+
+    @staticmethod
+    def _multiply(a, b):
+        """Returns the product of two 4x4 matrices given as list(16)."""
+        return [
+            sum(a[row * 4 + k] * b[k * 4 + col]
+                for k in range(4))
+            for row in range(4)
+            for col in range(4)
+        ]
+
+    def _get_matrix(self, oper_ids):
+        """Returns the combined matrix of the operators, applied right first."""
+        matrix = self._operators[oper_ids[0]]
+        for oper_id in oper_ids[1:]:
+            matrix = self._multiply(matrix, self._operators[oper_id])
+        return matrix
+
+    def _get_selection(self, asym_ids):
+        return '%s and segi %s' % (self._pdbid, '+'.join(asym_ids))
+
+    def get_size(self, assembly_id):
+        """Returns the number of atom coordinates of the assembly."""
+        size = 0
+        for asym_ids, oper_expr in self._generators.get(assembly_id, []):
+            num_copies = len(self._parse_oper_expression(oper_expr))
+            size += cmd.count_atoms(self._get_selection(asym_ids)) * num_copies
+        return size
+
+    @classmethod
+    def _get_built_size(cls):
+        return sum(size for _, _, size in cls._built.values())
+
+    def show(self, assembly_id, assembly_name):
+        """Builds the assembly, or a placeholder if it exceeds the budget.
+
+        Returns False if the assembly can't be generated from in-memory data.
+        """
+        if assembly_id not in self._generators or not self._operators:
+            return False
+        size = self.get_size(assembly_id)
+        with _api_lock(), self._lock:
+            self._prune()
+            if self._get_built_size() + size > self.atom_budget:
+                logging.info('Assembly %s exceeds atom budget; enable %s to '
+                             'build it.' % (assembly_id, assembly_name))
+                self._make_placeholder(assembly_id, assembly_name, size)
+                return True
+            if not self.build(assembly_id, assembly_name):
+                return False
+            self._placeholders.pop(assembly_name, None)
+            self._built[assembly_name] = (self, assembly_id, size)
+        return True
+
+    def _make_placeholder(self, assembly_id, assembly_name, size):
+        """Replaces assembly_name with a disabled single atom object."""
+        cmd.delete(assembly_name)
+        cmd.pseudoatom(assembly_name,
+                       selection=self._pdbid,
+                       label='assembly %s (enable to build)' % assembly_id)
+        cmd.disable(assembly_name)
+        self._built.pop(assembly_name, None)
+        self._placeholders[assembly_name] = (self, assembly_id, size)
+        _start_assembly_watcher()
+
+    @classmethod
+    def _prune(cls):
+        """Forgets about assembly objects that were deleted in the meantime."""
+        object_names = set(cmd.get_names('objects'))
+        for registry in (cls._placeholders, cls._built):
+            for assembly_name in list(registry.keys()):
+                if assembly_name not in object_names:
+                    del registry[assembly_name]
+
+    @classmethod
+    def _make_room(cls, size, enabled_names):
+        """Drops idle assemblies until size more atoms fit into the budget."""
+        for idle_name in list(cls._built.keys()):
+            if cls._get_built_size() + size <= cls.atom_budget:
+                break
+            if idle_name not in enabled_names:
+                idle_assemblies, idle_id, idle_size = cls._built[idle_name]
+                logging.info('Dropping idle assembly %s' % idle_name)
+                idle_assemblies._make_placeholder(idle_id, idle_name, idle_size)
+
+    @classmethod
+    def update(cls):
+        """Builds enabled placeholders and drops idle assemblies over budget.
+
+        This is polled by the GUI but can be called any time.
+        """
+        if not cls._placeholders and not cls._built:
+            return
+        with _api_lock(), cls._lock:
+            cls._prune()
+            enabled_names = set(cmd.get_names('objects', enabled_only=1))
+
+            # Mark enabled assemblies as most recently used.
+            for assembly_name in list(cls._built.keys()):
+                if assembly_name in enabled_names:
+                    cls._built[assembly_name] = cls._built.pop(assembly_name)
+
+            for assembly_name in list(cls._placeholders.keys()):
+                if assembly_name in enabled_names:
+                    cls._build_placeholder(assembly_name, enabled_names)
+
+    @classmethod
+    def _build_placeholder(cls, assembly_name, enabled_names):
+        """Builds the assembly of an enabled placeholder if it can be."""
+        assemblies, assembly_id, size = cls._placeholders[assembly_name]
+        if size > cls.atom_budget:
+            logging.warning('Assembly %s has %d atom coordinates, more than '
+                            'the PDB_PLUGIN_ASSEMBLY_ATOM_BUDGET of %d.' %
+                            (assembly_name, size, cls.atom_budget))
+            cmd.disable(assembly_name)
+            return
+        cls._make_room(size, enabled_names)
+        logging.info('Building assembly %s' % assembly_name)
+        if assemblies.build(assembly_id, assembly_name):
+            del cls._placeholders[assembly_name]
+            cls._built[assembly_name] = (assemblies, assembly_id, size)
+        else:
+            logging.warning('Failed to build assembly %s' % assembly_name)
+            assemblies._make_placeholder(assembly_id, assembly_name, size)
+
+    @profiler.timed('assembly build')
+    def build(self, assembly_id, assembly_name):
+        """Creates object assembly_name for the assembly.
+
+        Returns False if the assembly can't be generated from in-memory data.
+        """
+        generators = self._generators.get(assembly_id)
+        if not generators:
+            return False
+        cmd.delete(assembly_name)  # e.g. placeholder
+        # Only the first model of multi-model entries (e.g. NMR) is used.
+        # Otherwise all states are copied which also keeps atoms that have no
+        # coordinates, just like PyMOL's own assemblies do.
+        source_state = 1 if cmd.count_states(self._pdbid) > 1 else 0
+        parts = []
+        try:
+            for i, (asym_ids, oper_expr) in enumerate(generators):
+                part_name = (assembly_name if len(generators) == 1 else
+                             '%s_part%d' % (assembly_name, i))
+                selection = self._get_selection(asym_ids)
+                oper_products = self._parse_oper_expression(oper_expr)
+                # Copy the asymmetric unit once, then replicate its
+                # coordinates into one state per operator and transform them.
+                # Keep the object disabled meanwhile to avoid building
+                # representations for intermediate states.
+                cmd.create(part_name, selection, source_state, source_state)
+                cmd.disable(part_name)
+                coords = cmd.get_coords(part_name, 1)
+                for state, oper_ids in enumerate(oper_products, 1):
+                    if state > 1:
+                        cmd.load_coordset(coords, part_name, state)
+                    cmd.transform_object(part_name,
+                                         self._get_matrix(oper_ids),
+                                         state=state,
+                                         homogenous=1)
+                parts.append(part_name)
+        except Exception as e:
+            logging.debug('can\'t generate assembly in memory: %s' % e)
+            for part_name in parts:
+                cmd.delete(part_name)
+            return False
+        if len(parts) > 1:
+            cmd.create(assembly_name, ' or '.join(parts), 0, 0)
+            for part_name in parts:
+                cmd.delete(part_name)
+        # The copies inherit the source object's (usually hidden)
+        # representations; show them like a freshly loaded assembly.
+        cmd.hide('everything', assembly_name)
+        # They also inherit the entry's current colors (e.g. domains or
+        # validation); color them like a freshly loaded assembly instead.
+        pymol.util.cbc(assembly_name, quiet=1)
+        pymol.util.cnc(assembly_name, quiet=1)
+        atom_count = LevelOfDetail.get_drawn_atoms(assembly_name)
+        LevelOfDetail.show(level_of_detail.get_representation(atom_count),
+                           assembly_name)
+        level_of_detail.track([assembly_name])
+        cmd.show('sticks', '%s and organic' % assembly_name)
+        cmd.enable(assembly_name)
+        return True
+
+
+@profiler.timed('assemblies')
 def show_assemblies(pdbid, mm_cif_file):
-    """iterate through the assemblies and output images"""
+    """Shows the assemblies of the entry as separate objects.
+
+    Images of them are rendered with PDB_Render_Images.
+    """
     logging.info('Generating assemblies')
     # cmd.hide('everything')
     Presentation.set_transparency('all', 0.0)
 
     try:
-        assemblies = cmd.get_assembly_ids(pdbid)  # list or None
-        assemblies = assemblies if assemblies else []
+        builder = Assemblies(pdbid)
+        assemblies = builder.get_ids()
         logging.debug(assemblies)
         for assembly_id in assemblies:
             logging.debug('Assembly: %s' % assembly_id)
             assembly_name = pdbid + '_assem_' + assembly_id
             logging.debug(assembly_name)
-            cmd.set('assembly', assembly_id)
-            cmd.load(mm_cif_file, assembly_name, format='cif')
+            if not builder.show(assembly_id, assembly_name):
+                # Fall back to having PyMOL generate it from the file.
+                cmd.delete(assembly_name)
+                cmd.set('assembly', assembly_id)
+                cmd.load(mm_cif_file, assembly_name, format='cif')
             logging.debug('finished Assembly: %s' % assembly_id)
     except Exception:
         logging.debug('pymol version does not support assemblies')
 
 
 class Domains(object):
-    """Analyze and visualize domains."""
+    """Analyze and visualize domains.
+
+    Domain mappings are fetched and domain objects are created lazily, one
+    domain type at a time, only for the domain types that are asked for.
+    """
     _SEGMENT_ID_NAME = {
         # domain_type -> segment_id key string
         'CATH': 'domain',
@@ -928,54 +2698,127 @@ class Domains(object):
         'Pfam': '',
         'Rfam': ''
     }
+    # Domain types in display order.
+    DOMAIN_TYPES = ('Pfam', 'Rfam', 'SCOP', 'CATH')
+    # Domain types served by the nucleic_mappings API; all others are served
+    # by the (protein) mappings API.
+    _NUCLEIC_DOMAIN_TYPES = frozenset(['Rfam'])
     Segment = namedtuple('Segment', 'entity_id chain_id segment_id start end')
 
     def __init__(self, molecules):
         self._molecules = molecules
         self._pdbid = molecules.pdbid
+        self._domain_data = {}  # is_nucleic -> domain data from PDB API
+        self._mapped_domains = {}  # domain_type -> <typed_domain>
+        self._shown_domain_types = set()
+
+    @classmethod
+    def parse_domain_types(cls, domain_types=None):
+        """Returns the list of known domain types named in domain_types.
+
+        Args:
+            domain_types: None, a list of domain type names, or a string of
+                comma or space separated domain type names. Names are matched
+                case-insensitively. None or empty selects all domain types.
+        """
+        if not domain_types:
+            return list(cls.DOMAIN_TYPES)
+        if not isinstance(domain_types, (list, tuple, set, frozenset)):
+            domain_types = re.split(r'[\s,]+', str(domain_types).strip())
+        known_types = dict((t.lower(), t) for t in cls.DOMAIN_TYPES)
+        result = []
+        for domain_type in domain_types:
+            if not domain_type:
+                continue
+            try:
+                domain_type = known_types[domain_type.lower()]
+            except KeyError:
+                logging.warning('Unknown domain type "%s"; known types: %s' %
+                                (domain_type, ', '.join(cls.DOMAIN_TYPES)))
+                continue
+            if domain_type not in result:
+                result.append(domain_type)
+        return result
 
-    def _map_all(self):
-        """Make all domains."""
+    def _get_domain_data(self, is_nucleic):
+        """Returns domain data from the PDB API, fetching it on first use."""
+        if is_nucleic not in self._domain_data:
+            if is_nucleic and not self._molecules.has_nucleotides:
+                logging.debug('no nucleotides; skipping nucleic domains')
+                data = {}
+            elif is_nucleic:
+                data = pdb.get_nucleic_domains(self._pdbid)
+            else:
+                data = pdb.get_protein_domains(self._pdbid)
+            self._domain_data[is_nucleic] = data
+        return self._domain_data[is_nucleic]
+
+    @profiler.timed('domains fetch')
+    def prefetch(self, domain_types=None):
+        """Fetches the domain mappings needed to show domain_types."""
+        for domain_type in self.parse_domain_types(domain_types):
+            self._get_domain_data(domain_type in self._NUCLEIC_DOMAIN_TYPES)
+
+    @profiler.timed('domain mapping')
+    def _map_all(self, domain_types):
+        """Make all domains of the given domain types."""
         # mapped_domains = dict(<domain_type>: <typed_domain>)
         # <typed_domain> = dict(<domain_id>: <named_domain>)
         # <named_domain> = dict(<domain_name>: list(Segment)
         mapped_domains = {}
-
-        self._map_domains(pdb.get_protein_domains(self._pdbid), mapped_domains)
-        self._map_domains(pdb.get_nucleic_domains(self._pdbid), mapped_domains)
+        for domain_type in domain_types:
+            if domain_type not in self._mapped_domains:
+                is_nucleic = domain_type in self._NUCLEIC_DOMAIN_TYPES
+                self._mapped_domains[domain_type] = self._map_domains(
+                    self._get_domain_data(is_nucleic), domain_type)
+            if self._mapped_domains[domain_type]:
+                mapped_domains[domain_type] = self._mapped_domains[domain_type]
         return mapped_domains
 
-    def _map_domains(self, domains, mapped_domains):
+    def _map_domains(self, domains, domain_type):
+        """Returns the <typed_domain> mapping of domain_type."""
+        typed_domain = {}
         if not domains:
             logging.debug('no domain information for this entry')
-            return
-        for domain_type in domains[self._pdbid]:
-            try:
-                segment_id_name = self._SEGMENT_ID_NAME[domain_type]
-            except Exception:
-                # Ignore all domain types not in _SEGMENT_ID_NAME.
-                continue
-            for domain_id, domain in domains[self._pdbid][domain_type].items():
-                # logging.debug(domain_type)
-                # logging.debug(domain_id)
-                for mapping in domain.get('mappings', []):
-                    domain_name = str(mapping.get(segment_id_name, ''))
-                    start_residue_num = mapping['start']['residue_number']
-                    end_residue_num = mapping['end']['residue_number']
-                    chain_id = mapping['chain_id']
-                    entity_id = mapping['entity_id']
-                    segment_id = mapping['struct_asym_id']
-                    ranges = self._molecules.sequences.get_ranges(
-                        segment_id, start_residue_num, end_residue_num)
-                    for rng in ranges:
-                        mapped_domains.setdefault(domain_type, {}).setdefault(
-                            domain_id, {}).setdefault(domain_name, []).append(
-                                self.Segment(entity_id, chain_id, segment_id,
-                                             rng.start_residue_num,
-                                             rng.end_residue_num))
+            return typed_domain
+        segment_id_name = self._SEGMENT_ID_NAME[domain_type]
+        typed_domains = domains.get(self._pdbid, {}).get(domain_type, {})
+        for domain_id, domain in typed_domains.items():
+            # logging.debug(domain_type)
+            # logging.debug(domain_id)
+            for mapping in domain.get('mappings', []):
+                domain_name = str(mapping.get(segment_id_name, ''))
+                start_residue_num = mapping['start']['residue_number']
+                end_residue_num = mapping['end']['residue_number']
+                chain_id = mapping['chain_id']
+                entity_id = mapping['entity_id']
+                segment_id = mapping['struct_asym_id']
+                ranges = self._molecules.sequences.get_ranges(
+                    segment_id, start_residue_num, end_residue_num)
+                for rng in ranges:
+                    typed_domain.setdefault(domain_id, {}).setdefault(
+                        domain_name, []).append(
+                            self.Segment(entity_id, chain_id, segment_id,
+                                         rng.start_residue_num,
+                                         rng.end_residue_num))
+        return typed_domain
 
-    def show(self):
-        mapped_domains = self._map_all()
+    @profiler.timed('domains show')
+    def show(self, domain_types=None):
+        """Creates objects for domains of the requested domain types.
+
+        Domain types which have already been shown by this instance are not
+        created again.
+
+        Args:
+            domain_types: Domain types to show; see parse_domain_types().
+        """
+        domain_types = [
+            domain_type for domain_type in self.parse_domain_types(domain_types)
+            if domain_type not in self._shown_domain_types
+        ]
+        self._shown_domain_types.update(domain_types)
+        mapped_domains = self._map_all(domain_types)
         if not mapped_domains:
             return
 
@@ -1017,17 +2860,19 @@ class Domains(object):
                     object_name = '%s_%s_%s' % (domain_type, domain_id,
                                                 domain_name)
                     objects.append(Object(object_name, entity_ids, segment_ids))
-                    cmd.select('temp_select', pymol_selection)
-                    cmd.create(object_name, 'temp_select')
+                    with profiler.phase('create objects'):
+                        cmd.select('temp_select', pymol_selection)
+                        cmd.create(object_name, 'temp_select')
 
             # Show all original chains in grey as default background.
             for chain in chains:
                 logging.debug(chain.segment_id)
                 selection = 'chain %s and %s' % (chain.chain_id, self._pdbid)
                 length = molecule_length[chain.entity_id]
-                display_type = get_polymer_display_type(chain.segment_id,
+                display_type = get_polymer_display_type(self._molecules.context,
+                                                        chain.segment_id,
                                                         'polypeptide', length)
-                cmd.show(display_type, selection)
+                LevelOfDetail.show(display_type, selection)
                 cmd.color('grey', selection)
 
             # Show each mapped object in a different color.
@@ -1042,16 +2887,372 @@ class Domains(object):
                 for i, segment_id in enumerate(obj.segment_ids):
                     length = molecule_length[chain.entity_id]
                     display_type = get_polymer_display_type(
-                        segment_id, 'polypeptide', length)
-                    cmd.show(display_type, obj.name)
+                        self._molecules.context, segment_id, 'polypeptide',
+                        length)
+                    LevelOfDetail.show(display_type, obj.name)
                     Presentation.set_object_color(num, obj.name)
                     num += 1
 
             cmd.delete('temp_select')
 
 
+class AnalysisCache(object):
+    """Memoizes the object plans of the analysis steps of PDB entries.
+
+    The plan of a step, e.g. the domains of one domain type, is the list of
+    PyMOL commands that show it: which objects are created from which
+    selections, and with which representations and colors. Plans are keyed by
+    (pdbid, step, revision), so a newer revision of an entry is analyzed
+    again. Repeating a step replays its plan without fetching or analyzing
+    any data, and skips the commands of objects which the plan created and
+    which still exist.
+    """
+    # A planned PyMOL command; owner is the object it creates or changes,
+    # or None if it applies to the entry itself.
+    Command = namedtuple('Command', 'owner name args kwargs')
+    # Commands -> index of their object argument.
+    _OBJECT_ARGUMENT = {'create': 0, 'enable': 0, 'show': 1, 'color': 1}
+
+    def __init__(self, max_plans=100):
+        self.max_plans = max_plans
+        self._plans = OrderedDict()  # (pdbid, step, revision) -> plan
+        self._created = {}  # object name -> (pdbid, revision)
+
+    def clear(self):
+        self._plans.clear()
+        self._created.clear()
+
+    @staticmethod
+    def get_steps(method, domain_types=None):
+        """Returns the analysis steps of method in the order they are shown."""
+        domains = [
+            'domains:' + domain_type
+            for domain_type in Domains.parse_domain_types(domain_types)
+        ]
+        return {
+            'molecules': ['molecules'],
+            'domains': ['molecules'] + domains,
+            'validation': ['validation'],
+            'assemblies': ['assemblies'],
+            'all': ['molecules'] + domains + ['assemblies', 'validation'],
+        }.get(method, [])
+
+    def get_missing(self, pdbid, revision, steps):
+        """Returns the steps which have no plan for the entry yet."""
+        return [
+            step for step in steps
+            if revision is None or (pdbid, step, revision) not in self._plans
+        ]
+
+    def run(self, pdbid, revision, step, show=None):
+        """Shows step of the entry, replaying its plan if there is one.
+
+        Args:
+            pdbid: PDB entry ID.
+            revision: Revision of the entry's data; None disables caching.
+            step: Name of the analysis step; see get_steps().
+            show: Callable showing the step; only called if there is no
+                plan for the step yet.
+        """
+        plan = self._plans.pop((pdbid, step, revision), None)
+        if plan is not None:
+            self._replay(plan, (pdbid, revision))
+        elif revision is None:
+            show()
+            return
+        else:
+            plan = self._record(show)
+        self._add(pdbid, revision, step, plan)
+
+    def get_plans(self, pdbid, revision, steps):
+        """Returns the plans of the entry's steps as plain data.
+
+        Returns:
+            dict(<step>: list(tuple(<owner>, <name>, <args>, <kwargs>)))
+        """
+        plans = {}
+        for step in steps:
+            plan = self._plans.get((pdbid, step, revision))
+            if plan is not None:
+                plans[step] = [tuple(command) for command in plan]
+        return plans
+
+    def add_plans(self, pdbid, revision, plans):
+        """Adds plans returned by get_plans(), e.g. from a snapshot."""
+        for step, plan in plans.items():
+            self._add(pdbid, revision, step,
+                      [self.Command(*command) for command in plan])
+
+    def _add(self, pdbid, revision, step, plan):
+        self._plans[(pdbid, step, revision)] = plan
+        while len(self._plans) > self.max_plans:
+            self._plans.popitem(last=False)
+        for command in plan:
+            if command.owner:
+                self._created[command.owner] = (pdbid, revision)
+
+    @classmethod
+    def _record(cls, show):
+        """Calls show() and returns the plan of the PyMOL commands it issued."""
+        recorder = _CommandRecorder()
+        with cmd.observe(recorder):
+            show()
+        return cls._make_plan(recorder.commands)
+
+    @classmethod
+    def _make_plan(cls, commands):
+        created = set(args[0] for name, args, _ in commands if name == 'create')
+        plan = []
+        for i, (name, args, kwargs) in enumerate(commands):
+            owner = None
+            index = cls._OBJECT_ARGUMENT.get(name)
+            if index is not None and len(args) > index:
+                owner = args[index] if args[index] in created else None
+            elif name == 'select' and i + 1 < len(commands):
+                # Temporary selection an object is created from.
+                next_name, next_args, _ = commands[i + 1]
+                if next_name == 'create' and next_args[1:2] == args[:1]:
+                    owner = next_args[0]
+            plan.append(cls.Command(owner, name, args, kwargs))
+        return plan
+
+    def _replay(self, plan, version):
+        objects = set(cmd.get_names('objects'))
+        done = set(command.owner
+                   for command in plan
+                   if command.owner in objects and
+                   self._created.get(command.owner) == version)
+        logging.debug('replaying plan; %d objects still exist' % len(done))
+        for command in plan:
+            if command.owner not in done:
+                getattr(cmd, command.name)(*command.args, **command.kwargs)
+
+
+analysis_cache = AnalysisCache()
+
+
+@contextlib.contextmanager
+def _api_lock():
+    """Holds PyMOL's API lock, so that the changes made meanwhile are shown
+    all at once rather than redrawn piecemeal."""
+    pymol.cmd.lock(pymol.cmd)
+    try:
+        yield
+    finally:
+        pymol.cmd.unlock(None, pymol.cmd)
+
+
+class _Prefetch(object):
+    """Calls function(*args) in a background thread.
+
+    The thread belongs to the analysis task of the caller, if any, so it
+    stops when the analysis is cancelled. While profiling, function is called
+    right away in the calling thread instead, so that its phases are timed.
+    """
+
+    def __init__(self, function, *args):
+        self._result = None
+        self._error = None
+        self._done = threading.Event()
+        task = AnalysisTask.get_current()
+
+        def run():
+            AnalysisTask._local.task = task
+            try:
+                self._result = function(*args)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._done.set()
+
+        if profiler.timing:
+            run()
+            return
+        thread = threading.Thread(target=run, name='Prefetch')
+        thread.daemon = True
+        thread.start()
+
+    def result(self):
+        """Waits for and returns the result; raises the error of the call."""
+        while not self._done.wait(0.1):
+            AnalysisTask.check_cancelled()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def _prepare_analysis(pdbid, steps):
+    """Fetches the data needed for the analysis steps in the background.
+
+    The structure can be loaded and shown meanwhile; the data of the other
+    steps is fetched as soon as the molecules it builds on are there.
+
+    Returns:
+        dict(<step>: <callable waiting for the data of the step and returning
+                      the callable showing the step>)
+    """
+    shows = {}
+    if not [step for step in steps if step != 'assemblies']:
+        return shows  # Assemblies are built from the structure only.
+    molecules = _Prefetch(Molecules, pdbid)
+
+    def get_molecules_show():
+        with profiler.phase('molecules'):
+            return molecules.result().show
+
+    shows['molecules'] = get_molecules_show
+    domain_types = [
+        step.split(':', 1)[1] for step in steps if step.startswith('domains:')
+    ]
+    if domain_types:
+
+        def prefetch_domains():
+            domains = Domains(molecules.result())
+            domains.prefetch(domain_types)
+            return domains
+
+        prefetch = _Prefetch(prefetch_domains)
+
+        def get_domains_show(domain_type):
+            return functools.partial(prefetch.result().show, [domain_type])
+
+        for domain_type in domain_types:
+            shows['domains:' + domain_type] = functools.partial(
+                get_domains_show, domain_type)
+    if 'validation' in steps:
+        validation = _Prefetch(lambda: Validation(molecules.result()))
+
+        def get_validation_show():
+            with profiler.phase('validation fetch'):
+                return validation.result().show
+
+        shows['validation'] = get_validation_show
+    return shows
+
+
+# Version of the contents of analysis snapshots; increase it whenever they
+# change, so snapshots of other versions of the plugin aren't read.
+_SNAPSHOT_VERSION = 3
+
+
+def _get_snapshot_name(pdbid, method, domain_types=None):
+    """Returns the name the snapshot of an analysis is stored under.
+
+    The name includes the preferences which change how the entry is shown,
+    so that snapshots made with other preferences aren't restored.
+    """
+    names = [method]
+    if method in ('domains', 'all') and domain_types:
+        names.extend(Domains.parse_domain_types(domain_types))
+    preferences = repr(
+        (LevelOfDetail.budget, level_of_detail.level, Assemblies.atom_budget,
+         _get_structure_url(pdbid)[1]))
+    return '%s-v%d-%s.pse' % ('-'.join(names), _SNAPSHOT_VERSION,
+                              hashlib.sha1(
+                                  preferences.encode()).hexdigest()[:8])
+
+
+@profiler.timed('snapshot save')
+def _save_snapshot(pdbid, revision, snapshot_name, steps, object_names):
+    """Stores the analysis objects of the entry with the plugin's own data.
+
+    The objects are stored as a partial PyMOL session, which is restored
+    much faster than the analysis could be repeated. Built assemblies are
+    left out; they are built again from the entry on restore rather than
+    storing all their coordinates.
+    """
+    plans = analysis_cache.get_plans(pdbid, revision, steps)
+    object_names = set(object_names)
+    for plan in plans.values():
+        object_names.update(owner for owner, _, _, _ in plan if owner)
+    try:
+        assemblies = Assemblies(pdbid).get_snapshot()
+        object_names.difference_update(
+            assembly_name
+            for assembly_name, (_, _, is_built) in assemblies['objects'].items()
+            if is_built)
+        snapshot = {
+            'session':
+                cmd.get_session(' '.join(sorted(object_names)),
+                                partial=1,
+                                binary=1),
+            'steps':
+                steps,
+            'plans':
+                plans,
+            'assemblies':
+                assemblies,
+        }
+        contents = pickle.dumps(snapshot, 2)
+    except Exception as e:
+        logging.warning('Failed to make snapshot of %s: %s' % (pdbid, e))
+        return
+    snapshot_cache.store(pdbid, revision, contents, snapshot_name)
+
+
+@profiler.timed('snapshot restore')
+def _restore_snapshot(pdbid, revision, snapshot_name):
+    """Restores the analysis objects of the entry from its snapshot.
+
+    Returns False if there is no usable snapshot.
+    """
+    contents = snapshot_cache.read(pdbid, revision, snapshot_name)
+    if contents is None:
+        return False
+    try:
+        snapshot = pickle.loads(contents)
+    except Exception as e:
+        logging.warning('Removing unreadable snapshot of %s: %s' % (pdbid, e))
+        snapshot_cache.remove(pdbid, revision, snapshot_name)
+        return False
+    try:
+        cmd.set_session(snapshot['session'], partial=1)
+    except Exception as e:
+        logging.warning('Failed to restore snapshot of %s: %s' % (pdbid, e))
+        return False
+    logging.info('Restored %s analysis from snapshot' % pdbid)
+    BinaryCif.discard(pdbid)
+    analysis_cache.add_plans(pdbid, revision, snapshot['plans'])
+    Assemblies.restore_snapshot(pdbid, snapshot['assemblies'])
+    # The steps after the assemblies also showed and colored the rebuilt
+    # assemblies; replay them, which leaves the restored objects alone.
+    steps = snapshot['steps']
+    if 'assemblies' in steps:
+        for step in steps[steps.index('assemblies') + 1:]:
+            if step in snapshot['plans']:
+                analysis_cache.run(pdbid, revision, step)
+    return True
+
+
+def _get_structure_url(pdbid):
+    """Returns (url, format) of the structure file to download from PDBe."""
+    if (StructureDownload.preferred_format == 'bcif' and
+            BinaryCif.is_available()):
+        # Smaller to download and faster to parse than mmCIF.
+        return _UPDATED_BCIF % pdbid, 'bcif'
+    return _UPDATED_FTP % pdbid, 'cif'
+
+
+def _zoom_and_adapt(pdbid, old_object_names):
+    """Zooms to the analyzed entry and adapts the detail of its objects."""
+    cmd.zoom(pdbid, complete=1)
+    level_of_detail.track(
+        [pdbid] +
+        [x for x in cmd.get_names('objects') if x not in old_object_names])
+    level_of_detail.adapt()
+
+
+# Show the entry as soon as it's loaded and each analysis step as soon as its
+# data is ready, rather than everything at the end; set by initialize().
+progressive_rendering = True
+
+
 def PDBe_startup(  # noqa: 901 too complex
-    pdbid, method, mm_cif_file=None, file_path=None):
+        pdbid,
+        method,
+        mm_cif_file=None,
+        file_path=None,
+        domain_types=None):
     if pdbid:
         pdbid = pdbid.lower()
     if mm_cif_file:
@@ -1068,14 +3269,24 @@ def PDBe_startup(  # noqa: 901 too complex
             'version of pymol does not support keeping all cif items')
 
     # check the PDB code actually exists.
-    summary = pdb.get_summary(pdbid)
-
+    _report_progress('fetching summary', 0)
+    with profiler.phase('summary fetch'):
+        summary = pdb.get_summary(pdbid)
+    # Autocompletion need not fetch the summary again. An empty summary may
+    # just mean that the PDB wasn't reachable, so it isn't cached as a miss.
     if summary:
-        # start over fresh
-        clear_analysis_data()
+        title_cache.put(pdbid, TitleCache.get_title(summary, pdbid))
 
+    if summary:
         logging.debug('pdbid: %s' % pdbid)
         mid_pdb = pdbid[1:3]
+        revision = StructureCache.get_revision(summary, pdbid)
+        # Results can't be reused without knowing when they are outdated.
+        version = None if revision == 'unknown' else revision
+        steps = AnalysisCache.get_steps(method, domain_types)
+        snapshot_name = None
+        # The level of detail of the scene is part of the snapshot name.
+        level_of_detail.recover()
 
         obj_list = cmd.get_object_list('all')
         if pdbid not in obj_list:
@@ -1101,27 +3312,66 @@ def PDBe_startup(  # noqa: 901 too complex
                         file_path = _EBI_FTP % (mid_pdb, pdbid)
 
             logging.debug('File to load: %s' % file_path)
-            cmd.load(file_path, pdbid, format='cif')
-        cmd.hide('everything', pdbid)
-        molecules = Molecules(pdbid)
-
-        if method == 'molecules':
-            molecules.show()
-        elif method == 'domains':
-            molecules.show()
-            Domains(molecules).show()
-        elif method == 'validation':
-            Validation(molecules).show()
-        elif method == 'assemblies':
-            show_assemblies(pdbid, file_path)
-        elif method == 'all':
-            molecules.show()
-            Domains(molecules).show()
-            show_assemblies(pdbid, file_path)
-            Validation(molecules).show()
+            # Download the structure while the analysis data is fetched.
+            if '://' in file_path:
+                if version and steps and snapshot_cache.path:
+                    snapshot_name = _get_snapshot_name(pdbid, method,
+                                                       domain_types)
+                    if _restore_snapshot(pdbid, version, snapshot_name):
+                        _zoom_and_adapt(pdbid, obj_list)
+                        return
+                url, format = file_path, 'cif'
+                if file_path == _UPDATED_FTP % pdbid:
+                    url, format = _get_structure_url(pdbid)
+                structure = StructureDownload(
+                    url,
+                    cache=structure_cache,
+                    cache_key=(pdbid, revision),
+                    format=format,
+                    fallback_path=file_path if url != file_path else None)
+            else:
+                structure = StructureDownload(file_path)
         else:
+            structure = None
+
+        _report_progress('fetching analysis data', 0.1)
+        shows = _prepare_analysis(
+            pdbid, analysis_cache.get_missing(pdbid, version, steps))
+        if not progressive_rendering:
+            for get_show in shows.values():
+                get_show()  # wait for all data before showing anything
+
+        _report_progress('loading structure', 0.4)
+        if structure:
+            structure.wait()  # without blocking PyMOL meanwhile
+        with _api_lock():
+            if structure:
+                structure.load(pdbid)
+            # Progressively rendered entries are shown as loaded until their
+            # first layer is ready.
+            hide_entry = bool(progressive_rendering and steps)
+            if not hide_entry:
+                cmd.hide('everything', pdbid)
+
+        if not steps:
             logging.warning('provide a method')
-        cmd.zoom(pdbid, complete=1)
+        for i, step in enumerate(steps):
+            _report_progress(step, 0.5 + 0.5 * i / len(steps))
+            show = shows[step]() if step in shows else None
+            # Each layer is drawn all at once.
+            with _api_lock():
+                if hide_entry:
+                    cmd.hide('everything', pdbid)
+                    hide_entry = False
+                if step == 'assemblies':
+                    show_assemblies(pdbid, file_path)
+                else:
+                    analysis_cache.run(pdbid, version, step, show)
+        if snapshot_name:
+            _save_snapshot(
+                pdbid, version, snapshot_name, steps,
+                [x for x in cmd.get_names('objects') if x not in obj_list])
+        _zoom_and_adapt(pdbid, obj_list)
 
     elif mm_cif_file:
         logging.warning('no PDB ID, show assemblies from mmCIF file')
@@ -1132,8 +3382,99 @@ def PDBe_startup(  # noqa: 901 too complex
         logging.error('please provide a 4 letter PDB code')
 
 
+class AnalysisCancelled(Exception):
+    """Raised in an analysis which was cancelled."""
+
+
+class AnalysisTask(object):
+    """Runs an analysis function in a background thread.
+
+    The analysis reports its progress with _report_progress(), as the name of
+    its current phase and the fraction of the work done. A cancelled analysis
+    stops at its next download or progress report.
+
+    Args:
+        function: Called with args and kwargs in the background thread.
+    """
+
+    _local = threading.local()  # task of the current thread
+
+    def __init__(self, function, *args, **kwargs):
+        self.phase = 'starting'
+        self.fraction = 0.0
+        self.error = None
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(function, args, kwargs),
+                                        name='AnalysisTask')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @classmethod
+    def get_current(cls):
+        """Returns the task running in this thread, or None."""
+        return getattr(cls._local, 'task', None)
+
+    @classmethod
+    def check_cancelled(cls):
+        """Raises AnalysisCancelled if the task of this thread is cancelled."""
+        task = cls.get_current()
+        if task is not None and task.cancelled:
+            raise AnalysisCancelled()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def wait(self, timeout=None):
+        """Waits for the task to finish; returns False on timeout."""
+        return self._done.wait(timeout)
+
+    def _run(self, function, args, kwargs):
+        self._local.task = self
+        try:
+            function(*args, **kwargs)
+            self.phase = 'done'
+        except AnalysisCancelled:
+            logging.info('analysis cancelled')
+            self.phase = 'cancelled'
+        except Exception as e:
+            logging.exception('analysis failed')
+            self.error = e
+            self.phase = 'failed'
+        finally:
+            self.fraction = 1.0
+            self._local.task = None
+            self._done.set()
+
+
+def _report_progress(phase, fraction):
+    """Reports the progress of the analysis running in this thread, if any.
+
+    Raises AnalysisCancelled if the analysis was cancelled.
+    """
+    logging.debug('progress: %s %d%%' % (phase, fraction * 100))
+    task = AnalysisTask.get_current()
+    if task is not None:
+        task.check_cancelled()
+        task.phase = phase
+        task.fraction = fraction
+
+
 class PdbeGui(object):
-    """Handles the GUI aspects of this pluing."""
+    """Handles the GUI aspects of this pluing.
+
+    Analyses run in the background, so the PyMOL window stays responsive;
+    their progress is shown in a dialog which also allows cancelling them.
+    """
 
     def __init__(self):
         # Make sure we can load the GUI library at startup.
@@ -1145,6 +3486,24 @@ class PdbeGui(object):
                 __name__.split('.')[-1] +
                 ": Can't start GUI due to missing python libraries:\n" +
                 '    ' + str(e))
+        self.task = None  # AnalysisTask of the latest analysis
+        self._progress_dialog = None
+        self._progress_timer = None
+
+    def start_assembly_watcher(self, interval_ms=500):
+        """Periodically builds assemblies whose placeholders were enabled.
+
+        The same timer measures redrawing for the level of detail of the
+        scene, which can only be done in the GUI thread.
+        """
+        self._assembly_timer = self._qt.QtCore.QTimer()
+        self._assembly_timer.timeout.connect(Assemblies.update)
+        self._assembly_timer.timeout.connect(self._update_level_of_detail)
+        self._assembly_timer.start(interval_ms)
+
+    @staticmethod
+    def _update_level_of_detail():
+        level_of_detail.update()
 
     def _get_pdbid(self, label):
         """Gets a PDB entry ID from a dialog window and returns it."""
@@ -1154,77 +3513,559 @@ class PdbeGui(object):
             self._qt.QtWidgets.QLineEdit.Normal, '')
         return pdbid if ok_pressed else None
 
+    def _analyze(self, pdbid, method, **kwargs):
+        """Starts analyzing the entry in the background."""
+        if self.task is not None and not self.task.done:
+            logging.warning('Wait for the running analysis to finish or '
+                            'cancel it first.')
+            return
+        # Qt timers can only be started in the GUI thread.
+        _start_assembly_watcher()
+        self.task = AnalysisTask(PDBe_startup, pdbid, method, **kwargs)
+        self._show_progress(self.task, pdbid)
+
+    def _show_progress(self, task, pdbid, interval_ms=100):
+        """Shows the progress of task in a dialog until it is done."""
+        QtWidgets = self._qt.QtWidgets
+        if QtWidgets.QApplication.instance() is None:
+            return  # no GUI to show it in
+        dialog = QtWidgets.QProgressDialog('Analyzing %s' % pdbid, 'Cancel', 0,
+                                           100)
+        dialog.setWindowTitle('PDB Analysis')
+        dialog.setMinimumDuration(500)  # only shown for slow analyses
+        dialog.canceled.connect(task.cancel)
+        timer = self._qt.QtCore.QTimer()
+
+        def update():
+            if task.done:
+                timer.stop()
+                dialog.reset()
+                return
+            dialog.setLabelText('Analyzing %s: %s' % (pdbid, task.phase))
+            dialog.setValue(int(task.fraction * 100))
+
+        timer.timeout.connect(update)
+        timer.start(interval_ms)
+        self._progress_dialog, self._progress_timer = dialog, timer
+
     def analyze_all(self):
         pdbid = self._get_pdbid(
             'Highlight chemically distinct molecules, domains and assemblies'
             ' in a PDB entry.')
         if pdbid:
-            PDBe_startup(pdbid, 'all')
+            self._analyze(pdbid, 'all')
 
     def analyze_molecules(self):
         pdbid = self._get_pdbid(
             'Highlight chemically distinct molecules in a PDB entry.')
         if pdbid:
-            PDBe_startup(pdbid, 'molecules')
+            self._analyze(pdbid, 'molecules')
 
-    def analyze_domains(self):
-        pdbid = self._get_pdbid(
-            'Display Pfam, SCOP, CATH and Rfam domains on a PDB entry.')
+    def analyze_domains(self, domain_types=None):
+        if domain_types:
+            label = 'Display %s domains on a PDB entry.' % domain_types
+        else:
+            label = 'Display Pfam, SCOP, CATH and Rfam domains on a PDB entry.'
+        pdbid = self._get_pdbid(label)
         if pdbid:
-            PDBe_startup(pdbid, 'domains')
+            self._analyze(pdbid, 'domains', domain_types=domain_types)
 
     def analyze_validation(self):
         pdbid = self._get_pdbid('Display geometric outliers on a PDB entry.')
         if pdbid:
-            PDBe_startup(pdbid, 'validation')
+            self._analyze(pdbid, 'validation')
 
     def analyze_assemblies(self):
         pdbid = self._get_pdbid('Display assemblies for a PDB entry.')
         if pdbid:
-            PDBe_startup(pdbid, 'assemblies')
+            self._analyze(pdbid, 'assemblies')
 
 
-class PdbIdAutocomplete(cmd.Shortcut):
-    """
-    PDB entry ID autocomplete helper: we don't have the whole set of valid keys
-    in the PDB, but we try to guide the user to filling in a valid key and
-    verify full-length keys with the PDB, showing the entry title as guidance.
-    """
+# The GUI is only created when a menu item is first used; the assembly watcher
+# only once an assembly placeholder needs watching.
+_gui_state = {'gui': None, 'watch_assemblies': False, 'watching': False}
 
-    MAX_CACHE_SIZE = 100
 
-    def __init__(self, get_summary=None):
-        """Constructor.
-        Args:
-            get_summary: Function that takes the pdbid as its only argument
-                and returns a PDB summary or None if the pdbid is not valid.
-        """
+def _get_gui():
+    """Returns the plugin's PdbeGui, creating it on first use."""
+    if _gui_state['gui'] is None:
+        _gui_state['gui'] = PdbeGui()
+    return _gui_state['gui']
 
-        self._pdb_id_re = re.compile(r'\d[a-zA-Z0-9]{0,3}$')
-        # for dependency injection
-        self._get_summary = (get_summary if get_summary else
-                             lambda key: pdb.get_summary(key))
-        self._title_cache = {}
 
-    def _get_title_from_pdb_with_caching(self, key):
-        # Try to get it from the cache.
-        if key in self._title_cache:
-            return self._title_cache[key]
+def _start_assembly_watcher():
+    """Starts the GUI's assembly watcher if running as a GUI plugin."""
+    if not _gui_state['watch_assemblies'] or _gui_state['watching']:
+        return
+    _gui_state['watching'] = True
+    try:
+        _get_gui().start_assembly_watcher()
+    except Exception as e:
+        logging.error('unable to watch assembly placeholders')
+        logging.exception(e)
 
-        summary = self._get_summary(key)
-        # If the key doesn't return a valid description return None to
-        # indicate that the key is invalid.
+
+class PdbIdIndex(object):
+    """Local index of PDB entry IDs and their titles.
+
+    The index file holds the IDs as a sorted array of 4 byte ASCII strings,
+    followed by the offsets of the entries' titles in the UTF-8 encoded titles
+    that make up the rest of the file. The file is memory mapped and prefix
+    lookups are binary searches in it, so it is never read as a whole and
+    works without network access.
+
+    Args:
+        path: Index file; None disables the index.
+    """
+
+    _MAGIC = b'PDBIDX1\n'
+    _HEADER = struct.Struct('<8sI')  # magic, number of entries
+    _OFFSET = struct.Struct('<I')
+    _ID_LENGTH = 4
+    _PDB_ID_RE = re.compile(r'\d[a-z0-9]{3}$')
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mapped_path = None  # path the current mapping was made for
+        self._mmap = None
+        self._count = 0
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mapped_path = None
+        self._mmap = None
+        self._count = 0
+
+    def _open(self):
+        """Maps the index file on first use; returns False if there is none."""
+        if self._mapped_path == self.path:
+            return self._mmap is not None
+        self._close()
+        self._mapped_path = self.path
+        if not self.path or not os.path.exists(self.path):
+            return False
         try:
-            title = summary[key][0]['title']
+            with open(self.path, 'rb') as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count = self._HEADER.unpack_from(mapped, 0)
+            if magic != self._MAGIC:
+                mapped.close()
+                raise ValueError('not a PDB ID index')
+        except Exception as e:
+            logging.warning('Failed to open PDB ID index %s: %s' %
+                            (self.path, e))
+            return False
+        self._mmap = mapped
+        self._count = count
+        return True
+
+    def __len__(self):
+        with self._lock:
+            return self._count if self._open() else 0
+
+    def _get_id(self, i):
+        start = self._HEADER.size + i * self._ID_LENGTH
+        return self._mmap[start:start + self._ID_LENGTH].decode('ascii')
+
+    def _get_title(self, i):
+        offsets = self._HEADER.size + self._count * self._ID_LENGTH
+        titles = offsets + (self._count + 1) * self._OFFSET.size
+        start, = self._OFFSET.unpack_from(self._mmap,
+                                          offsets + i * self._OFFSET.size)
+        end, = self._OFFSET.unpack_from(self._mmap,
+                                        offsets + (i + 1) * self._OFFSET.size)
+        return self._mmap[titles + start:titles + end].decode('utf-8')
+
+    def _find_first(self, key):
+        """Returns the index of the first ID >= key."""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_id(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, prefix, limit=None):
+        """Returns the entries whose IDs start with prefix.
+
+        Returns:
+            (<number of entries>, list((<pdbid>, <title>))), where the list
+            has the first limit entries in ID order.
+        """
+        prefix = prefix.lower()
+        with self._lock:
+            if not self._open():
+                return 0, []
+            first = self._find_first(prefix)
+            # IDs are made of digits and lower case letters, all ordered
+            # before '~'.
+            end = self._find_first(prefix + '~')
+            last = end if limit is None else min(end, first + limit)
+            return end - first, [(self._get_id(i), self._get_title(i))
+                                 for i in range(first, last)]
+
+    def get_title(self, pdbid):
+        """Returns the title of the entry or None if it isn't indexed.
+
+        Entries indexed without a title have the title ''.
+        """
+        _, entries = self.find(pdbid, 1)
+        if entries and entries[0][0] == pdbid.lower():
+            return entries[0][1]
+        return None
+
+    def update(self, entries):
+        """Adds entries to the index, rewriting the index file.
+
+        Args:
+            entries: Iterable of (pdbid, title); title may be empty, which
+                keeps the title of an entry that is already indexed.
+        Returns:
+            Number of entries in the index.
+        """
+        with self._lock:
+            index = {}  # pdbid -> title
+            if self._open():
+                index.update((self._get_id(i), self._get_title(i))
+                             for i in range(self._count))
+            for pdbid, title in entries:
+                pdbid = pdbid.lower()
+                if not self._PDB_ID_RE.match(pdbid):
+                    logging.warning('Skipping invalid PDB ID %s' % pdbid)
+                elif title or pdbid not in index:
+                    index[pdbid] = title or ''
+            self._close()  # the file is replaced
+            self._write(index)
+            return len(index)
+
+    def _write(self, index):
+        pdbids = sorted(index)
+        titles = [index[pdbid].encode('utf-8') for pdbid in pdbids]
+        offsets = [0]
+        for title in titles:
+            offsets.append(offsets[-1] + len(title))
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Write to a temporary file first so readers never see a partially
+        # written index.
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(self._HEADER.pack(self._MAGIC, len(pdbids)))
+            file.write(''.join(pdbids).encode('ascii'))
+            file.write(struct.pack('<%dI' % len(offsets), *offsets))
+            file.write(b''.join(titles))
+        getattr(os, 'replace', os.rename)(temp_path, self.path)
+
+
+pdb_id_index = PdbIdIndex()  # configured by initialize()
+
+
+class TitleCache(object):
+    """Least recently used cache of PDB entry titles.
+
+    Titles of valid entries expire after hit_ttl seconds, the None title of
+    invalid entries already after miss_ttl seconds, since an entry may just
+    not be released yet or the PDB was not reachable. The cache is loaded
+    from and saved to a JSON file, at most every save_interval seconds.
+
+    Args:
+        path: JSON file backing the cache; None keeps it in memory only.
+        max_size: Maximum number of cached titles.
+    """
+
+    MISSING = object()  # get() result for keys which are not cached
+    hit_ttl = 30 * 24 * 3600
+    miss_ttl = 300
+    save_interval = 30
+
+    def __init__(self, path=None, max_size=10000):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (title, expiry time)
+        self._loaded_path = None  # path the entries were loaded from
+        self._saved_time = 0
+        self._dirty = False
+
+    @staticmethod
+    def get_title(summary, pdbid):
+        """Returns the title from the summary of the entry or None."""
+        try:
+            return summary[pdbid][0]['title']
         except Exception:
-            title = None
-        # Purge the cache if it gets too large.
-        if len(self._title_cache) >= self.MAX_CACHE_SIZE:
-            self._title_cache = {}
+            return None
+
+    def get(self, key):
+        """Returns the cached title of key, or MISSING."""
+        with self._lock:
+            self._load()
+            title, expiry_time = self._entries.pop(key, (None, 0))
+            if expiry_time <= time.time():
+                self.misses += 1
+                return self.MISSING
+            self._entries[key] = (title, expiry_time)  # most recently used
+            self.hits += 1
+            return title
+
+    def put(self, key, title):
+        """Caches the title of key; None marks key as invalid."""
+        ttl = self.miss_ttl if title is None else self.hit_ttl
+        with self._lock:
+            self._load()
+            self._entries.pop(key, None)
+            self._entries[key] = (title, time.time() + ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._dirty = True
+            if time.time() - self._saved_time >= self.save_interval:
+                self._save()
+
+    def __contains__(self, key):
+        """Returns whether key is cached, without counting a hit or miss."""
+        with self._lock:
+            self._load()
+            _, expiry_time = self._entries.get(key, (None, 0))
+            return expiry_time > time.time()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def save(self):
+        """Saves the cache to its file if it changed."""
+        with self._lock:
+            self._save()
+
+    def _load(self):
+        if self._loaded_path == self.path:
+            return
+        self._loaded_path = self.path
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as file:
+                entries = json.load(file)['entries']
+        except Exception as e:
+            logging.warning('Failed to read title cache %s: %s' %
+                            (self.path, e))
+            return
+        now = time.time()
+        for key, title, expiry_time in entries:
+            if expiry_time > now and key not in self._entries:
+                self._entries[key] = (title, expiry_time)
+        self._entries = OrderedDict(
+            list(self._entries.items())[-self.max_size:])
+        self._saved_time = now
+
+    def _save(self):
+        self._saved_time = time.time()
+        if not self.path or not self._dirty:
+            return
+        entries = [[key, title, expiry_time]
+                   for key, (title, expiry_time) in self._entries.items()]
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as file:
+                json.dump({'entries': entries}, file)
+            getattr(os, 'replace', os.rename)(temp_path, self.path)
+            self._dirty = False
+        except Exception as e:
+            logging.warning('Failed to save title cache %s: %s' %
+                            (self.path, e))
+
+
+title_cache = TitleCache()  # configured by initialize()
+atexit.register(title_cache.save)
+
+
+class PdbIdAutocomplete(cmd.Shortcut):
+    """
+    PDB entry ID autocomplete helper: we try to guide the user to filling in a
+    valid key and verify full-length keys with the PDB, showing the entry title
+    as guidance. If the local PDB ID index has entries starting with a partial
+    key, they are offered as completions, all without network access.
+
+    Asynchronous autocompleters never wait for the PDB: titles are looked up in
+    a background thread once no new key was asked for during LOOKUP_DELAY.
+    Until then, the key completes to a pending marker. Titles which arrived
+    are printed by the next completion, from the thread asking for it.
+    """
+
+    # Maximum number of index entries listed with their titles.
+    MAX_CANDIDATES = 10
+    # Seconds without new keys before titles are looked up asynchronously.
+    LOOKUP_DELAY = 0.3
+    _PENDING = object()  # title which is being looked up
+
+    def __init__(self,
+                 get_summary=None,
+                 index=None,
+                 asynchronous=False,
+                 cache=None):
+        """Constructor.
+        Args:
+            get_summary: Function that takes the pdbid as its only argument
+                and returns a PDB summary or None if the pdbid is not valid.
+            index: PdbIdIndex to complete keys from; defaults to the plugin's
+                index.
+            asynchronous: If True, titles are looked up in the background.
+            cache: TitleCache shared with other autocompleters; defaults to
+                the plugin's title cache.
+        """
+
+        self._pdb_id_re = re.compile(r'\d[a-zA-Z0-9]{0,3}$')
+        # for dependency injection
+        self._get_summary = (get_summary if get_summary else
+                             lambda key: pdb.get_summary(key))
+        self._index = index if index is not None else pdb_id_index
+        self._asynchronous = asynchronous
+        self._title_cache = cache if cache is not None else title_cache
+        # State of asynchronous lookups, guarded by _lookup_condition.
+        self._lookup_condition = threading.Condition()
+        self._queued_keys = []  # keys to look up, most wanted first
+        self._announced_keys = set()  # keys whose title is printed
+        self._arrived_titles = []  # (key, title) of announced keys to print
+        self._lookup_key = None  # key being looked up
+        self._lookup_thread = None
+        self._last_request_time = 0
+
+    def _get_title_from_pdb(self, key):
+        # If the key doesn't return a valid description return None to
+        # indicate that the key is invalid.
+        return TitleCache.get_title(self._get_summary(key), key)
+
+    def _cache_title(self, key, title):
         # Put it into the cache, even for negative results.
-        self._title_cache[key] = title
+        self._title_cache.put(key, title)
+
+    def _get_title_from_pdb_with_caching(self, key):
+        # Try to get it from the cache.
+        title = self._title_cache.get(key)
+        if title is not TitleCache.MISSING:
+            return title
+        if self._asynchronous:
+            self._request_title(key, announce=True)
+            return self._PENDING
+        title = self._get_title_from_pdb(key)
+        self._cache_title(key, title)
         return title
 
+    def _request_title(self, key, announce=False):
+        """Queues an asynchronous lookup of the title of key.
+
+        Lookups of keys that are queued or in flight are not repeated. Keys
+        to announce go first; others are speculative prefetches.
+        """
+        with self._lookup_condition:
+            self._last_request_time = time.time()
+            if announce:
+                self._announced_keys.add(key)
+            if key == self._lookup_key or key in self._title_cache:
+                return
+            if key in self._queued_keys:
+                if not announce:
+                    return
+                self._queued_keys.remove(key)
+            if announce:
+                self._queued_keys.insert(0, key)
+            else:
+                self._queued_keys.append(key)
+            del self._queued_keys[self.MAX_CANDIDATES:]
+            if self._lookup_thread is None:
+                self._lookup_thread = threading.Thread(
+                    target=self._look_up_titles, name='PdbIdAutocomplete')
+                self._lookup_thread.daemon = True
+                self._lookup_thread.start()
+            self._lookup_condition.notify()
+
+    def _next_lookup_key(self):
+        """Waits for the next key to look up; returns None when done."""
+        with self._lookup_condition:
+            self._lookup_key = None
+            while self._queued_keys:
+                # Debounce: the user may still be typing.
+                delay = (self._last_request_time + self.LOOKUP_DELAY -
+                         time.time())
+                if delay <= 0:
+                    self._lookup_key = self._queued_keys.pop(0)
+                    return self._lookup_key
+                self._lookup_condition.wait(delay)
+            self._lookup_thread = None
+            self._lookup_condition.notify_all()
+            return None
+
+    def _look_up_titles(self):
+        """Looks up the queued titles; runs in the lookup thread."""
+        key = self._next_lookup_key()
+        while key is not None:
+            try:
+                title = self._get_title_from_pdb(key)
+            except Exception as e:
+                logging.debug('title lookup of %s failed: %s' % (key, e))
+                title = None
+            with self._lookup_condition:
+                self._cache_title(key, title)
+                if key in self._announced_keys:
+                    self._announced_keys.discard(key)
+                    self._arrived_titles.append((key, title))
+            key = self._next_lookup_key()
+
+    def _print_arrived_titles(self):
+        """Prints the titles looked up since the last completion."""
+        with self._lookup_condition:
+            arrived_titles = self._arrived_titles
+            self._arrived_titles = []
+        for key, title in arrived_titles:
+            print(key + ':',
+                  title if title is not None else 'not a valid PDB ID')
+
+    def wait_for_lookups(self, timeout=None):
+        """Waits for all queued lookups; returns False on timeout."""
+        end_time = None if timeout is None else time.time() + timeout
+        with self._lookup_condition:
+            while self._lookup_thread is not None:
+                remaining = None if end_time is None else end_time - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._lookup_condition.wait(remaining)
+        return True
+
+    def _complete_from_index(self, key, filler):
+        """Returns the completions of a partial key from the index or None."""
+        count, entries = self._index.find(key, self.MAX_CANDIDATES)
+        if count == 0:
+            return None
+        if count > self.MAX_CANDIDATES:
+            return [
+                key + '[alphanumeric]' * (4 - len(key)),
+                '(%d entries)' % count, filler
+            ]
+        for pdbid, title in entries:
+            print(pdbid + ':', title)
+            if not title and self._asynchronous:
+                self._request_title(pdbid)  # prefetch likely completions
+        if count == 1:
+            return entries[0][0]
+        return [pdbid for pdbid, _ in entries]
+
     def interpret(self, key, mode=0):
         # The filler is a 'space' but ordered after visible ASCII chars. We use
         # it to convince autocomplete that there is still more than 1 option
@@ -1232,16 +4073,24 @@ class PdbIdAutocomplete(cmd.Shortcut):
         # of 'regular expression' to guide the user.
         filler = '\x7f'
         key = key.lower()
-        if len(key) == 0:
-            # Returning a list indicates that there are still >1 options.
-            return ['[0-9]' + '[alphanumeric]' * 3, filler]
-        elif len(key) < 4:
-            if re.match(self._pdb_id_re, key) is None:
+        self._print_arrived_titles()
+        if len(key) < 4:
+            if key and re.match(self._pdb_id_re, key) is None:
                 return None  # key doesn't match PDB ID format
+            completion = self._complete_from_index(key, filler)
+            if completion is not None:
+                return completion
             # Returning a list indicates that there are still >1 options.
+            if len(key) == 0:
+                return ['[0-9]' + '[alphanumeric]' * 3, filler]
             return [key + '[alphanumeric]' * (4 - len(key)), filler]
         else:
-            title = self._get_title_from_pdb_with_caching(key)
+            title = self._index.get_title(key)
+            if title is None:
+                title = self._get_title_from_pdb_with_caching(key)
+            if title is self._PENDING:
+                # The title is printed by a completion after it arrived.
+                return [key + ' (looking up title)', filler]
             # If we don't have a valid title return None to indicate that the
             # key is invalid.
             if title is None:
@@ -1252,10 +4101,21 @@ class PdbIdAutocomplete(cmd.Shortcut):
             return key
 
 
-PDB_ID_AUTOCOMPLETE = [
-    lambda: PdbIdAutocomplete(get_summary=lambda key: pdb.get_summary(key)),
-    'PDB Entry Id', ''
-]
+_autocomplete_state = {'completer': None}
+
+
+def _get_pdb_id_autocomplete():
+    """Returns the autocompleter of PDB ID arguments, creating it on first use.
+
+    It is shared by all commands, so titles and lookups are shared as well.
+    """
+    if _autocomplete_state['completer'] is None:
+        _autocomplete_state['completer'] = PdbIdAutocomplete(
+            get_summary=lambda key: pdb.get_summary(key), asynchronous=True)
+    return _autocomplete_state['completer']
+
+
+PDB_ID_AUTOCOMPLETE = [_get_pdb_id_autocomplete, 'PDB Entry Id', '']
 
 
 @extendaa(PDB_ID_AUTOCOMPLETE)
@@ -1285,7 +4145,7 @@ EXAMPLES
 
 
 @extendaa(PDB_ID_AUTOCOMPLETE)
-def PDB_Analysis_Domains(pdbid):
+def PDB_Analysis_Domains(pdbid, domain_types=''):
     """
 DESCRIPTION
 
@@ -1295,19 +4155,25 @@ DESCRIPTION
     PyMOL. The Domains Plugin also highlights chemically distinct molecules and
     domains are overlaid on these molecules.
 
+    Only the domain mappings needed for the requested domain types are
+    fetched from PDB.
+
 USAGE
 
-    PDB_Analysis_Domains pdb_id
+    PDB_Analysis_Domains pdb_id [, domain_types ]
 
 ARGUMENTS
 
     pdb_id = string: 4-character PDB entry ID
+    domain_types = string: comma separated list of domain types to show, out of
+    Pfam, Rfam, SCOP, CATH {default: all domain types}
 
 EXAMPLES
 
     PDB_Analysis_Domains 3b43
+    PDB_Analysis_Domains 3b43, Pfam
     """
-    PDBe_startup(pdbid, 'domains')
+    PDBe_startup(pdbid, 'domains', domain_types=domain_types)
 
 
 @extendaa(PDB_ID_AUTOCOMPLETE)
@@ -1345,6 +4211,12 @@ DESCRIPTION
 
     Fetches the specified entry from PDB and highlights the assemblies.
 
+    Assemblies that would exceed the atom budget (preference
+    PDB_PLUGIN_ASSEMBLY_ATOM_BUDGET, in atoms times states) are shown as a
+    disabled placeholder object. Enabling the placeholder in the GUI builds
+    the assembly, dropping other disabled assemblies as needed to stay within
+    the budget.
+
 USAGE
 
     PDB_Analysis_Assemblies pdb_id
@@ -1360,6 +4232,913 @@ EXAMPLES
     PDBe_startup(pdbid, 'assemblies')
 
 
+@extendaa(PDB_ID_AUTOCOMPLETE)
+def PDB_Profile(pdbid, method='all', output_file=None):
+    """
+DESCRIPTION
+
+    Analyzes a PDB entry like the PDB_Analysis_* commands and prints how much
+    time each phase of the analysis took, e.g. fetching data from the PDB API,
+    loading the structure or creating objects. Bytes fetched, objects created
+    and PyMOL commands issued are counted as well. This tells whether a slow
+    entry is network bound or PyMOL bound.
+
+USAGE
+
+    PDB_Profile pdb_id [, method [, output_file ]]
+
+ARGUMENTS
+
+    pdb_id = string: 4-character PDB entry ID
+    method = string: all, molecules, domains, validation or assemblies
+    {default: all}
+    output_file = string: name of a JSON file the profile is written to
+    {default: none}
+
+EXAMPLES
+
+    PDB_Profile 3mzw
+    PDB_Profile 3l2p, domains, 3l2p_profile.json
+    """
+    object_names = set(cmd.get_names('objects'))
+    profiler.start()
+    try:
+        with cmd.observe(_count_command):
+            PDBe_startup(pdbid, method)
+    finally:
+        report = profiler.stop()
+    report['counters']['objects created'] = len(
+        set(cmd.get_names('objects')) - object_names)
+    report['pdbid'] = pdbid
+    report['method'] = method
+    print(Profiler.format_report(report))
+    if output_file:
+        with open(output_file, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def _get_deep_size(obj):
+    """Returns the bytes used by obj and all objects it references.
+
+    Containers and instances of this plugin's classes are followed; other
+    objects (e.g. modules or functions) only count with their own size.
+    """
+    seen = set()
+    size = 0
+    objects = [obj]
+    while objects:
+        obj = objects.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            objects.extend(obj.keys())
+            objects.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            objects.extend(obj)
+        elif type(obj).__module__ == __name__ and hasattr(obj, '__dict__'):
+            objects.append(obj.__dict__)
+    return size
+
+
+def get_memory_report():
+    """Returns the memory used by the plugin's analysis state.
+
+    The analysis contexts are those still in use plus that of the last
+    analysis, which is kept alive for this report.
+
+    Format:
+      <report> = dict('state': dict(<name>: <bytes>),
+                      'objects': dict(<object name>: <atoms>),
+                      'state_bytes': <total bytes of state>,
+                      'copied_atoms': <atoms of all but the entry objects>)
+    """
+    state = OrderedDict([
+        ('AnalysisContext._contexts', list(AnalysisContext._contexts)),
+        ('title_cache._entries', title_cache._entries),
+        ('Assemblies._built', Assemblies._built),
+        ('Assemblies._placeholders', Assemblies._placeholders),
+        ('BinaryCif._loaded', BinaryCif._loaded),
+        ('Assemblies._restored', Assemblies._restored),
+        ('analysis_cache._plans', analysis_cache._plans),
+    ])
+    for name, value in state.items():
+        state[name] = _get_deep_size(value)
+    objects = OrderedDict((name, cmd.count_atoms('%s' % name))
+                          for name in cmd.get_names('objects'))
+    # Objects loaded from structure files are named by their pdbid; all
+    # others are copies made by the analysis.
+    copied_atoms = sum(atoms for name, atoms in objects.items()
+                       if not re.match(r'\d\w{3}$', name))
+    return {
+        'state': state,
+        'objects': objects,
+        'state_bytes': sum(state.values()),
+        'copied_atoms': copied_atoms,
+    }
+
+
+def _format_memory_report(report):
+    """Returns the memory report as a human readable table."""
+    lines = ['%-40s %12s' % ('plugin state', 'bytes')]
+    for name, size in report['state'].items():
+        lines.append('%-40s %12d' % ('  ' + name, size))
+    lines.append('%-40s %12d' % ('  total', report['state_bytes']))
+    lines.append('%-40s %12s' % ('objects', 'atoms'))
+    for name, atoms in report['objects'].items():
+        lines.append('%-40s %12d' % ('  ' + name[:36], atoms))
+    lines.append('%-40s %12d' % ('  copied atoms', report['copied_atoms']))
+    if 'allocations' in report:
+        lines.append('%-40s %12s' % ('python allocations', 'bytes'))
+        lines.append('%-40s %12d' % ('  peak', report['peak_bytes']))
+        for where, size in report['allocations']:
+            lines.append('%-40s %12d' % ('  ' + where[-36:], size))
+    return '\n'.join(lines)
+
+
+def _analyze_tracing_allocations(pdbid, method, top):
+    """Analyzes the entry while tracing python memory allocations.
+
+    Returns (allocations, peak_bytes) where allocations lists the top
+    (file:line, bytes) of this plugin's code lines which grew the most, or
+    (None, None) if tracemalloc isn't available.
+    """
+    try:
+        tracemalloc = importlib.import_module('tracemalloc')
+    except ImportError:
+        logging.warning('tracemalloc needs python 3; not tracing python '
+                        'memory allocations.')
+        PDBe_startup(pdbid, method)
+        return None, None
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    if hasattr(tracemalloc, 'reset_peak'):  # python 3.9+
+        tracemalloc.reset_peak()
+    try:
+        before = tracemalloc.take_snapshot()
+        PDBe_startup(pdbid, method)
+        after = tracemalloc.take_snapshot()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    this_file = [tracemalloc.Filter(True, __file__)]
+    differences = after.filter_traces(this_file).compare_to(
+        before.filter_traces(this_file), 'lineno')
+    allocations = []
+    for difference in differences[:top]:
+        frame = difference.traceback[0]
+        where = '%s:%d' % (os.path.basename(frame.filename), frame.lineno)
+        allocations.append((where, difference.size_diff))
+    return allocations, peak_bytes
+
+
+@extendaa(PDB_ID_AUTOCOMPLETE)
+def PDB_Memory(pdbid=None, method='all', top=10):
+    """
+DESCRIPTION
+
+    Reports the memory used by the plugin's analysis state (e.g. PDB API data
+    and sequences of the last analysis) and the atoms of all objects,
+    including the atoms copied into the objects an analysis creates.
+
+    If a pdb_id is given, that entry is analyzed first while tracing python
+    memory allocations, and the allocations of the plugin's code lines which
+    grew the most are reported as well. This needs python 3.
+
+USAGE
+
+    PDB_Memory [ pdb_id [, method [, top ]]]
+
+ARGUMENTS
+
+    pdb_id = string: 4-character PDB entry ID {default: none}
+    method = string: all, molecules, domains, validation or assemblies
+    {default: all}
+    top = integer: number of allocating code lines reported {default: 10}
+
+EXAMPLES
+
+    PDB_Memory
+    PDB_Memory 3mzw, domains
+    """
+    allocations = None
+    if pdbid:
+        allocations, peak_bytes = _analyze_tracing_allocations(
+            pdbid, method, int(top))
+    report = get_memory_report()
+    if allocations is not None:
+        report['allocations'] = allocations
+        report['peak_bytes'] = peak_bytes
+    print(_format_memory_report(report))
+    return report
+
+
+def _read_pdbids(args):
+    """Returns the PDB IDs listed in args.
+
+    Each arg is a space or comma separated list of PDB IDs, or the name of a
+    file containing such lists.
+    """
+    pdbids = []
+    for arg in args:
+        for token in re.split(r'[\s,]+', arg.strip()):
+            if not token:
+                continue
+            if os.path.isfile(token):
+                with open(token) as file:
+                    pdbids.extend(_read_pdbids(file.readlines()))
+            else:
+                pdbids.append(token.lower())
+    return pdbids
+
+
+@extendaa(PDB_ID_AUTOCOMPLETE)
+def PDB_Cache_Structures(*pdbids):
+    """
+DESCRIPTION
+
+    Downloads the structures of the specified entries into the local
+    structure cache, so that later analyses of these entries don't have to
+    download them again. Entries which are already cached in their current
+    revision are skipped.
+
+    The cache directory and its maximum size are set with the preferences
+    PDB_PLUGIN_STRUCTURE_CACHE_DIR and PDB_PLUGIN_STRUCTURE_CACHE_MB. The
+    structures are cached in the format set with PDB_PLUGIN_STRUCTURE_FORMAT.
+
+USAGE
+
+    PDB_Cache_Structures pdb_ids
+
+ARGUMENTS
+
+    pdb_ids = string: space separated PDB entry IDs, or the name of a file
+    containing PDB entry IDs
+
+EXAMPLES
+
+    PDB_Cache_Structures 3mzw 3l2p
+    PDB_Cache_Structures pdb_ids.txt
+    """
+    if not structure_cache.path:
+        logging.error('The structure cache is disabled.')
+        return 0
+    num_cached = 0
+    for pdbid in _read_pdbids(pdbids):
+        summary = pdb.get_summary(pdbid)
+        if not summary:
+            logging.warning('Skipping invalid PDB ID %s' % pdbid)
+            continue
+        revision = StructureCache.get_revision(summary, pdbid)
+        url, format = _get_structure_url(pdbid)
+        format = StructureCache.get_format(url, format)
+        if not structure_cache.get_file(pdbid, revision, format):
+            logging.info('Caching structure of %s' % pdbid)
+            contents, compressed = _read_file(url)
+            structure_cache.store(pdbid, revision, contents, format,
+                                  compressed)
+        num_cached += 1
+    return num_cached
+
+
+def _read_index_entries(file_name):
+    """Yields (pdbid, title) of each line '<pdb_id> [<title>]' of a file."""
+    with io.open(file_name, encoding='utf-8') as file:
+        for line in file:
+            fields = line.strip().split(None, 1)
+            if fields:
+                yield fields[0], fields[1] if len(fields) > 1 else ''
+
+
+@extendaa()
+def PDB_Update_Index(file_name):
+    """
+DESCRIPTION
+
+    Adds PDB entries to the local index of PDB IDs and titles, from which
+    PDB ID arguments of the PDB commands are autocompleted without network
+    access. Entries which are already in the index get the listed title.
+
+    The index file is set with the preference PDB_PLUGIN_ID_INDEX.
+
+USAGE
+
+    PDB_Update_Index file_name
+
+ARGUMENTS
+
+    file_name = string: name of a file with one PDB entry ID per line,
+    optionally followed by a space or tab and the entry's title
+
+EXAMPLES
+
+    PDB_Update_Index pdb_titles.txt
+    """
+    if not pdb_id_index.path:
+        logging.error('The PDB ID index is disabled.')
+        return 0
+    num_entries = pdb_id_index.update(_read_index_entries(file_name))
+    print('PDB ID index has %d entries.' % num_entries)
+    return num_entries
+
+
+# Seconds a batch task may take; set from preference PDB_PLUGIN_BATCH_TIMEOUT
+# by initialize().
+batch_task_timeout = 3600
+batch_tasks_per_worker = 50  # tasks after which a worker process is replaced
+
+
+def _start_batch_worker():
+    """Initializes a batch worker process with a headless PyMOL instance."""
+    # A raising pool initializer makes the pool restart workers forever;
+    # failures show up in the analysis of the entries instead.
+    try:
+        if cmd._COb is None:
+            pymol.invocation.options.quiet = 1
+            pymol2 = importlib.import_module('pymol2')
+            pymol2.SingletonPyMOL().start()
+            # Read the user's preferences, but don't load any other plugins.
+            pymol.plugins.initialize(pmgapp=-2)
+        initialize()
+        # Nothing is drawn, so redraw times tell nothing about the scene.
+        LevelOfDetail.max_redraw_time = 0
+    except Exception:
+        logging.exception('failed to initialize batch worker')
+
+
+def _new_batch_result(pdbid, error=None):
+    """Returns a report entry of a batch, failed with error if given."""
+    return {
+        'pdbid': pdbid,
+        'status': 'failed' if error else 'ok',
+        'seconds': 0.0,
+        'num_objects': 0,
+        'output': None,
+        'error': error,
+    }
+
+
+def _analyze_batch_entry(task):
+    """Analyzes one PDB entry of a batch and saves the results.
+
+    Args:
+        task: (pdbid, method, output_dir, output_format)
+
+    Returns:
+        A report entry dict with pdbid, status, seconds, num_objects, output
+        and error.
+    """
+    pdbid, method, output_dir, output_format = task
+    result = _new_batch_result(pdbid)
+    start = time.time()
+    try:
+        cmd.reinitialize()
+        PDBe_startup(pdbid, method)
+        object_names = cmd.get_object_list('all') or []
+        if not object_names:
+            raise ValueError('no objects created for %s' % pdbid)
+        if output_format == 'pse':
+            output = os.path.join(output_dir, pdbid + '.pse')
+            cmd.save(output)
+        else:
+            output = os.path.join(output_dir, pdbid)
+            if not os.path.isdir(output):
+                os.makedirs(output)
+            for object_name in object_names:
+                cmd.save(
+                    os.path.join(output,
+                                 '%s.%s' % (object_name, output_format)),
+                    object_name)
+        result['num_objects'] = len(object_names)
+        result['output'] = output
+    except Exception as e:
+        logging.exception('batch analysis of %s failed' % pdbid)
+        result['status'] = 'failed'
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    result['seconds'] = time.time() - start
+    return result
+
+
+def _create_pool(processes, num_tasks, initializer=_start_batch_worker):
+    """Returns a pool of batch worker processes, or None for processes=0.
+
+    Args:
+        processes: Number of worker processes; None for the number of CPUs.
+            See _get_num_processes().
+        num_tasks: Number of tasks.
+        initializer: Called in each worker process on startup.
+    """
+    multiprocessing = importlib.import_module('multiprocessing')
+    processes = _get_num_processes(processes, num_tasks)
+    if not processes:
+        return None
+    # Don't fork a process with a running PyMOL; start fresh ones.
+    if hasattr(multiprocessing, 'get_context'):  # python3.4+
+        context = multiprocessing.get_context('spawn')
+    else:
+        context = multiprocessing
+    api_slots = context.Semaphore(api_rate_limiter.max_concurrent)
+    # Fresh workers now and then release what PyMOL doesn't free.
+    return context.Pool(processes,
+                        initializer=_start_batch_worker_sharing_limits,
+                        initargs=(initializer, processes, api_slots),
+                        maxtasksperchild=batch_tasks_per_worker)
+
+
+def _map_in_pool(pool, worker, tasks, get_failed_result):
+    """Calls worker(task) for each task in pool and returns the results.
+
+    A task without result within batch_task_timeout seconds, e.g. because
+    its worker process died, gets get_failed_result(task, error) as result
+    instead of stalling the batch. The pool is closed afterwards.
+    """
+    pending = [pool.apply_async(worker, (task,)) for task in tasks]
+    results = []
+    lost = False
+    # The tasks before a task are done when waiting for it starts, so it is
+    # running by then and the timeout applies to its own run time.
+    for task, pending_result in zip(tasks, pending):
+        result, task_lost = _get_pool_result(task, pending_result,
+                                             batch_task_timeout,
+                                             get_failed_result)
+        results.append(result)
+        lost = lost or task_lost
+    _close_pool(pool, lost)
+    return results
+
+
+def _get_pool_result(task, pending_result, timeout, get_failed_result):
+    """Waits up to timeout seconds for the AsyncResult of task.
+
+    Returns:
+        (<result>, <lost>), where a lost task, e.g. of a worker process which
+        died, or a failed one gets get_failed_result(task, error) as result.
+    """
+    multiprocessing = importlib.import_module('multiprocessing')
+    try:
+        return pending_result.get(timeout), False
+    except multiprocessing.TimeoutError:
+        error = ('no result within %d s; the worker process may have died' %
+                 batch_task_timeout)
+        logging.error('%s: %s' % (task[0], error))
+        return get_failed_result(task, error), True
+    except Exception as e:
+        return get_failed_result(task, '%s: %s' % (type(e).__name__, e)), False
+
+
+def _close_pool(pool, lost):
+    """Closes pool, terminating it if a task got lost."""
+    if lost:
+        pool.terminate()  # a hanging worker would block join()
+    else:
+        pool.close()
+    pool.join()
+
+
+def _get_num_processes(processes, num_tasks):
+    """Returns the number of batch worker processes to start.
+
+    Args:
+        processes: Number of worker processes; None for the number of CPUs.
+        num_tasks: Number of tasks; no more workers than tasks are started.
+    """
+    if processes is None:
+        processes = importlib.import_module('multiprocessing').cpu_count()
+    return min(processes, num_tasks)
+
+
+def _start_batch_worker_sharing_limits(initializer, processes, api_slots):
+    """Calls initializer and gives the worker its share of the API limits.
+
+    The shares of all workers add up to the limits, except for the burst,
+    which is at least one request per worker. Concurrent requests are limited
+    across all workers by the semaphore api_slots.
+    """
+    initializer()
+    limiter = api_rate_limiter
+    limiter.min_rate = min(limiter.min_rate, limiter.rate / processes)
+    limiter.set_limits(limiter.rate / processes,
+                       max(limiter.burst // processes, 1),
+                       limiter.max_concurrent)
+    limiter.shared_slots = api_slots
+
+
+def _run_batch(pdbids,
+               method='all',
+               output_dir='.',
+               processes=None,
+               output_format='pse',
+               worker=_analyze_batch_entry,
+               initializer=_start_batch_worker):
+    """Analyzes PDB entries in a pool of worker processes.
+
+    Each worker process runs its own headless PyMOL instance. With processes
+    set to 0 all entries are analyzed in the calling process instead.
+
+    Returns:
+        The list of report entries, in the order of pdbids.
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    tasks = [(pdbid, method, output_dir, output_format) for pdbid in pdbids]
+    pool = _create_pool(processes, len(tasks), initializer)
+    if pool:
+        try:
+            results = _map_in_pool(
+                pool, worker, tasks,
+                lambda task, error: _new_batch_result(task[0], error))
+        except BaseException:
+            pool.terminate()
+            raise
+    else:
+        results = [worker(task) for task in tasks]
+    return results
+
+
+def _write_batch_report(results, output_dir, seconds, name='batch'):
+    """Writes the report of a batch job as JSON and prints a summary of it.
+
+    Args:
+        results: List of report entries, each a dict with at least pdbid,
+            status, seconds and error.
+        output_dir: Directory of the report file <name>_report.json.
+        seconds: Wall clock time of the batch job.
+        name: Name of the batch job.
+    """
+    failed = [x for x in results if x['status'] != 'ok']
+    report = {
+        'num_entries': len(results),
+        'num_failed': len(failed),
+        'seconds': seconds,
+        'entries': results,
+    }
+    file_name = os.path.join(output_dir, '%s_report.json' % name)
+    with open(file_name, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    entry_seconds = sum(x['seconds'] for x in results)
+    print('Finished %s of %d entries in %.1f s (%.1f s total per-entry time); '
+          '%d failed. Report: %s' %
+          (name, len(results), seconds, entry_seconds, len(failed), file_name))
+    for result in failed:
+        label = ' '.join(filter(None, [result['pdbid'], result.get('view')]))
+        print('  %s failed: %s' % (label, result['error']))
+    return report
+
+
+@extendaa(PDB_ID_AUTOCOMPLETE)
+def PDB_Batch_Analysis(pdbids,
+                       method='all',
+                       output_dir='.',
+                       processes=None,
+                       output_format='pse'):
+    """
+DESCRIPTION
+
+    Analyzes many PDB entries in parallel worker processes, each running its
+    own headless PyMOL instance. The results of each entry are saved into
+    output_dir, either as session <pdb_id>.pse or as one file per object in
+    directory <pdb_id>. A report with per-entry timings and failures is
+    written to output_dir/batch_report.json.
+
+    The current PyMOL session is not changed, unless processes is 0.
+
+    The workers share the PDB API request limits set with the preferences
+    PDB_PLUGIN_API_RATE (requests per second), PDB_PLUGIN_API_BURST and
+    PDB_PLUGIN_API_CONCURRENCY (concurrent requests). An entry without
+    result after PDB_PLUGIN_BATCH_TIMEOUT seconds (default: 3600), e.g.
+    because its worker process crashed, is reported as failed.
+
+USAGE
+
+    PDB_Batch_Analysis pdb_ids [, method [, output_dir [, processes
+                       [, output_format ]]]]
+
+ARGUMENTS
+
+    pdb_ids = string: space separated PDB entry IDs, or the name of a file
+    containing PDB entry IDs
+    method = string: all, molecules, domains, validation or assemblies
+    {default: all}
+    output_dir = string: directory for the results {default: .}
+    processes = integer: number of worker processes; 0 analyzes the entries
+    in this PyMOL session, reinitializing it for each entry
+    {default: number of CPUs}
+    output_format = string: pse for sessions, else a file format for object
+    files, e.g. cif {default: pse}
+
+EXAMPLES
+
+    PDB_Batch_Analysis 3mzw 3l2p, molecules, results
+    PDB_Batch_Analysis pdb_ids.txt, all, results, 8, cif
+    """
+    start = time.time()
+    pdbids = _read_pdbids([pdbids])
+    if processes is not None:
+        processes = int(processes)
+    results = _run_batch(pdbids, method, output_dir, processes, output_format)
+    _write_batch_report(results, output_dir, time.time() - start)
+    return results
+
+
+RENDER_VIEWS = ('molecules', 'domains', 'validation', 'assemblies')
+_render_worker_state = {'session': None}  # session loaded in this worker
+
+
+def _set_up_render_scenes(task):
+    """Sets up the scenes of all views of one entry for rendering.
+
+    The entry is loaded once and the views are analyzed one after the other
+    into the same session; views sharing analysis steps reuse their objects.
+    After each view, the session is saved with just the objects of the view
+    enabled, and all renders of the view start from it. Assemblies are
+    rendered one image per assembly.
+
+    Args:
+        task: (pdbid, views, output_dir)
+
+    Returns:
+        A list of report entries for failed views and a list of render tasks
+        (pdbid, view, session_file, image_file, object_names).
+    """
+    pdbid, views, output_dir = task
+    scene_dir = os.path.join(output_dir, 'scenes')
+    failures = []
+    render_tasks = []
+    molecule_objects = []  # shared by the views showing molecules
+    _render_worker_state['session'] = None  # about to be replaced
+    cmd.reinitialize()
+    cmd.bg_color('white')
+    # Molecules go first, so that later views find their objects.
+    for view in sorted(views, key=RENDER_VIEWS.index):
+        start = time.time()
+        try:
+            object_names = set(cmd.get_names('objects'))
+            PDBe_startup(pdbid, view)
+            if pdbid not in (cmd.get_object_list('all') or []):
+                raise ValueError('no structure loaded for %s' % pdbid)
+            created = [
+                x for x in cmd.get_names('objects') if x not in object_names
+            ]
+            steps = AnalysisCache.get_steps(view)
+            if steps == ['molecules']:
+                molecule_objects = created
+            elif 'molecules' in steps:
+                created += [x for x in molecule_objects if x not in created]
+            session_file = os.path.join(scene_dir, '%s_%s.pse' % (pdbid, view))
+            _save_render_scene(session_file, pdbid, [pdbid] + created)
+            render_tasks.extend(
+                _get_render_tasks(pdbid, view, session_file, output_dir,
+                                  created))
+        except Exception as e:
+            logging.exception('setting up %s view of %s failed' % (view, pdbid))
+            failures.append(
+                _new_render_result(pdbid, view, None,
+                                   '%s: %s' % (type(e).__name__, e),
+                                   time.time() - start))
+    return failures, render_tasks
+
+
+def _save_render_scene(session_file, pdbid, object_names):
+    """Saves the session with only object_names enabled."""
+    enabled = cmd.get_names('objects', enabled_only=1)
+    cmd.disable('all')
+    for object_name in object_names:
+        if object_name not in Assemblies._placeholders:
+            cmd.enable(object_name)
+    cmd.orient(pdbid)
+    cmd.save(session_file)
+    cmd.disable('all')
+    for object_name in enabled:
+        cmd.enable(object_name)
+
+
+def _get_render_tasks(pdbid, view, session_file, output_dir, object_names):
+    """Returns the render tasks of a view saved in session_file."""
+    if view != 'assemblies':
+        image_file = os.path.join(output_dir, '%s_%s.png' % (pdbid, view))
+        return [(pdbid, view, session_file, image_file, None)]
+    return [(pdbid, view, session_file,
+             os.path.join(output_dir, object_name + '.png'), [object_name])
+            for object_name in object_names
+            if (object_name.startswith(pdbid + '_assem_') and
+                object_name not in Assemblies._placeholders)]
+
+
+def _new_render_result(pdbid, view, image_file, error=None, seconds=0.0):
+    """Returns a report entry of a render, failed with error if given."""
+    return {
+        'pdbid': pdbid,
+        'view': view,
+        'image': image_file,
+        'status': 'failed' if error else 'ok',
+        'seconds': seconds,
+        'error': error,
+    }
+
+
+def _render_image(task):
+    """Ray traces one view of an entry into a PNG image.
+
+    Args:
+        task: (pdbid, view, session_file, image_file, object_names, width,
+            height) where object_names are the objects to show, or None for
+            all objects enabled in the session.
+
+    Returns:
+        A report entry dict.
+    """
+    pdbid, view, session_file, image_file, object_names, width, height = task
+    result = _new_render_result(pdbid, view, image_file)
+    start = time.time()
+    try:
+        # Consecutive renders of the same view share the loaded session.
+        if _render_worker_state['session'] != session_file:
+            _render_worker_state['session'] = None
+            cmd.load(session_file)
+            _render_worker_state['session'] = session_file
+        if object_names:
+            cmd.disable('all')
+            for object_name in object_names:
+                cmd.enable(object_name)
+            cmd.orient(' or '.join(object_names))
+        # Worker processes render in parallel; one ray tracing thread each.
+        cmd.set('max_threads', 1)
+        cmd.png(image_file, width, height, ray=1, quiet=1)
+        # The next task must not see this task's changes to the scene.
+        if object_names:
+            _render_worker_state['session'] = None
+    except Exception as e:
+        logging.exception('rendering %s failed' % image_file)
+        result['status'] = 'failed'
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    result['seconds'] = time.time() - start
+    return result
+
+
+def _run_render(pdbids,
+                views=RENDER_VIEWS,
+                output_dir='.',
+                width=640,
+                height=480,
+                processes=None,
+                initializer=_start_batch_worker):
+    """Renders views of PDB entries in a pool of worker processes.
+
+    Scenes are set up per entry and the resulting renders are distributed over
+    the same pool as soon as their entry is set up (see _render_in_pool). With
+    processes set to 0 everything runs in the calling process instead.
+
+    Returns:
+        The list of report entries, one per image or failed scene set up.
+    """
+    scene_dir = os.path.join(output_dir, 'scenes')
+    if not os.path.isdir(scene_dir):
+        os.makedirs(scene_dir)
+    setup_tasks = [(pdbid, views, output_dir) for pdbid in pdbids]
+    # Each entry has several views to render in parallel.
+    num_tasks = len(setup_tasks) * len(views)
+    pool = _create_pool(processes, num_tasks, initializer)
+    results = []
+    if pool:
+        try:
+            results = _render_in_pool(pool,
+                                      _get_num_processes(processes, num_tasks),
+                                      setup_tasks, (width, height))
+        except BaseException:
+            pool.terminate()
+            raise
+    else:
+        for setup_task in setup_tasks:
+            failures, render_tasks = _set_up_render_scenes(setup_task)
+            results.extend(failures)
+            for render_task in render_tasks:
+                results.append(_render_image(render_task + (width, height)))
+    return sorted(results,
+                  key=lambda x:
+                  (pdbids.index(x['pdbid']), x['view'], x['image'] or ''))
+
+
+def _render_in_pool(pool, processes, setup_tasks, size):
+    """Sets up and renders the scenes of entries in pool of processes.
+
+    No more entries than processes are set up at a time, so that the renders
+    of an entry which is set up are queued before the set up of any further
+    entry and start as soon as a worker is free. The pool is closed
+    afterwards.
+
+    Args:
+        size: (width, height) of the images.
+
+    Returns:
+        The list of report entries, one per image or failed scene set up.
+    """
+
+    def get_failed_setup(setup_task, error):
+        pdbid, views, _ = setup_task
+        failures = [
+            _new_render_result(pdbid, view, None, error) for view in views
+        ]
+        return failures, []
+
+    waiting = list(reversed(setup_tasks))
+    setups = []  # list of (setup_task, AsyncResult, deadline)
+    renders = []  # list of (render_task, AsyncResult)
+    results = []
+    lost = False
+    while waiting or setups:
+        while waiting and len(setups) < processes:
+            setup_task = waiting.pop()
+            # The time a set up may take includes waiting for earlier renders.
+            setups.append(
+                (setup_task,
+                 pool.apply_async(_set_up_render_scenes, (setup_task,)),
+                 time.time() + batch_task_timeout))
+        setups[0][1].wait(0.05)
+        for setup in list(setups):
+            setup_task, pending_result, deadline = setup
+            if not pending_result.ready() and time.time() < deadline:
+                continue
+            setups.remove(setup)
+            (failures, render_tasks), setup_lost = _get_pool_result(
+                setup_task, pending_result, 0, get_failed_setup)
+            lost = lost or setup_lost
+            results.extend(failures)
+            for render_task in render_tasks:
+                render_task += size
+                renders.append(
+                    (render_task, pool.apply_async(_render_image,
+                                                   (render_task,))))
+    for render_task, pending_result in renders:
+        result, render_lost = _get_pool_result(
+            render_task, pending_result,
+            batch_task_timeout, lambda task, error: _new_render_result(
+                task[0], task[1], task[3], error))
+        results.append(result)
+        lost = lost or render_lost
+    _close_pool(pool, lost)
+    return results
+
+
+@extendaa(PDB_ID_AUTOCOMPLETE)
+def PDB_Render_Images(pdbids,
+                      views=' '.join(RENDER_VIEWS),
+                      output_dir='.',
+                      width=640,
+                      height=480,
+                      processes=None):
+    """
+DESCRIPTION
+
+    Renders ray traced PNG images of the analysis views of PDB entries in
+    parallel worker processes, each running its own headless PyMOL instance
+    without graphics hardware. Images are saved as <pdb_id>_<view>.png in
+    output_dir, with one image <pdb_id>_assem_<id>.png per assembly. The
+    sessions the images are rendered from are kept in output_dir/scenes. A
+    report with per-image timings and failures is written to
+    output_dir/render_report.json.
+
+    The current PyMOL session is not changed, unless processes is 0.
+
+USAGE
+
+    PDB_Render_Images pdb_ids [, views [, output_dir [, width [, height
+                      [, processes ]]]]]
+
+ARGUMENTS
+
+    pdb_ids = string: space separated PDB entry IDs, or the name of a file
+    containing PDB entry IDs
+    views = string: space separated views to render, any of molecules,
+    domains, validation and assemblies {default: all of them}
+    output_dir = string: directory for the images {default: .}
+    width, height = integer: image size in pixels {default: 640, 480}
+    processes = integer: number of worker processes; 0 renders in this
+    PyMOL session, reinitializing it for each view
+    {default: number of CPUs}
+
+EXAMPLES
+
+    PDB_Render_Images 3mzw 3l2p, molecules assemblies, images, 200, 150
+    PDB_Render_Images pdb_ids.txt, output_dir=gallery
+    """
+    start = time.time()
+    pdbids = _read_pdbids([pdbids])
+    views = [x for x in re.split(r'[\s,]+', views.strip()) if x]
+    for view in views:
+        if view not in RENDER_VIEWS:
+            raise pymol.CmdException('unknown view %s' % view)
+    if processes is not None:
+        processes = int(processes)
+    results = _run_render(pdbids, views, output_dir, int(width), int(height),
+                          processes)
+    _write_batch_report(results, output_dir, time.time() - start, 'render')
+    return results
+
+
 @extendaa(cmd.auto_arg[0]['count_atoms'])
 def count_chains(selection='(all)', state=0, quiet=False):
     """
@@ -1393,6 +5172,38 @@ SEE ALSO
     return n
 
 
+def _get_pref(name, default):
+    """Returns preference name, initializing it to default if unset."""
+    value = pymol.plugins.pref_get(name, None)
+    if value is None:
+        value = default
+        pymol.plugins.pref_set(name, value)
+        pymol.plugins.pref_save()
+    return value
+
+
+def _get_int_pref(name, default):
+    """Returns integer preference name, initializing it to default if unset."""
+    value = _get_pref(name, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        logging.error('Invalid preference %s = "%s"; using %s instead.' %
+                      (name, value, default))
+        return default
+
+
+def _get_float_pref(name, default):
+    """Returns number preference name, initializing it to default if unset."""
+    value = _get_pref(name, default)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        logging.error('Invalid preference %s = "%s"; using %s instead.' %
+                      (name, value, default))
+        return default
+
+
 def initialize():
     # get preferences
     pref_loglevel = 'PDB_PLUGIN_LOGLEVEL'
@@ -1415,21 +5226,83 @@ def initialize():
     else:
         logger.setLevel(numeric_loglevel)
 
+    Assemblies.atom_budget = _get_int_pref('PDB_PLUGIN_ASSEMBLY_ATOM_BUDGET',
+                                           Assemblies.atom_budget)
+    LevelOfDetail.budget = _get_int_pref('PDB_PLUGIN_GEOMETRY_BUDGET',
+                                         LevelOfDetail.budget)
+    LevelOfDetail.max_redraw_time = _get_float_pref(
+        'PDB_PLUGIN_MAX_REDRAW_TIME', LevelOfDetail.max_redraw_time)
+    # An empty cache directory disables the structure cache.
+    cache_dir = _get_pref(
+        'PDB_PLUGIN_STRUCTURE_CACHE_DIR',
+        os.path.join('~', '.pymol', 'pdb_plugin', 'structures'))
+    structure_cache.path = os.path.expanduser(cache_dir) if cache_dir else None
+    structure_cache.max_bytes = _get_int_pref('PDB_PLUGIN_STRUCTURE_CACHE_MB',
+                                              1000) * 1024 * 1024
+    # An empty file name disables the PDB ID index.
+    index_file = _get_pref(
+        'PDB_PLUGIN_ID_INDEX',
+        os.path.join('~', '.pymol', 'pdb_plugin', 'pdb_ids.idx'))
+    pdb_id_index.path = os.path.expanduser(index_file) if index_file else None
+    api_rate_limiter.set_limits(_get_float_pref('PDB_PLUGIN_API_RATE', 10.0),
+                                _get_int_pref('PDB_PLUGIN_API_BURST', 10),
+                                _get_int_pref('PDB_PLUGIN_API_CONCURRENCY', 4))
+    # Space separated root URLs of equivalent servers, fastest used first.
+    for mirrors, name in ((api_mirrors, 'PDB_PLUGIN_API_MIRRORS'),
+                          (file_mirrors, 'PDB_PLUGIN_FILE_MIRRORS')):
+        mirrors.set_urls(_get_pref(name, mirrors.canonical).split())
+        mirrors.hedge_percentile = _get_float_pref(
+            'PDB_PLUGIN_MIRROR_HEDGE_PERCENTILE', 0)
+    # An empty file name keeps the title cache in memory only.
+    title_file = _get_pref(
+        'PDB_PLUGIN_TITLE_CACHE',
+        os.path.join('~', '.pymol', 'pdb_plugin', 'titles.json'))
+    title_cache.path = os.path.expanduser(title_file) if title_file else None
+    title_cache.max_size = _get_int_pref('PDB_PLUGIN_TITLE_CACHE_SIZE',
+                                         title_cache.max_size)
+    # An empty snapshot directory disables analysis snapshots.
+    snapshot_dir = _get_pref(
+        'PDB_PLUGIN_SNAPSHOT_DIR',
+        os.path.join('~', '.pymol', 'pdb_plugin', 'snapshots'))
+    snapshot_cache.path = (os.path.expanduser(snapshot_dir)
+                           if snapshot_dir else None)
+    snapshot_cache.max_bytes = _get_int_pref('PDB_PLUGIN_SNAPSHOT_CACHE_MB',
+                                             500) * 1024 * 1024
+    global batch_task_timeout
+    batch_task_timeout = _get_int_pref('PDB_PLUGIN_BATCH_TIMEOUT',
+                                       batch_task_timeout)
+    global progressive_rendering
+    progressive_rendering = bool(_get_int_pref('PDB_PLUGIN_PROGRESSIVE', 1))
+    # 'bcif' downloads BinaryCIF if PyMOL can read it, with mmCIF as fallback.
+    structure_format = _get_pref('PDB_PLUGIN_STRUCTURE_FORMAT', 'cif')
+    if structure_format not in StructureDownload.FORMATS:
+        logging.error('Invalid preference %s = "%s"; using cif instead.' %
+                      ('PDB_PLUGIN_STRUCTURE_FORMAT', structure_format))
+        structure_format = 'cif'
+    StructureDownload.preferred_format = structure_format
+
 
 # Run when used as a plugin.
 def __init_plugin__(app=None):
     initialize()
-    gui = PdbeGui()
+    _gui_state['watch_assemblies'] = True
     try:
         # Simply add the menu entry and callback
         from pymol.plugins import addmenuitemqt
 
         submenu = 'PDB Analysis|'
-        addmenuitemqt(submenu + 'All', lambda: gui.analyze_all())
-        addmenuitemqt(submenu + 'Molecules', lambda: gui.analyze_molecules())
-        addmenuitemqt(submenu + 'Domains', lambda: gui.analyze_domains())
-        addmenuitemqt(submenu + 'Validation', lambda: gui.analyze_validation())
-        addmenuitemqt(submenu + 'Assemblies', lambda: gui.analyze_assemblies())
+        addmenuitemqt(submenu + 'All', lambda: _get_gui().analyze_all())
+        addmenuitemqt(submenu + 'Molecules',
+                      lambda: _get_gui().analyze_molecules())
+        addmenuitemqt(submenu + 'Domains', lambda: _get_gui().analyze_domains())
+        for domain_type in Domains.DOMAIN_TYPES:
+            addmenuitemqt(submenu + 'Domains by Type|' + domain_type,
+                          lambda domain_type=domain_type: _get_gui().
+                          analyze_domains(domain_type))
+        addmenuitemqt(submenu + 'Validation',
+                      lambda: _get_gui().analyze_validation())
+        addmenuitemqt(submenu + 'Assemblies',
+                      lambda: _get_gui().analyze_assemblies())
 
     except Exception as e:
         logging.error('unable to make menu items')
@@ -1440,10 +5313,14 @@ def usage():
     usage = """
 Usage
     pymol PDB_plugin.py [pdbid | mmCIF_file=<file>]
+    pymol -cq PDB_plugin.py -- batch=<pdbids> [method=<method>]
+          [output_dir=<dir>] [processes=<n>] [output_format=<format>]
 
         pdbid ... PDB entry ID; CIF data will be downloaded
         file .... CIF file for a PDB entry.
                   The file name should start with PDB ID.
+        batch ... Comma separated PDB entry IDs or name of file with IDs,
+                  analyzed in parallel; see help PDB_Batch_Analysis.
 """
     print(usage)
     # pymol.cmd.quit()
@@ -1454,9 +5331,12 @@ def main(argv=sys.argv):
     initialize()
     mm_cif_file = None
     pdbid = None
+    batch_args = {}
     logging.debug(argv)
     pdb_id_re = re.compile(r'\d[A-z0-9]{3}')
     mm_cif_file_re = re.compile(r'mmCIF_file=(.*)')
+    batch_re = re.compile(
+        r'(batch|method|output_dir|processes|output_format)=(.*)')
 
     for arg in argv:
         match = pdb_id_re.match(arg)
@@ -1465,8 +5345,14 @@ def main(argv=sys.argv):
         match = mm_cif_file_re.match(arg)
         if match:
             mm_cif_file = match.group(1)
+        match = batch_re.match(arg)
+        if match:
+            batch_args[match.group(1)] = match.group(2)
 
-    if pdbid or mm_cif_file:
+    if 'batch' in batch_args:
+        pdbids = batch_args.pop('batch')
+        PDB_Batch_Analysis(pdbids, **batch_args)
+    elif pdbid or mm_cif_file:
         logging.debug('pdbid: %s' % pdbid)
         logging.debug('mmCIF file: %s' % mm_cif_file)
         PDBe_startup(pdbid, 'all', mm_cif_file=mm_cif_file)
@@ -94,3 +94,32 @@ def pytest_addoption(parser):
                     'webcache-save',
                     default=False,
                     help='Save web cache to directory after runs complete.')
+
+    # Benchmark options:
+    #
+    # The benchmarks replay the web cache and measure each analysis method on
+    # each recorded entry. They only run with --benchmark, see tools/benchmark.
+    #   --benchmark-output=<file>: write the results as JSON
+    #   --benchmark-baseline=<file>: fail benchmarks which regressed by more
+    #     than --benchmark-threshold against the results in <file>
+    add_bool_option(parser,
+                    'benchmark',
+                    default=False,
+                    help='Run the replay benchmarks.')
+    parser.addoption('--benchmark-rounds',
+                     type=int,
+                     default=3,
+                     help='Runs per benchmark; the fastest one counts '
+                     '(default: 3)')
+    parser.addoption('--benchmark-output',
+                     default=None,
+                     help='JSON file the benchmark results are written to.')
+    parser.addoption('--benchmark-baseline',
+                     default=None,
+                     help='JSON file of earlier benchmark results to compare '
+                     'with.')
+    parser.addoption('--benchmark-threshold',
+                     type=float,
+                     default=0.25,
+                     help='Relative increase over the baseline counted as '
+                     'regression (default: 0.25)')
@@ -3,17 +3,29 @@
 import PDB_plugin as plugin
 import pymol
 
+import codecs
+import gzip
 import importlib
 import json
 import logging
+import math
+import numpy
 import os
+import pickle
 import pytest
 import socket
+import subprocess
 import sys
+import threading
+import time
 try:
     import urllib.parse as url_parse
 except ImportError:
     import urllib as url_parse
+try:
+    import tracemalloc  # needs at least python 3.4
+except ImportError:
+    tracemalloc = None
 
 # ----- Test Fixtures -----
 
@@ -22,7 +34,7 @@ WEBCACHE_PATH = 'tests/data/webcache'
 
 
 @pytest.fixture(autouse=True)
-def initialize_pymol():
+def initialize_pymol(tmpdir, monkeypatch):
     """Properly initialize and set up PyMOL library."""
     # --- setup ---
     # Finish launching PyMOL without GUI.
@@ -34,11 +46,28 @@ def initialize_pymol():
     pymol.plugins.initialize(pmgapp=-2)  # No Autoloading
     # Don't save preference changes into rc file.
     pymol.plugins.pref_set('instantsave', False)
+    monkeypatch.setattr(pymol.plugins, 'pref_save',
+                        lambda *args, **kwargs: None)
     # Temporarily turn on maximal log level to also test all logging statements.
     pymol.plugins.pref_set(PREF_LOGLEVEL, 'DEBUG')
     # Also set log level directly in logging library for unit tests.
     logger = logging.getLogger()
     logger.setLevel(logging.DEBUG)
+    # Keep the structure cache in a fresh temporary directory for each test.
+    cache_dir = str(tmpdir.join('structures'))
+    pymol.plugins.pref_set('PDB_PLUGIN_STRUCTURE_CACHE_DIR', cache_dir)
+    monkeypatch.setattr(plugin.structure_cache, 'path', cache_dir)
+    # Don't reuse analysis results of other tests.
+    monkeypatch.setattr(plugin, 'analysis_cache', plugin.AnalysisCache())
+    pymol.plugins.pref_set('PDB_PLUGIN_SNAPSHOT_DIR', '')
+    monkeypatch.setattr(plugin.snapshot_cache, 'path', None)
+    pymol.plugins.pref_set('PDB_PLUGIN_ID_INDEX', '')
+    monkeypatch.setattr(plugin.pdb_id_index, 'path', None)
+    pymol.plugins.pref_set('PDB_PLUGIN_TITLE_CACHE', '')
+    monkeypatch.setattr(plugin, 'title_cache', plugin.TitleCache())
+    monkeypatch.setattr(plugin, 'api_rate_limiter', plugin.RateLimiter())
+    monkeypatch.setattr(plugin, 'level_of_detail', plugin.LevelOfDetail())
+    monkeypatch.setattr(plugin.AnalysisContext, '_last', None)
 
     yield  # each test runs here
 
@@ -55,6 +84,7 @@ class WebCache(object):
         self._plugin_fetcher = plugin_fetcher
         self._pymol_fetcher = pymol_fetcher
         self._cache = {}
+        self._synthetic = {}  # generated entries, see SyntheticEntry
         self._num_accesses = 0
         self._num_hits = 0
 
@@ -70,10 +100,31 @@ class WebCache(object):
             # Don't cache local file accesses.
             return self._pymol_fetcher(finfo)
 
+    def access_raw_url(self, file_path):
+        """Interposer for the plugin's _read_raw_file(file_path)"""
+        if '://' not in file_path:
+            with open(file_path, 'rb') as file:
+                return file.read()
+        data = self._access('pymol', file_path, 'pymol')
+        if file_path.endswith('.gz'):
+            # The cache holds the data uncompressed, as read by PyMOL.
+            data = gzip.compress(data)
+        return data
+
+    def add_synthetic(self, items):
+        """Serves items (key -> data) until clear_synthetic; never saved."""
+        self._synthetic.update(items)
+
+    def clear_synthetic(self):
+        self._synthetic = {}
+
     def _access(self, source, url, description):
         """Returns the data for the given URL."""
         self._num_accesses += 1
         key = '%s:%s' % (source, url)
+        if key in self._synthetic:
+            self._num_hits += 1
+            return self._synthetic[key]
         if key in self._cache:
             # Cache hit - return data from cache.
             self._num_hits += 1
@@ -168,6 +219,300 @@ def web_cache(pytestconfig):
             web_cache.save_to_dir(webcache_path)
 
 
+class SyntheticEntry(object):
+    """Generates a consistent synthetic PDB entry at a given scale.
+
+    The PDB API data (summary, molecules, residue_listing, mappings and
+    validation) and a matching mmCIF file are generated such that every
+    residue referenced by the API data exists in the structure.
+
+    Args:
+        pdbid: PDB ID of the entry; shouldn't be a real one.
+        chains: Number of polymer chains.
+        residues: Number of residues per chain.
+        entities: Number of polymer entities the chains are spread over.
+        ligands: Number of ligand (zinc ion) instances.
+        domains: Number of CATH and Pfam domains per chain.
+        outliers: Number of residues with validation outliers per chain.
+        gap_every: Number of residues after which the author residue
+            numbering jumps by 10; 0 for contiguous numbering.
+    """
+
+    ATOMS = (('N', -0.5), ('CA', 0.0), ('C', 0.5), ('O', 1.0))
+    OUTLIER_TYPES = ('clashes', 'bond_angles', 'bond_lengths')
+
+    def __init__(self,
+                 pdbid='0syn',
+                 chains=4,
+                 residues=100,
+                 entities=1,
+                 ligands=2,
+                 domains=2,
+                 outliers=5,
+                 gap_every=0):
+        self.pdbid = pdbid
+        self.chains = chains
+        self.residues = residues
+        self.entities = min(entities, chains)
+        self.ligands = ligands
+        self.domains = domains
+        self.outliers = min(outliers, residues)
+        self.gap_every = gap_every
+        asym_ids = self._get_asym_ids(chains + ligands)
+        self.chain_ids = asym_ids[:chains]  # also the polymer segment ids
+        self.ligand_ids = asym_ids[chains:]
+
+    @staticmethod
+    def _get_asym_ids(count):
+        """Returns count distinct chain ids: A..Z, a..z, AA, AB, ..."""
+        letters = [chr(c) for c in range(ord('A'), ord('Z') + 1)]
+        letters += [x.lower() for x in letters]
+        ids = []
+        length = 1
+        while len(ids) < count:
+            for i in range(min(len(letters)**length, count - len(ids))):
+                asym_id = ''
+                for _ in range(length):
+                    i, j = divmod(i, len(letters))
+                    asym_id = letters[j] + asym_id
+                ids.append(asym_id)
+            length += 1
+        return ids[:count]
+
+    def get_entity_id(self, chain_index):
+        return chain_index % self.entities + 1
+
+    def get_author_residue_number(self, residue_number):
+        if not self.gap_every:
+            return residue_number
+        return residue_number + 10 * ((residue_number - 1) // self.gap_every)
+
+    def _get_residue(self, residue_number, residue_name='ALA'):
+        author_residue_number = self.get_author_residue_number(residue_number)
+        return {
+            'author_insertion_code': '',
+            'author_residue_number': author_residue_number,
+            'observed_ratio': 1,
+            'residue_name': residue_name,
+            'residue_number': residue_number,
+        }
+
+    def _get_outlier_residue_numbers(self):
+        step = self.residues // self.outliers if self.outliers else 1
+        return [1 + i * step for i in range(self.outliers)]
+
+    def get_summary(self):
+        return {
+            self.pdbid: [{
+                'assemblies': [],
+                'revision_date': '20200101',
+                'title': 'Synthetic entry with %d chains' % self.chains,
+            }]
+        }
+
+    def get_molecules(self):
+        molecules = []
+        for entity in range(self.entities):
+            indexes = range(entity, self.chains, self.entities)
+            molecules.append({
+                'ca_p_only': False,
+                'entity_id': entity + 1,
+                'in_chains': [self.chain_ids[i] for i in indexes],
+                'in_struct_asyms': [self.chain_ids[i] for i in indexes],
+                'length': self.residues,
+                'molecule_name': ['Synthetic protein %d' % (entity + 1)],
+                'molecule_type': 'polypeptide(L)',
+            })
+        if self.ligands:
+            molecules.append({
+                'ca_p_only': False,
+                'entity_id': self.entities + 1,
+                'in_chains': [
+                    self.chain_ids[i % self.chains] for i in range(self.ligands)
+                ],
+                'in_struct_asyms': self.ligand_ids,
+                'molecule_name': ['ZINC ION'],
+                'molecule_type': 'Bound',
+            })
+        return {self.pdbid: molecules}
+
+    def get_residue_listing(self):
+        molecules = []
+        for entity in range(self.entities):
+            chains = []
+            for i in range(entity, self.chains, self.entities):
+                residues = [
+                    self._get_residue(n) for n in range(1, self.residues + 1)
+                ]
+                chains.append({
+                    'chain_id': self.chain_ids[i],
+                    'struct_asym_id': self.chain_ids[i],
+                    'residues': residues,
+                })
+            molecules.append({'entity_id': entity + 1, 'chains': chains})
+        if self.ligands:
+            chains = []
+            for i, ligand_id in enumerate(self.ligand_ids):
+                residue = self._get_residue(1, 'ZN')
+                residue['author_residue_number'] = 1000 + i
+                chains.append({
+                    'chain_id': self.chain_ids[i % self.chains],
+                    'struct_asym_id': ligand_id,
+                    'residues': [residue],
+                })
+            molecules.append({'entity_id': self.entities + 1, 'chains': chains})
+        return {self.pdbid: {'molecules': molecules}}
+
+    def _get_mapping(self, chain_index, domain):
+        """Returns the mapping of domain (index) onto a chain."""
+        length = self.residues // self.domains
+        start = 1 + domain * length
+        end = start + length - 1
+        chain_id = self.chain_ids[chain_index]
+        return {
+            'chain_id': chain_id,
+            'domain': '%s%s%02d' % (self.pdbid, chain_id, domain),
+            'entity_id': self.get_entity_id(chain_index),
+            'struct_asym_id': chain_id,
+            'start': self._get_residue(start),
+            'end': self._get_residue(end),
+        }
+
+    def get_mappings(self):
+        """Returns one CATH and one Pfam domain per domain index and chain.
+
+        CATH domains are named per chain and give one object each, while the
+        Pfam domains of all chains are combined into one object each.
+        """
+        cath, pfam = {}, {}
+        for domain in range(self.domains):
+            mappings = [
+                self._get_mapping(i, domain) for i in range(self.chains)
+            ]
+            cath['1.10.%d.10' % domain] = {'mappings': mappings}
+            pfam['PF%05d' % domain] = {'mappings': mappings}
+        return {self.pdbid: {'CATH': cath, 'Pfam': pfam}}
+
+    def get_validation(self):
+        return {self.pdbid: {'clashscore': {'rawvalue': 1.0}}}
+
+    def get_residue_validation(self):
+        molecules = []
+        for entity in range(self.entities):
+            chains = []
+            for i in range(entity, self.chains, self.entities):
+                outlier_types = {}
+                for j, n in enumerate(self._get_outlier_residue_numbers()):
+                    outlier_type = self.OUTLIER_TYPES[j %
+                                                      len(self.OUTLIER_TYPES)]
+                    outlier_types.setdefault(outlier_type,
+                                             []).append(self._get_residue(n))
+                chains.append({
+                    'chain_id': self.chain_ids[i],
+                    'struct_asym_id': self.chain_ids[i],
+                    'models': [{
+                        'model_id': 1,
+                        'outlier_types': outlier_types
+                    }],
+                })
+            molecules.append({'entity_id': entity + 1, 'chains': chains})
+        return {self.pdbid: {'molecules': molecules}}
+
+    def get_ramachandran_validation(self):
+        """Returns every other outlier residue also as ramachandran outlier."""
+        outliers = []
+        for i, chain_id in enumerate(self.chain_ids):
+            for n in self._get_outlier_residue_numbers()[::2]:
+                outlier = self._get_residue(n)
+                outlier.update(chain_id=chain_id,
+                               entity_id=self.get_entity_id(i),
+                               model_id=1)
+                outliers.append(outlier)
+        return {
+            self.pdbid: {
+                'ramachandran_outliers': outliers,
+                'sidechain_outliers': []
+            }
+        }
+
+    def get_mm_cif(self):
+        """Returns the mmCIF file contents with the atoms of all residues."""
+        lines = [
+            'data_%s' % self.pdbid.upper(), '#', 'loop_',
+            '_atom_site.group_PDB', '_atom_site.id', '_atom_site.type_symbol',
+            '_atom_site.label_atom_id', '_atom_site.label_alt_id',
+            '_atom_site.label_comp_id', '_atom_site.label_asym_id',
+            '_atom_site.label_entity_id', '_atom_site.label_seq_id',
+            '_atom_site.pdbx_PDB_ins_code', '_atom_site.Cartn_x',
+            '_atom_site.Cartn_y', '_atom_site.Cartn_z', '_atom_site.occupancy',
+            '_atom_site.B_iso_or_equiv', '_atom_site.auth_seq_id',
+            '_atom_site.auth_asym_id', '_atom_site.pdbx_PDB_model_num'
+        ]
+        atom_format = ('%s %d %s %s . %s %s %d %s ? %.3f %.3f %.3f 1.00 20.00 '
+                       '%d %s 1')
+        columns = int(math.ceil(math.sqrt(self.chains)))
+        atom_id = 0
+        for i, chain_id in enumerate(self.chain_ids):
+            # Chains are helices standing on a grid.
+            center_x, center_y = 20.0 * (i % columns), 20.0 * (i // columns)
+            for n in range(1, self.residues + 1):
+                angle = math.radians(100.0 * n)
+                for atom_name, offset in self.ATOMS:
+                    atom_id += 1
+                    lines.append(atom_format %
+                                 ('ATOM', atom_id, atom_name[0], atom_name,
+                                  'ALA', chain_id, self.get_entity_id(i), n,
+                                  center_x + 2.3 * math.cos(angle), center_y +
+                                  2.3 * math.sin(angle), 1.5 * n + offset,
+                                  self.get_author_residue_number(n), chain_id))
+        for i, ligand_id in enumerate(self.ligand_ids):
+            atom_id += 1
+            lines.append(atom_format %
+                         ('HETATM', atom_id, 'ZN', 'ZN', 'ZN', ligand_id,
+                          self.entities + 1, 1, 20.0 * i, -10.0, 0.0, 1000 + i,
+                          self.chain_ids[i % self.chains]))
+        lines.append('#')
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def get_web_cache_items(self):
+        """Returns the web cache items (key -> data) serving this entry."""
+        items = {}
+        for api_url, data in (
+            ('pdb/entry/summary', self.get_summary()),
+            ('pdb/entry/molecules', self.get_molecules()),
+            ('pdb/entry/residue_listing', self.get_residue_listing()),
+            ('mappings', self.get_mappings()),
+            ('nucleic_mappings', {}),
+            ('validation/global-percentiles/entry', self.get_validation()),
+            ('validation/protein-RNA-DNA-geometry-outlier-residues/entry',
+             self.get_residue_validation()),
+            ('validation/protein-ramachandran-sidechain-outliers/entry',
+             self.get_ramachandran_validation()),
+        ):
+            items['plugin:' + plugin.pdb._get_url(api_url, self.pdbid)] = data
+        items['pymol:' + plugin._UPDATED_FTP % self.pdbid] = self.get_mm_cif()
+        return items
+
+
+@pytest.fixture
+def synthetic_entry(web_cache):
+    """Returns a function which makes a SyntheticEntry servable by the plugin.
+
+    The function takes the arguments of SyntheticEntry and returns the entry.
+    """
+    if not web_cache:
+        pytest.skip('synthetic entries are served by the web cache')
+
+    def add_entry(**kwargs):
+        entry = SyntheticEntry(**kwargs)
+        web_cache.add_synthetic(entry.get_web_cache_items())
+        return entry
+
+    yield add_entry
+
+    web_cache.clear_synthetic()
+
+
 @pytest.fixture(autouse=True)
 def cache_url_data_for_plugin(monkeypatch, web_cache):
     """Cache data returned from URLs fetched over the network.
@@ -183,6 +528,7 @@ def cache_url_data_for_plugin(monkeypatch, web_cache):
         monkeypatch.setattr(plugin.pdb._fetcher, 'get_data',
                             web_cache.access_plugin_url)
         monkeypatch.setattr(pymol.cmd, 'file_read', web_cache.access_pymol_url)
+        monkeypatch.setattr(plugin, '_read_raw_file', web_cache.access_raw_url)
 
     yield  # each test runs here
 
@@ -205,9 +551,10 @@ def chdir_back_to_pwd(monkeypatch):
 # ----- Unit Tests -----
 
 
-def test_pdb_fetcher_with_requests(requests_mock):
+def test_pdb_fetcher_with_requests(requests_mock, monkeypatch):
     """Tests the PDB json data fetcher class using requests library."""
 
+    monkeypatch.setattr(plugin.RateLimiter, 'backoff', 0)
     fetcher = plugin.PdbFetcher()
 
     # Test a response with status code 200 (ie. OK)
@@ -227,6 +574,36 @@ def test_pdb_fetcher_with_requests(requests_mock):
         assert isinstance(data, dict)
         assert data == {}
 
+    # Throttled requests are retried after the Retry-After time.
+    requests_mock.get('http://testpdb/busy', [
+        {
+            'status_code': 429,
+            'headers': {
+                'Retry-After': '0'
+            }
+        },
+        {
+            'status_code': 503
+        },
+        {
+            'json': good_response
+        },
+    ])
+    call_count = requests_mock.call_count
+    assert fetcher.get_data('http://testpdb/busy', 'data') == good_response
+    assert requests_mock.call_count == call_count + 3
+    assert plugin.api_rate_limiter._current_rate < 10
+
+    # Server errors are retried without slowing down other requests.
+    plugin.api_rate_limiter.set_limits(10, 10, 4)
+    requests_mock.get('http://testpdb/error', [{
+        'status_code': 500
+    }, {
+        'json': good_response
+    }])
+    assert fetcher.get_data('http://testpdb/error', 'data') == good_response
+    assert plugin.api_rate_limiter._current_rate == 10
+
 
 class ImportModuleMock(object):
     """Exclude specified modules from loading in importlib.import_module."""
@@ -253,6 +630,7 @@ def test_pdb_fetcher_with_urllib(monkeypatch):
 
     # PDB fetcher uses 'requests' library by default. We'll prevent that here
     # such that it falls back to urllib.
+    monkeypatch.setattr(plugin.RateLimiter, 'backoff', 0)
     mock = ImportModuleMock('requests')
     monkeypatch.setattr(importlib, 'import_module', mock.import_module)
     # We're ready to get a fetcher using urllib.
@@ -289,6 +667,7 @@ def test_pdb_fetcher_with_urllib(monkeypatch):
             urllib_error.HTTPError(None, 403, None, None, None),
             urllib_error.HTTPError(None, 404, None, None, None),
             urllib_error.HTTPError(None, 500, None, None, None),
+            urllib_error.HTTPError(None, 429, None, {'Retry-After': '0'}, None),
             urllib_error.URLError(None),
             socket.timeout(),
     ):
@@ -302,6 +681,14 @@ def test_pdb_fetcher_with_urllib(monkeypatch):
         assert isinstance(data, dict)
         assert data == {}
 
+    # Every retried attempt counts as an API request.
+    monkeypatch.setattr(
+        urllib_request, 'urlopen', lambda *arg: _raise(
+            urllib_error.HTTPError(None, 500, None, None, None)))
+    plugin.profiler.start()
+    fetcher.get_data('http://testpdb/bad', 'no data', sleep_min=0, sleep_max=0)
+    assert plugin.profiler.stop()['counters']['api requests'] == 5
+
 
 def test_pdb_fetcher_missing_libraries(monkeypatch):
     """Tests the PDB json data fetcher with missing libraries."""
@@ -318,6 +705,241 @@ def test_pdb_fetcher_missing_libraries(monkeypatch):
         raise Exception('No missing library Exception from PdbFetcher')
 
 
+def test_rate_limiter(monkeypatch):
+    """Tests limiting the rate and concurrency of PDB API requests."""
+    limiter = plugin.RateLimiter(rate=100, burst=2, max_concurrent=1)
+    start = time.time()
+    for i in range(4):
+        with limiter.request('https://host1/api/%d' % i):
+            pass
+    # Two requests in a burst, then one every 10 ms.
+    assert 0.015 < time.time() - start < 1
+
+    # Requests to the same host wait for each other.
+    events = []
+
+    def request(name):
+        with limiter.request('https://host2/api'):
+            events.append(name + ' start')
+            time.sleep(0.05)
+            events.append(name + ' end')
+
+    threads = [threading.Thread(target=request, args=(name,)) for name in 'ab']
+    for thread in threads:
+        thread.start()
+    with limiter.request('https://host1/api'):
+        events.append('other host')
+    for thread in threads:
+        thread.join(10)
+    events.remove('other host')
+    assert events in (['a start', 'a end', 'b start',
+                       'b end'], ['b start', 'b end', 'a start', 'a end'])
+
+    # Throttling halves the rate and pauses for the Retry-After time.
+    limiter.throttled('0.1')
+    assert limiter._current_rate == 50
+    start = time.time()
+    with limiter.request('https://host1/api'):
+        assert time.time() - start > 0.09
+    limiter.succeeded()
+    assert limiter._current_rate == 60
+    assert limiter._parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert limiter._parse_retry_after('soon') is None
+
+    # Batch workers share the limits; the number of workers doesn't depend on
+    # them.
+    monkeypatch.setattr(plugin, 'api_rate_limiter', limiter)
+    limiter.set_limits(1, 8, 4)
+    assert plugin._get_num_processes(8, 100) == 8
+    assert plugin._get_num_processes(8, 2) == 2
+    api_slots = threading.Semaphore(1)
+    plugin._start_batch_worker_sharing_limits(lambda: None, 4, api_slots)
+    assert (limiter.rate, limiter.burst, limiter.max_concurrent) == (0.25, 2, 4)
+    # Requests in flight hold one of the slots shared by all workers.
+    with limiter.request('https://host1/api'):
+        assert not api_slots.acquire(False)
+    assert api_slots.acquire(False)
+
+
+def test_mirrors(monkeypatch):
+    """Tests failover and hedging between mirrors."""
+    delays = {'slow': 0.05, 'fast': 0.01}
+    urls = []
+
+    def read(url):
+        urls.append(url)
+        host = url.split('/')[2]
+        if host == 'down':
+            raise IOError('%s is down' % host)
+        time.sleep(delays[host])
+        return host
+
+    mirrors = plugin.Mirrors(
+        'https://pdb/api',
+        ['https://slow/api', 'https://down/api/', 'https://fast/api'])
+    # Each mirror is tried once, then the fastest healthy one is used.
+    results = [mirrors.fetch('https://pdb/api/x', read) for i in range(3)]
+    assert results == ['slow', 'fast', 'fast']
+    assert urls == [
+        'https://slow/api/x', 'https://down/api/x', 'https://fast/api/x',
+        'https://fast/api/x'
+    ]
+    with pytest.raises(IOError):
+        plugin.Mirrors('https://pdb',
+                       ['https://down']).fetch('https://pdb/x', read)
+
+    # Slow requests are repeated at the next mirror.
+    mirrors = plugin.Mirrors('https://pdb/api',
+                             ['https://slow/api', 'https://fast/api'])
+    mirrors.hedge_percentile = 90
+    slow, fast = mirrors._mirrors
+    slow.latencies.extend([0.01] * mirrors.min_samples)
+    slow.latency, fast.latency = 0.01, 0.02
+    delays['slow'] = 1
+    start = time.time()
+    assert mirrors.fetch('https://pdb/api/x', read) == 'fast'
+    assert time.time() - start < 0.5
+
+    # The fetcher fails over to other API mirrors.
+    canonical = plugin.api_mirrors.canonical
+    monkeypatch.setattr(plugin, 'api_mirrors',
+                        plugin.Mirrors(canonical, ['https://down', canonical]))
+    fetcher = plugin.PdbFetcher()
+
+    def fetch(url, description):
+        if url.startswith('https://down'):
+            raise plugin.NoResponseError('No response')
+        return {'url': url}
+
+    monkeypatch.setattr(fetcher, '_fetcher', fetch)
+    url = plugin.pdb._get_url('pdb/entry/summary', '3mzw')
+    assert fetcher.get_data(url, 'summary') == {'url': url}
+    plugin.api_mirrors.set_urls(['https://down'])
+    assert fetcher.get_data(url, 'summary') == {}
+
+
+def get_data_in_threads(fetchers, url, started, release, num_threads=3):
+    """Returns the data or errors of concurrent get_data calls of url."""
+    results = []
+
+    def get_data(fetcher):
+        try:
+            results.append(fetcher.get_data(url, 'data'))
+        except Exception as e:
+            results.append(e)
+
+    threads = [
+        threading.Thread(target=get_data, args=(fetchers[i % len(fetchers)],))
+        for i in range(num_threads)
+    ]
+    started.clear()
+    release.clear()
+    threads[0].start()
+    assert started.wait(10)
+    for thread in threads[1:]:
+        thread.start()
+    while plugin.PdbFetcher._flights[url].waiters < num_threads - 1:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_pdb_fetcher_coalesces_requests(monkeypatch):
+    """Tests that identical requests in flight share one download."""
+    started = threading.Event()
+    release = threading.Event()
+    urls = []
+
+    def fetch(url, description):
+        urls.append(url)
+        started.set()
+        release.wait(10)
+        if url.endswith('bad'):
+            raise socket.timeout('timed out')
+        return {'url': url}
+
+    fetchers = [plugin.PdbFetcher(), plugin.PdbFetcher()]
+    for fetcher in fetchers:
+        monkeypatch.setattr(fetcher, '_fetcher', fetch)
+    monkeypatch.setattr(plugin.PdbFetcher, 'coalesced_requests', 0)
+    url = 'http://testpdb/good'
+    results = get_data_in_threads(fetchers, url, started, release)
+    assert results == [{'url': url}] * 3
+    # Each caller gets its own data to modify.
+    assert len(set(map(id, results))) == 3
+    results = get_data_in_threads(fetchers, 'http://testpdb/bad', started,
+                                  release)
+    assert list(map(type, results)) == [socket.timeout] * 3
+    assert urls == [url, 'http://testpdb/bad']
+    assert plugin.PdbFetcher.coalesced_requests == 4
+    assert not plugin.PdbFetcher._flights
+    # Later requests are downloaded again.
+    assert fetchers[1].get_data(url, 'data') == {'url': url}
+    assert len(urls) == 3
+    # The data is copied without blocking other requests.
+    copied_while_locked = []
+
+    class Data(dict):
+
+        def __deepcopy__(self, memo):
+            copied_while_locked.append(plugin.PdbFetcher._flights_lock.locked())
+            return Data(self)
+
+    for fetcher in fetchers:
+        monkeypatch.setattr(
+            fetcher, '_fetcher',
+            lambda url, description: Data(fetch(url, description)))
+    results = get_data_in_threads(fetchers, 'http://testpdb/copy', started,
+                                  release)
+    assert results == [{'url': 'http://testpdb/copy'}] * 3
+    assert copied_while_locked and not any(copied_while_locked)
+
+
+def test_pdb_fetcher_cancelled_request(monkeypatch):
+    """Tests that requests waiting for a cancelled analysis still get data."""
+    started = threading.Event()
+    releases = [threading.Event(), threading.Event()]  # of each download
+    urls = []
+
+    def fetch(url, description):
+        release = releases[len(urls)]
+        urls.append(url)
+        started.set()
+        release.wait(10)
+        plugin.AnalysisTask.check_cancelled()
+        return {'url': url}
+
+    fetcher = plugin.PdbFetcher()
+    monkeypatch.setattr(fetcher, '_fetcher', fetch)
+    url = 'http://testpdb/cancelled'
+    task = plugin.AnalysisTask(fetcher.get_data, url, 'data')
+    assert started.wait(10)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(fetcher.get_data(url, 'data')))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    while plugin.PdbFetcher._flights[url].waiters < 2:
+        time.sleep(0.01)
+    task.cancel()
+    releases[0].set()
+    assert task.wait(10)
+    assert task.phase == 'cancelled'
+    # One waiter downloads the data again, the other one waits for it.
+    while len(urls) < 2 or plugin.PdbFetcher._flights[url].waiters < 1:
+        time.sleep(0.01)
+    releases[1].set()
+    for thread in threads:
+        thread.join(10)
+    assert results == [{'url': url}] * 2
+    assert urls == [url] * 2
+    assert not plugin.PdbFetcher._flights
+
 def test_pdb_autocomplete(capsys):
     """Tests the PDB ID autocomplete class."""
 
@@ -361,28 +983,10 @@ def test_pdb_autocomplete(capsys):
         captured = capsys.readouterr()
         assert 'Title for %s' % key.lower() in captured.out
 
-    # --- Check cache purge path.
-    autocompleter = plugin.PdbIdAutocomplete(
-        get_summary=lambda key: {key: [{
-            'title': 'Title for ' + key
-        }]})
-    # fill up cache with new keys
-    for i in range(plugin.PdbIdAutocomplete.MAX_CACHE_SIZE):
-        key = 'key%d' % i
-        completion = autocompleter.interpret(key)
-        assert completion == key
-        captured = capsys.readouterr()
-        assert 'Title for %s' % key in captured.out
-    # exceed cache size; will execute cache purge code path
-    key = 'purge_key'
-    completion = autocompleter.interpret(key)
-    assert completion == key
-    captured = capsys.readouterr()
-    assert 'Title for %s' % key in captured.out
-
     # --- Get None when invalid summary format is returned.
     autocompleter = plugin.PdbIdAutocomplete(
-        get_summary=lambda key: {key: 'Title for ' + key})
+        get_summary=lambda key: {key: 'Title for ' + key},
+        cache=plugin.TitleCache())
     key = 'good_key'
     completion = autocompleter.interpret(key)
     assert completion is None
@@ -396,9 +1000,134 @@ def test_pdb_autocomplete(capsys):
     assert 'HER2' in captured.out
 
 
-def test_initialize():
+def test_title_cache(tmpdir, monkeypatch):
+    """Tests the shared LRU cache of entry titles."""
+    path = str(tmpdir.join('titles', 'titles.json'))
+    cache = plugin.TitleCache(path, max_size=3)
+    looked_up = []
+
+    def get_summary(key):
+        looked_up.append(key)
+        if key == 'bad1':
+            return None
+        return {key: [{'title': 'Title for ' + key}]}
+
+    autocompleter = plugin.PdbIdAutocomplete(get_summary=get_summary,
+                                             cache=cache)
+    for key in ['1abc', '2abc', '1abc', '3abc', '4abc']:
+        autocompleter.interpret(key)
+    # 2abc was the least recently used title.
+    assert looked_up == ['1abc', '2abc', '3abc', '4abc']
+    assert (cache.hits, cache.misses) == (1, 4)
+    assert '2abc' not in cache and '1abc' in cache
+    # Misses expire sooner than hits.
+    monkeypatch.setattr(cache, 'miss_ttl', -1)
+    for i in range(2):
+        assert autocompleter.interpret('bad1') is None
+    assert looked_up.count('bad1') == 2
+    assert cache.get('bad1') is plugin.TitleCache.MISSING
+    assert autocompleter.interpret('4abc') == '4abc'
+    assert looked_up.count('4abc') == 1
+
+    # The cache is saved and shared with later sessions.
+    cache.save()
+    cache = plugin.TitleCache(path)
+    assert cache.get('4abc') == 'Title for 4abc'
+    assert cache.get('2abc') is plugin.TitleCache.MISSING
+
+    # Titles fetched by PDBe_startup are reused.
+    plugin.PDBe_startup('3mzw', 'molecules')
+    assert 'HER2' in plugin.title_cache.get('3mzw')
+    # Entries without response from the PDB are not cached as invalid.
+    monkeypatch.setattr(plugin.pdb, 'get_summary', lambda pdbid: {})
+    plugin.PDBe_startup('1abc', 'molecules')
+    assert '1abc' not in plugin.title_cache
+
+
+def test_pdb_id_index(tmpdir, capsys, monkeypatch):
+    """Tests autocompletion from the local PDB ID index."""
+    index = plugin.PdbIdIndex(str(tmpdir.join('index', 'pdb_ids.idx')))
+    assert len(index) == 0
+    assert index.find('1') == (0, [])
+    id_file = tmpdir.join('pdb_ids.txt')
+    id_file.write_text(
+        u'3MZW\tHER2 in complex with an affibody\n'
+        u'3mxw sonic hedgehog \u00e9pitope\n'
+        u'3l2p\n'
+        u'bad_id title\n', 'utf-8')
+    assert index.update(plugin._read_index_entries(str(id_file))) == 3
+    # Entries without titles keep their indexed title.
+    assert index.update([('3l2p', 'DNA ligase'), ('3mzw', '')]) == 3
+    her2 = 'HER2 in complex with an affibody'
+    assert index.find('3m') == (2, [('3mxw', u'sonic hedgehog \u00e9pitope'),
+                                    ('3mzw', her2)])
+    assert index.find('3', 1) == (3, [('3l2p', 'DNA ligase')])
+    assert index.get_title('3MZW') == her2
+    assert index.get_title('3mz') is None
+
+    def fail(key):
+        raise Exception('summary of %s fetched' % key)
+
+    autocompleter = plugin.PdbIdAutocomplete(get_summary=fail, index=index)
+    assert autocompleter.interpret('3l') == '3l2p'
+    assert autocompleter.interpret('3M') == ['3mxw', '3mzw']
+    assert 'HER2' in capsys.readouterr().out
+    assert autocompleter.interpret('3mzw') == '3mzw'
+    assert autocompleter.interpret('4')[0].startswith('4[alphanumeric]')
+    monkeypatch.setattr(autocompleter, 'MAX_CANDIDATES', 2)
+    assert '(3 entries)' in autocompleter.interpret('')
+    index.close()
+
+
+def test_pdb_autocomplete_async(tmpdir, capsys, monkeypatch):
+    """Tests that titles are looked up in the background."""
+    monkeypatch.setattr(plugin.PdbIdAutocomplete, 'LOOKUP_DELAY', 0.2)
+    index = plugin.PdbIdIndex(str(tmpdir.join('pdb_ids.idx')))
+    index.update([('3l2p', '')])
+    looked_up = []
+
+    def get_summary(key):
+        looked_up.append(key)
+        if key != '3mzw':
+            return None
+        return {key: [{'title': 'Title for ' + key}]}
+
+    autocompleter = plugin.PdbIdAutocomplete(get_summary=get_summary,
+                                             index=index,
+                                             asynchronous=True)
+    assert autocompleter.interpret('3mzw') == [
+        '3mzw (looking up title)', '\x7f'
+    ]
+    # Keys are looked up once, the latest first, after typing stopped.
+    autocompleter.interpret('3mzx')
+    autocompleter.interpret('3mzw')
+    assert autocompleter.interpret('3l') == '3l2p'
+    assert not looked_up
+    assert autocompleter.wait_for_lookups(10)
+    assert looked_up == ['3mzw', '3mzx', '3l2p']
+    # The lookup thread doesn't print; the next completion does.
+    assert 'Title for 3mzw' not in capsys.readouterr().out
+    assert autocompleter.interpret('3mzw') == '3mzw'
+    out = capsys.readouterr().out
+    assert '3mzw: Title for 3mzw' in out
+    assert '3mzx: not a valid PDB ID' in out
+    assert autocompleter.interpret('3mzx') is None
+    assert len(looked_up) == 3
+    index.close()
+
+    # Commands share one asynchronous autocompleter.
+    monkeypatch.setattr(plugin, '_autocomplete_state', {'completer': None})
+    completer = plugin.PDB_ID_AUTOCOMPLETE[0]()
+    assert completer is plugin.PDB_ID_AUTOCOMPLETE[0]()
+    assert completer._asynchronous
+
+
+def test_initialize(monkeypatch):
     """Tests initialization fuction."""
     logger = logging.getLogger()
+    # initialize() sets the budget from preferences; restore it afterwards.
+    monkeypatch.setattr(plugin.Assemblies, 'atom_budget',
+                        plugin.Assemblies.atom_budget)
 
     # When unset (first time use of plugin), set preference to WARNING.
     pymol.plugins.pref_set(PREF_LOGLEVEL, None)
@@ -422,19 +1151,242 @@ def test_initialize():
     assert loglevel == 'BOgus'
     assert logger.getEffectiveLevel() == logging.WARNING
 
+    # Integer preferences fall back to their default when invalid.
+    pymol.plugins.pref_set('PDB_PLUGIN_ASSEMBLY_ATOM_BUDGET', 'many')
+    assert plugin._get_int_pref('PDB_PLUGIN_ASSEMBLY_ATOM_BUDGET', 7) == 7
+    pymol.plugins.pref_set('PDB_PLUGIN_ASSEMBLY_ATOM_BUDGET', None)
+    assert plugin._get_int_pref('PDB_PLUGIN_ASSEMBLY_ATOM_BUDGET', 7) == 7
+    assert pymol.plugins.pref_get('PDB_PLUGIN_ASSEMBLY_ATOM_BUDGET') == 7
+    pymol.plugins.pref_set('PDB_PLUGIN_ASSEMBLY_ATOM_BUDGET', None)
+
+    # Unknown structure formats fall back to mmCIF.
+    monkeypatch.setattr(plugin.StructureDownload, 'preferred_format', 'cif')
+    pymol.plugins.pref_set('PDB_PLUGIN_STRUCTURE_FORMAT', 'bcif')
+    plugin.initialize()
+    assert plugin.StructureDownload.preferred_format == 'bcif'
+    pymol.plugins.pref_set('PDB_PLUGIN_STRUCTURE_FORMAT', 'pdb')
+    plugin.initialize()
+    assert plugin.StructureDownload.preferred_format == 'cif'
+    pymol.plugins.pref_set('PDB_PLUGIN_STRUCTURE_FORMAT', None)
+
+
+# BinaryCIF test data is encoded from the mmCIF structures in the web cache.
+BCIF_BYTE_ARRAY_TYPES = {'<i1': 1, '<i4': 3, '<f8': 33}
+BCIF_CATEGORIES = {
+    'atom_site': [('group_PDB', 's'), ('id', 'i'), ('type_symbol', 's'),
+                  ('label_atom_id', 's'), ('label_alt_id', 's'),
+                  ('label_comp_id', 's'), ('label_asym_id', 's'),
+                  ('label_entity_id', 's'), ('label_seq_id', 's'),
+                  ('pdbx_PDB_ins_code', 's'), ('Cartn_x', 'f'),
+                  ('Cartn_y', 'f'), ('Cartn_z', 'f'), ('occupancy', 'f'),
+                  ('B_iso_or_equiv', 'f'), ('auth_seq_id', 'i'),
+                  ('auth_comp_id', 's'), ('auth_asym_id', 's'),
+                  ('auth_atom_id', 's'), ('pdbx_PDB_model_num', 'i')],
+    'struct_conf': [('conf_type_id', 's'), ('beg_auth_asym_id', 's'),
+                    ('beg_auth_seq_id', 'i'), ('end_auth_seq_id', 'i')],
+    'struct_sheet_range': [('beg_auth_asym_id', 's'), ('beg_auth_seq_id', 'i'),
+                           ('end_auth_seq_id', 'i')],
+    'pdbx_struct_assembly': [('id', 's')],
+    'pdbx_struct_assembly_gen': [('assembly_id', 's'), ('oper_expression', 's'),
+                                 ('asym_id_list', 's')],
+    'pdbx_struct_oper_list': [('id', 's')] + [
+        ('matrix[%d][%d]' % (i, j), 'f') for i in (1, 2, 3) for j in (1, 2, 3)
+    ] + [('vector[%d]' % i, 'f') for i in (1, 2, 3)],
+}
+
+
+def bcif_byte_array(values, dtype):
+    return (numpy.asarray(values).astype(dtype).tobytes(), [{
+        'kind': 'ByteArray',
+        'type': BCIF_BYTE_ARRAY_TYPES[dtype]
+    }])
+
+
+def bcif_integer_packing(values):
+    packed = []
+    for value in values:
+        while value >= 127 or value <= -128:
+            limit = 127 if value > 0 else -128
+            packed.append(limit)
+            value -= limit
+        packed.append(value)
+    data, encoding = bcif_byte_array(packed, '<i1')
+    return data, [{
+        'kind': 'IntegerPacking',
+        'byteCount': 1,
+        'isUnsigned': False,
+        'srcSize': len(values)
+    }] + encoding
+
+
+def bcif_delta(values):
+    origin = int(values[0]) if len(values) else 0
+    diffs = numpy.diff(values, prepend=origin).astype(int).tolist()
+    data, encoding = bcif_integer_packing(diffs)
+    return data, [{'kind': 'Delta', 'origin': origin, 'srcType': 3}] + encoding
+
+
+def bcif_run_length(values):
+    pairs = []
+    for value in values:
+        if pairs and pairs[-2] == value:
+            pairs[-1] += 1
+        else:
+            pairs += [value, 1]
+    data, encoding = bcif_integer_packing(pairs)
+    return data, [{
+        'kind': 'RunLength',
+        'srcType': 3,
+        'srcSize': len(values)
+    }] + encoding
+
+
+def bcif_encode_column(name, values):
+    """Encodes values like the PDBe BinaryCIF encoder does."""
+    column = {'name': name, 'mask': None}
+    if values and isinstance(values[0], float):
+        fixed_point = numpy.round(numpy.array(values) * 1000)
+        data, encoding = bcif_delta(fixed_point.astype(int))
+        encoding.insert(0, {
+            'kind': 'FixedPoint',
+            'factor': 1000,
+            'srcType': 33
+        })
+    elif values and isinstance(values[0], int):
+        data, encoding = bcif_delta(values)
+    else:
+        strings = []
+        indices = []
+        for value in values:
+            if value in ('.', '?'):
+                indices.append(-1)
+                continue
+            if value not in strings:
+                strings.append(value)
+            indices.append(strings.index(value))
+        offsets, offset_encoding = bcif_delta(
+            numpy.cumsum([0] + [len(x) for x in strings]))
+        data, data_encoding = bcif_run_length(indices)
+        encoding = [{
+            'kind': 'StringArray',
+            'dataEncoding': data_encoding,
+            'stringData': ''.join(strings),
+            'offsetEncoding': offset_encoding,
+            'offsets': offsets
+        }]
+        mask = [
+            ('', '.', '?').index(x) if x in ('.', '?') else 0 for x in values
+        ]
+        if any(mask):
+            mask_data, mask_encoding = bcif_run_length(mask)
+            column['mask'] = {'data': mask_data, 'encoding': mask_encoding}
+    column['data'] = {'data': data, 'encoding': encoding}
+    return column
+
+
+def bcif_encode_object(name):
+    """Returns BinaryCIF file contents encoded from an object's mmCIF data."""
+    msgpack = pytest.importorskip('msgpack')
+    categories = []
+    for category, items in BCIF_CATEGORIES.items():
+        columns = []
+        for item, dtype in items:
+            values = pymol.querying.cif_get_array(
+                name, '_%s.%s' % (category, item.lower()), dtype)
+            if values:
+                values = ['?' if x is None else x for x in values]
+                columns.append(bcif_encode_column(item, values))
+                row_count = len(values)
+        if columns:
+            categories.append({
+                'name': '_' + category,
+                'rowCount': row_count,
+                'columns': columns
+            })
+    blocks = [{'header': name.upper(), 'categories': categories}]
+    return msgpack.packb(
+        {
+            'encoder': 'tests',
+            'version': '0.3.0',
+            'dataBlocks': blocks
+        },
+        use_bin_type=True)
+
+
+def test_binary_cif_decode():
+    """Tests decoding of BinaryCIF column encodings."""
+    ints = [1, 2, 2, 2, 500, -400, 7]
+    decoded = plugin.BinaryCif.decode(bcif_encode_column('x', ints)['data'])
+    assert decoded.tolist() == ints
+    data, encoding = bcif_run_length(ints)
+    decoded = plugin.BinaryCif.decode({'data': data, 'encoding': encoding})
+    assert decoded.tolist() == ints
+    floats = [1.234, -2.5, 100.001]
+    decoded = plugin.BinaryCif.decode(bcif_encode_column('x', floats)['data'])
+    assert numpy.allclose(decoded, floats)
+    data, encoding = bcif_byte_array([0, 2, 4], '<i4')
+    encoding.insert(
+        0, {
+            'kind': 'IntervalQuantization',
+            'min': 1.0,
+            'max': 2.0,
+            'numSteps': 5,
+            'srcType': 33
+        })
+    decoded = plugin.BinaryCif.decode({'data': data, 'encoding': encoding})
+    assert numpy.allclose(decoded, [1.0, 1.5, 2.0])
+    strings = ['A', 'B', '.', 'A', '?', 'CA']
+    column = bcif_encode_column('x', strings)
+    decoded = plugin.BinaryCif.decode(column['data'])
+    assert decoded.tolist() == ['A', 'B', '', 'A', '', 'CA']
+    assert plugin.BinaryCif.decode(
+        column['mask']).tolist() == [0, 0, 1, 0, 2, 0]
+    with pytest.raises(ValueError):
+        plugin.BinaryCif.decode({'data': b'', 'encoding': [{'kind': 'Bogus'}]})
+
 
 # ----- Integration Tests -----
 
 
-def test_initialize_plugin():
+def test_initialize_plugin(monkeypatch):
     # Initialize the plugin, but don't perform any actions. The initialization
     # can't actually 'addmenuitemqt' since pymol.qt hasn't been initialized, but
     # that's OK, we just want to check that the python code in the plugin
     # initialization doesn't crash.
+    monkeypatch.setattr(plugin, '_gui_state', dict(plugin._gui_state))
     plugin.__init_plugin__()
     assert True
 
 
+# Measured in a fresh process since this one has everything imported already.
+STARTUP_SCRIPT = '''
+import json, sys, time
+import pymol
+from pymol import cmd
+import pymol.plugins
+start = time.time()
+import PDB_plugin
+PDB_plugin.__init_plugin__()
+seconds = time.time() - start
+deferred = ['multiprocessing', 'pymol.Qt', 'requests', 'urllib3']
+print(json.dumps({'seconds': seconds,
+                  'loaded': [m for m in deferred if m in sys.modules]}))
+'''
+
+
+def test_plugin_startup_time(tmpdir):
+    """Tests that the plugin defers its heavy imports at startup."""
+    env = dict(os.environ, HOME=str(tmpdir))  # keep pref_save in tmpdir
+    output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT],
+                                     cwd=os.path.dirname(
+                                         os.path.abspath(plugin.__file__)),
+                                     env=env)
+    result = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+    print('plugin startup: %.3f seconds' % result['seconds'])
+    assert result['loaded'] == []
+    assert result['seconds'] < 1.0
+
+
 # This is a quick and dirty way to get up the test coverage initially just to
 # check for fatal problems in the code. It doesn't check correctness.
 @pytest.mark.parametrize(
@@ -524,28 +1476,35 @@ def test_gui_api(monkeypatch):
             monkeypatch.setattr(gui, '_get_pdbid', lambda *arg: pdbid
                                 if ok_pressed else None)
 
+    def analyze(function):
+        function()
+        # Analyses run in the background.
+        if gui.task is not None:
+            assert gui.task.wait(60)
+            assert gui.task.error is None
+
     patch_pdbid_input('3l2p')
-    gui.analyze_molecules()
+    analyze(gui.analyze_molecules)
     assert plugin.count_chains() == 4
 
     pymol.cmd.reinitialize()
     patch_pdbid_input('3b43')
-    gui.analyze_domains()
+    analyze(gui.analyze_domains)
     assert plugin.count_chains() == 1
 
     pymol.cmd.reinitialize()
     patch_pdbid_input('2gc2')
-    gui.analyze_validation()
+    analyze(gui.analyze_validation)
     assert plugin.count_chains() == 2
 
     pymol.cmd.reinitialize()
     patch_pdbid_input('5j96')
-    gui.analyze_assemblies()
+    analyze(gui.analyze_assemblies)
     assert plugin.count_chains() == 3
 
     pymol.cmd.reinitialize()
     patch_pdbid_input('3mzw')
-    gui.analyze_all()
+    analyze(gui.analyze_all)
     assert plugin.count_chains() == 2
 
     # Test code doesn't crash when user cancels pdbid input, inputs nothing, or
@@ -555,11 +1514,49 @@ def test_gui_api(monkeypatch):
                               ('bogus', True)]:
         print('user input', pdbid, ok_pressed)
         patch_pdbid_input(pdbid, ok_pressed)
-        gui.analyze_molecules()
-        gui.analyze_domains()
-        gui.analyze_validation()
-        gui.analyze_assemblies()
-        gui.analyze_all()
+        analyze(gui.analyze_molecules)
+        analyze(gui.analyze_domains)
+        analyze(gui.analyze_validation)
+        analyze(gui.analyze_assemblies)
+        analyze(gui.analyze_all)
+
+
+def test_analysis_task(monkeypatch):
+    """Tests analyzing entries in the background."""
+    progress = []
+    report_progress = plugin._report_progress
+
+    def record_progress(phase, fraction):
+        report_progress(phase, fraction)
+        progress.append((phase, fraction))
+
+    monkeypatch.setattr(plugin, '_report_progress', record_progress)
+    task = plugin.AnalysisTask(plugin.PDBe_startup, '3l2p', 'molecules')
+    assert task.wait(60)
+    assert (task.phase, task.fraction, task.error) == ('done', 1.0, None)
+    assert plugin.count_chains() == 4
+    assert [phase for phase, _ in progress] == [
+        'fetching summary', 'fetching analysis data', 'loading structure',
+        'molecules'
+    ]
+    assert sorted(progress, key=lambda x: x[1]) == progress
+    assert plugin.AnalysisTask.get_current() is None
+
+    # Cancelled analyses stop before their next download.
+    pymol.cmd.reinitialize()
+    started = threading.Event()
+
+    def analyze():
+        started.set()
+        while not plugin.AnalysisTask.get_current().cancelled:
+            time.sleep(0.01)
+        plugin.PdbFetcher().get_data('http://testpdb/good', 'data')
+
+    task = plugin.AnalysisTask(analyze)
+    assert started.wait(10)
+    task.cancel()
+    assert task.wait(10)
+    assert (task.phase, task.error) == ('cancelled', None)
 
 
 def test_gui_missing_libraries(monkeypatch):
@@ -642,6 +1639,1110 @@ def test_object_atom_count():
         assert expected_objects[object_name] == atom_count
 
 
+def test_domain_types(monkeypatch):
+    """Tests 'domains' analysis restricted to selected domain types."""
+    assert plugin.Domains.parse_domain_types(None) == list(
+        plugin.Domains.DOMAIN_TYPES)
+    assert plugin.Domains.parse_domain_types('pfam, CATH bogus') == [
+        'Pfam', 'CATH'
+    ]
+
+    # 3mzw has no nucleotides, so nucleic domains must not be fetched.
+    def fail(pdbid):
+        raise Exception('nucleic domains fetched for %s' % pdbid)
+
+    monkeypatch.setattr(plugin.pdb, 'get_nucleic_domains', fail)
+    plugin.PDB_Analysis_Domains('3mzw', 'Pfam')
+    object_names = pymol.cmd.get_object_list()
+    assert 'Pfam_PF01030_' in object_names
+    assert not [name for name in object_names if name.startswith('CATH_')]
+
+
+def get_atom_counts():
+    return dict((name, pymol.cmd.count_atoms(name))
+                for name in pymol.cmd.get_object_list())
+
+
+def test_analysis_cache(monkeypatch):
+    """Tests that repeated and overlapping analyses replay their plans."""
+    plugin.PDB_Analysis_Domains('3mzw', 'Pfam')
+    expected_atom_counts = get_atom_counts()
+    molecules_class = plugin.Molecules
+
+    def fail(pdbid):
+        raise Exception('%s analyzed again' % pdbid)
+
+    monkeypatch.setattr(plugin, 'Molecules', fail)
+    plugin.PDB_Analysis_Molecules('3mzw')
+    plugin.PDB_Analysis_Domains('3mzw', 'Pfam')
+    assert get_atom_counts() == expected_atom_counts
+
+    # Only objects which no longer exist are created again.
+    pymol.cmd.delete('Pfam_PF01030_')
+    pymol.cmd.delete('NACETYLDGLUCOSAMINE')
+    report = plugin.PDB_Profile('3mzw', 'molecules')
+    assert report['counters']['cmd.create'] == 1
+    plugin.PDB_Analysis_Domains('3mzw', 'Pfam')
+    assert get_atom_counts() == expected_atom_counts
+
+    # Only the missing domain types are analyzed.
+    with pytest.raises(Exception, match='analyzed again'):
+        plugin.PDB_Analysis_Domains('3mzw', 'CATH')
+    monkeypatch.setattr(plugin, 'Molecules', molecules_class)
+    plugin.PDB_Analysis_Domains('3mzw', 'CATH')
+    assert 'CATH_3.80.20.20_3mzwA01' in pymol.cmd.get_object_list()
+
+    # A new revision of the entry is analyzed again.
+    monkeypatch.setattr(plugin.StructureCache, 'get_revision',
+                        staticmethod(lambda summary, pdbid: '2099-01-01'))
+    monkeypatch.setattr(plugin, 'Molecules', fail)
+    with pytest.raises(Exception, match='analyzed again'):
+        plugin.PDB_Analysis_Molecules('3mzw')
+
+
+def test_overlapping_recordings():
+    """Tests recording the PyMOL commands of overlapping analyses."""
+    recorded = threading.Event()
+    release = threading.Event()
+
+    def show(name):
+        plugin.cmd.pseudoatom(name)
+        recorded.set()
+        release.wait(30)
+
+    # The recording of this thread ends while the other one goes on.
+    thread = threading.Thread(target=plugin.AnalysisCache._record,
+                              args=(lambda: show('other'),))
+    thread.start()
+    assert recorded.wait(30)
+    plan = plugin.AnalysisCache._record(lambda: plugin.cmd.pseudoatom('own'))
+    assert [command.args for command in plan] == [('own',)]
+    release.set()
+    thread.join()
+    assert not plugin.cmd.observers
+    assert plugin.AnalysisCache._record(lambda: None) == []
+
+    # Only commands changing what is shown are recorded, not queries.
+    def show_with_queries():
+        plugin.cmd.count_atoms('own')
+        plugin.cmd.get_coords('own')
+        plugin.cmd.hide('everything', 'own')
+
+    plan = plugin.AnalysisCache._record(show_with_queries)
+    assert [command.name for command in plan] == ['hide']
+
+
+def test_assemblies(monkeypatch):
+    """Tests generation of assemblies from the already loaded object."""
+    parse = plugin.Assemblies._parse_oper_expression
+    assert parse('1') == [('1',)]
+    assert parse('(1-3)') == [('1',), ('2',), ('3',)]
+    assert parse('(1,2,5)') == [('1',), ('2',), ('5',)]
+    assert parse('(X0)(1-2)') == [('X0', '1'), ('X0', '2')]
+
+    plugin.PDB_Analysis_Molecules('5j96')
+
+    # Assemblies must not be loaded from file again.
+    def fail(*args, **kwargs):
+        raise Exception('cmd.load called for assembly')
+
+    monkeypatch.setattr(pymol.cmd, 'load', fail)
+    plugin.show_assemblies('5j96', None)
+    num_atoms = pymol.cmd.count_atoms('5j96 and segi A+B+C')
+    expected_states = {'1': 60, '2': 1, '3': 5, '4': 6, '5': 1}
+    for assembly_id, num_states in expected_states.items():
+        assembly_name = '5j96_assem_' + assembly_id
+        assert pymol.cmd.count_states(assembly_name) == num_states
+        # All assemblies are made of copies of segments A, B and C.
+        assert (pymol.cmd.count_atoms(assembly_name) == num_atoms)
+        assert pymol.cmd.count_atoms(assembly_name + ' and rep cartoon')
+
+
+def test_lazy_assemblies(monkeypatch):
+    """Tests assembly placeholders built on enable within an atom budget."""
+    plugin.PDB_Analysis_Molecules('5j96')
+    num_atoms = pymol.cmd.count_atoms('5j96 and segi A+B+C')
+    # Budget fits assemblies with up to 6 copies, but not 2 of them at once.
+    monkeypatch.setattr(plugin.Assemblies, 'atom_budget', num_atoms * 6)
+    monkeypatch.setattr(plugin.Assemblies, '_placeholders', {})
+    monkeypatch.setattr(plugin.Assemblies, '_built', plugin.OrderedDict())
+    plugin.show_assemblies('5j96', None)
+    # Assembly 1 has 60 copies and doesn't fit; 2 fits and is built.
+    assert pymol.cmd.count_atoms('5j96_assem_1') == 1
+    assert '5j96_assem_1' not in pymol.cmd.get_names('objects', enabled_only=1)
+    assert pymol.cmd.count_states('5j96_assem_2') == 1
+
+    # Enabling a placeholder builds the assembly, dropping idle ones.
+    pymol.cmd.disable('5j96_assem_*')
+    pymol.cmd.enable('5j96_assem_4')
+    plugin.Assemblies.update()
+    assert pymol.cmd.count_states('5j96_assem_4') == 6
+    assert pymol.cmd.count_atoms('5j96_assem_4') == num_atoms
+    assert pymol.cmd.count_atoms('5j96_assem_2') == 1
+
+    # Assemblies larger than the whole budget are not built.
+    pymol.cmd.enable('5j96_assem_1')
+    plugin.Assemblies.update()
+    assert pymol.cmd.count_atoms('5j96_assem_1') == 1
+    assert '5j96_assem_1' not in pymol.cmd.get_names('objects', enabled_only=1)
+    # Placeholders stay if building fails.
+    with monkeypatch.context() as context:
+        context.setattr(plugin.Assemblies, 'build', lambda *args: False)
+        pymol.cmd.enable('5j96_assem_2')
+        plugin.Assemblies.update()
+    assert pymol.cmd.count_atoms('5j96_assem_2') == 1
+    pymol.cmd.enable('5j96_assem_2')
+    plugin.Assemblies.update()
+    assert pymol.cmd.count_atoms('5j96_assem_2') == num_atoms
+
+
+def test_assembly_colors():
+    """Tests that assemblies don't inherit the colors of the entry."""
+    def get_assembly_colors():
+        colors = []
+        pymol.cmd.iterate('3mzw_assem_1',
+                          'colors.append((index, color))',
+                          space={'colors': colors})
+        return sorted(colors)
+
+    plugin.PDB_Analysis_Molecules('3mzw')
+    plugin.show_assemblies('3mzw', None)
+    expected_colors = get_assembly_colors()
+    pymol.cmd.reinitialize()
+    plugin.PDB_Analysis_Domains('3mzw')
+    plugin.show_assemblies('3mzw', None)
+    assert get_assembly_colors() == expected_colors
+    # Carbons are colored by chain, other atoms by element.
+    assert pymol.cmd.count_atoms('3mzw_assem_1 and elem O')
+    assert not pymol.cmd.count_atoms(
+        '3mzw_assem_1 and elem O and not color red')
+
+
+def get_atom_colors():
+    colors = []
+    pymol.cmd.iterate('all',
+                      'colors.append((model, index, color, reps))',
+                      space={'colors': colors})
+    return sorted(colors)
+
+
+def test_progressive_rendering(monkeypatch):
+    """Tests showing analysis layers as soon as their data is ready."""
+    fetching = threading.Event()
+    release = threading.Event()
+    validation_class = plugin.Validation
+
+    def slow_validation(molecules):
+        fetching.set()
+        release.wait(30)
+        return validation_class(molecules)
+
+    monkeypatch.setattr(plugin, 'Validation', slow_validation)
+    # Redraws can't be timed from the task's thread without a GUI.
+    monkeypatch.setattr(plugin.LevelOfDetail, 'max_redraw_time', 0)
+    task = plugin.AnalysisTask(plugin.PDBe_startup, '3mzw', 'all')
+    assert fetching.wait(30)
+    while task.phase != 'validation' and not task.done:
+        time.sleep(0.01)
+    # The other layers are shown while the validation data is fetched.
+    objects = pymol.cmd.get_names('objects')
+    assert '3mzw' in objects and len(objects) > 1
+    release.set()
+    assert task.wait(60)
+    assert task.error is None
+    colors = get_atom_colors()
+
+    # Rendering everything at the end gives the same result.
+    pymol.cmd.reinitialize()
+    plugin.analysis_cache.clear()
+    monkeypatch.setattr(plugin, 'progressive_rendering', False)
+    plugin.PDBe_startup('3mzw', 'all')
+    assert get_atom_colors() == colors
+
+    # The structure is shown before the molecules data arrives.
+    pymol.cmd.reinitialize()
+    plugin.analysis_cache.clear()
+    monkeypatch.setattr(plugin, 'progressive_rendering', True)
+    fetching.clear()
+    release.clear()
+    molecules_class = plugin.Molecules
+
+    def slow_molecules(pdbid):
+        fetching.set()
+        release.wait(30)
+        return molecules_class(pdbid)
+
+    monkeypatch.setattr(plugin, 'Molecules', slow_molecules)
+    task = plugin.AnalysisTask(plugin.PDBe_startup, '3l2p', 'molecules')
+    assert fetching.wait(30)
+    deadline = time.time() + 30
+    while ('3l2p' not in pymol.cmd.get_names('objects') or
+           not pymol.cmd.count_atoms('3l2p and visible')):
+        assert time.time() < deadline and not task.done
+        time.sleep(0.01)
+    release.set()
+    assert task.wait(60)
+    assert task.error is None
+    assert not pymol.cmd.count_atoms('3l2p and visible')
+
+
+def get_atom_reps():
+    atom_reps = []
+    pymol.cmd.iterate('all',
+                      'atom_reps.append((model, index, reps))',
+                      space={'atom_reps': atom_reps})
+    return sorted(atom_reps)
+
+
+def get_ribbon_trace_atoms():
+    return dict((name, pymol.cmd.get('ribbon_trace_atoms', name))
+                for name in pymol.cmd.get_names('objects'))
+
+
+def test_concurrent_analyses(monkeypatch):
+    """Tests analyzing two entries at the same time."""
+    # Redraw times of overlapping analyses vary.
+    monkeypatch.setattr(plugin.LevelOfDetail, 'max_redraw_time', 0)
+    pdbids = ('1a1q', '3l2p')  # 1a1q has CA only polymers
+    for pdbid in pdbids:
+        plugin.PDBe_startup(pdbid, 'molecules')
+    expected_reps = get_atom_reps()
+    expected_settings = get_ribbon_trace_atoms()
+    assert set(expected_settings.values()) == {'0', '1'}
+    assert expected_settings['3l2p'] == '0'
+
+    pymol.cmd.reinitialize()
+    plugin.analysis_cache.clear()
+    tasks = [
+        plugin.AnalysisTask(plugin.PDBe_startup, pdbid, 'molecules')
+        for pdbid in pdbids
+    ]
+    for task in tasks:
+        assert task.wait(60)
+        assert task.error is None
+    # Carbon colors depend on the order the entries are loaded in.
+    assert get_atom_reps() == expected_reps
+    assert get_ribbon_trace_atoms() == expected_settings
+    assert pymol.cmd.get('ribbon_trace_atoms') == '0'
+
+
+def test_snapshot(monkeypatch, tmpdir):
+    """Tests restoring analyses from snapshots instead of analyzing again."""
+    snapshot_dir = tmpdir.join('snapshots')
+    monkeypatch.setattr(plugin.snapshot_cache, 'path', str(snapshot_dir))
+    monkeypatch.setattr(plugin.Assemblies, '_placeholders', {})
+    monkeypatch.setattr(plugin.Assemblies, '_built', plugin.OrderedDict())
+    monkeypatch.setattr(plugin.Assemblies, '_restored', {})
+    plugin.PDBe_startup('3mzw', 'all')
+    expected_colors = get_atom_colors()
+    assert len(snapshot_dir.listdir()) == 1
+    file_name = snapshot_dir.listdir()[0].basename
+    assert '.all-v%d-' % plugin._SNAPSHOT_VERSION in file_name
+    revision = file_name.split('.')[0].split('_')[1]
+    snapshot_name = file_name.split('.', 1)[1][:-len('.gz')]
+    # Built assemblies are left out of the snapshot.
+    snapshot = pickle.loads(
+        plugin.snapshot_cache.read('3mzw', revision, snapshot_name))
+    assert '3mzw_assem_1' in snapshot['assemblies']['objects']
+    assert '3mzw_assem_1' not in [
+        names[0] for names in snapshot['session']['names'] if names
+    ]
+
+    def fail(*args, **kwargs):
+        raise Exception('analyzed again')
+
+    pymol.cmd.reinitialize()
+    monkeypatch.setattr(plugin, 'analysis_cache', plugin.AnalysisCache())
+    monkeypatch.setattr(plugin, 'Molecules', fail)
+    monkeypatch.setattr(plugin.StructureDownload, 'load', fail)
+    adapted = []
+    with monkeypatch.context() as context:
+        context.setattr(plugin.level_of_detail, 'adapt',
+                        lambda: adapted.append(True))
+        report = plugin.PDB_Profile('3mzw', 'all')
+    assert get_phase_names(
+        report['phases']) == ['total', 'summary fetch', 'snapshot restore']
+    # Built assemblies are built again, with the steps after them replayed.
+    assert get_atom_colors() == expected_colors
+    # Restored objects are shown at the level of detail of the scene too.
+    assert adapted
+    # The analysis of restored entries is replayed like any other.
+    plugin.PDBe_startup('3mzw', 'molecules')
+    # Restored assembly placeholders are built on enable.
+    num_atoms = pymol.cmd.count_atoms('3mzw')
+    monkeypatch.setattr(plugin.Assemblies, 'atom_budget', 0)
+    pymol.cmd.delete('3mzw_assem_*')
+    plugin.PDBe_startup('3mzw', 'assemblies')
+    monkeypatch.setattr(plugin.Assemblies, 'atom_budget', num_atoms)
+    pymol.cmd.enable('3mzw_assem_1')
+    plugin.Assemblies.update()
+    assert pymol.cmd.count_atoms('3mzw_assem_1') == num_atoms
+
+    # Snapshots made with other preferences aren't used.
+    pymol.cmd.reinitialize()
+    with monkeypatch.context() as context:
+        context.setattr(plugin.LevelOfDetail, 'budget', 1000)
+        with pytest.raises(Exception, match='analyzed again'):
+            plugin.PDBe_startup('3mzw', 'all')
+
+    # Unreadable snapshots are removed.
+    plugin.snapshot_cache.store('3mzw', revision, b'garbage', snapshot_name)
+    assert not plugin._restore_snapshot('3mzw', revision, snapshot_name)
+    assert not plugin.snapshot_cache.get_file('3mzw', revision, snapshot_name)
+
+    # Snapshots of other revisions aren't used.
+    pymol.cmd.reinitialize()
+    monkeypatch.setattr(plugin.StructureCache, 'get_revision',
+                        staticmethod(lambda summary, pdbid: '2099-01-01'))
+    with pytest.raises(Exception, match='analyzed again'):
+        plugin.PDBe_startup('3mzw', 'all')
+
+
+def test_structure_download_overlaps_api(monkeypatch):
+    """Tests that the structure is downloaded while API data is fetched."""
+    molecules_fetched = threading.Event()
+    read_raw_file = plugin._read_raw_file
+    get_molecules = plugin.pdb.get_molecules
+
+    def read_raw_file_after_molecules(file_path):
+        # Can only finish if molecules are fetched while we're waiting here.
+        assert molecules_fetched.wait(10)
+        return read_raw_file(file_path)
+
+    def get_molecules_and_notify(pdbid):
+        data = get_molecules(pdbid)
+        molecules_fetched.set()
+        return data
+
+    monkeypatch.setattr(plugin, '_read_raw_file',
+                        read_raw_file_after_molecules)
+    monkeypatch.setattr(plugin.pdb, 'get_molecules', get_molecules_and_notify)
+    plugin.PDB_Analysis_Molecules('3l2p')
+    assert plugin.count_chains() == 4
+
+
+def test_structure_cache(monkeypatch):
+    """Tests the local cache of downloaded structure files."""
+    cache = plugin.structure_cache
+    read_raw_file = plugin._read_raw_file
+    downloads = {}  # url -> contents as downloaded
+
+    def recording_read_raw_file(file_path):
+        downloads[file_path] = read_raw_file(file_path)
+        return downloads[file_path]
+
+    monkeypatch.setattr(plugin, '_read_raw_file', recording_read_raw_file)
+    plugin.PDB_Analysis_Molecules('3l2p')
+    assert plugin.count_chains() == 4
+    summary = plugin.pdb.get_summary('3l2p')
+    revision = plugin.StructureCache.get_revision(summary, '3l2p')
+    # The cache is written in the background after the download.
+    for thread in threading.enumerate():
+        if thread.name == 'StructureDownload':
+            thread.join()
+    cif = plugin.StructureCache.get_format(plugin._UPDATED_FTP % '3l2p', 'cif')
+    cached_file = cache.get_file('3l2p', revision, cif)
+    assert cached_file
+    assert cache.get_file('3l2p', 'other_revision', cif) is None
+    # The gzipped download is stored as it is.
+    with open(cached_file, 'rb') as file:
+        assert file.read() == downloads[plugin._UPDATED_FTP % '3l2p']
+
+    # A fresh session reads the structure from the cache only.
+    pymol.cmd.reinitialize()
+
+    def local_read_raw_file(file_path):
+        assert '://' not in file_path
+        return read_raw_file(file_path)
+
+    monkeypatch.setattr(plugin, '_read_raw_file', local_read_raw_file)
+    plugin.PDB_Analysis_Molecules('3l2p')
+    assert plugin.count_chains() == 4
+    # Files of other sources, e.g. the archive, are not taken from the cache.
+    download = plugin.StructureDownload(plugin._EBI_FTP % ('l2', '3l2p'),
+                                        cache=cache,
+                                        cache_key=('3l2p', revision))
+    with pytest.raises(AssertionError):
+        download.load('archive')
+    monkeypatch.setattr(plugin, '_read_raw_file', read_raw_file)
+
+    # Corrupt cache files are discarded.
+    with open(cached_file, 'wb') as file:
+        file.write(b'bogus')
+    assert cache.read('3l2p', revision, cif) is None
+    assert cache.get_file('3l2p', revision, cif) is None
+
+    # Pre-warming the cache, with the least recently used entry evicted.
+    assert plugin.PDB_Cache_Structures('3l2p, 3mzw') == 2
+    assert cache.get_file('3l2p', revision, cif)
+    mzw_cif = plugin.StructureCache.get_format(plugin._UPDATED_FTP % '3mzw',
+                                               'cif')
+    assert cache.get_file('3mzw', '20171108', mzw_cif)
+    monkeypatch.setattr(
+        cache, 'max_bytes',
+        os.path.getsize(cache.get_file('3mzw', '20171108', mzw_cif)))
+    os.utime(cache.get_file('3l2p', revision, cif), (0, 0))
+    assert plugin.PDB_Cache_Structures('5j96') == 1
+    assert cache.get_file('3l2p', revision, cif) is None
+
+
+def test_binary_cif_load_times(pytestconfig, capsys):
+    """Compares loading mmCIF and BinaryCIF for the web cache structures."""
+    if not pytestconfig.option.benchmark:
+        pytest.skip('benchmarks only run with --benchmark')
+    if not plugin.BinaryCif.use_native_reader:
+        pytest.skip('PyMOL has no BinaryCIF reader')
+    pymol.cmd.set('cif_keepinmemory')
+    pdbids = ['1a1q', '1b2m', '1f0d', '2gc2', '3b43', '3l2p', '5j96', '6a5j']
+    lines = []
+    for pdbid in pdbids:
+        contents = pymol.cmd.file_read(plugin._UPDATED_FTP % pdbid)
+        start = time.time()
+        pymol.cmd.load_raw(contents, 'cif', pdbid)
+        cif_time = time.time() - start
+        bcif_contents = bcif_encode_object(pdbid)
+
+        start = time.time()
+        plugin.BinaryCif.load(bcif_contents, 'native')
+        native_time = time.time() - start
+        lines.append('%s %7d %10d %10d %8.3f %8.3f' %
+                     (pdbid, pymol.cmd.count_atoms('native'),
+                      len(gzip.compress(contents)),
+                      len(gzip.compress(bcif_contents)), cif_time, native_time))
+        pymol.cmd.delete('all')
+
+    with capsys.disabled():
+        print('\npdbid   atoms  cif.gz[B] bcif.gz[B]   cif[s]  bcif[s]')
+        print('\n'.join(lines))
+
+
+def test_binary_cif_analysis(monkeypatch):
+    """Tests analysis of entries downloaded as BinaryCIF."""
+    pymol.cmd.set('cif_keepinmemory')
+    file_read = pymol.cmd.file_read
+    pymol.cmd.load_raw(file_read(plugin._UPDATED_FTP % '5j96'), 'cif', '5j96')
+    bcif_contents = bcif_encode_object('5j96')
+    num_atoms = pymol.cmd.count_atoms('5j96')
+    pymol.cmd.delete('all')
+    bcif_url = plugin._UPDATED_BCIF % '5j96'
+
+    read_raw_file = plugin._read_raw_file
+
+    def bcif_read_raw_file(file_path):
+        if file_path == bcif_url:
+            return bcif_contents
+        assert file_path.endswith('.cif.gz')
+        return read_raw_file(file_path)
+
+    monkeypatch.setattr(plugin, '_read_raw_file', bcif_read_raw_file)
+    monkeypatch.setattr(plugin.StructureDownload, 'preferred_format', 'bcif')
+    for use_native_reader in (False, True):
+        monkeypatch.setattr(plugin.BinaryCif, 'use_native_reader',
+                            use_native_reader)
+        pymol.cmd.reinitialize()
+        plugin.PDB_Analysis_Assemblies('5j96')
+        # Coordinate-less atoms are only read from mmCIF, which is downloaded
+        # instead if PyMOL can't read BinaryCIF.
+        assert (pymol.cmd.count_atoms('5j96') < num_atoms) == use_native_reader
+        assert pymol.cmd.count_states('5j96_assem_1') == 60
+        binary_cif = plugin.BinaryCif.get('5j96')
+        if binary_cif:
+            # Only the assembly data of the file is decoded and kept.
+            assert binary_cif._contents is None
+            assert set(binary_cif._categories) == set(
+                plugin.BinaryCif._ASSEMBLY_CATEGORIES)
+
+    # Broken BinaryCIF files fall back to mmCIF.
+    valid_bcif_contents = bcif_contents
+    bcif_contents = b'bogus'
+    pymol.cmd.reinitialize()
+    monkeypatch.setattr(plugin.structure_cache, 'path', None)
+    plugin.PDB_Analysis_Molecules('5j96')
+    assert pymol.cmd.count_atoms('5j96') == num_atoms
+
+    # PyMOL builds without msgpack-c have a BinaryCIF reader which only prints
+    # an error; mmCIF is loaded instead.
+    bcif_contents = valid_bcif_contents
+    load_raw = pymol.cmd.load_raw
+
+    def load_raw_without_bcif(content, format, *args, **kwargs):
+        if format == 'bcif':
+            print(' Error: This build has no BinaryCIF support.')
+            return None
+        return load_raw(content, format, *args, **kwargs)
+
+    monkeypatch.setattr(pymol.cmd, 'load_raw', load_raw_without_bcif)
+    monkeypatch.setattr(plugin.BinaryCif, 'use_native_reader', True)
+    pymol.cmd.reinitialize()
+    plugin.PDB_Analysis_Assemblies('5j96')
+    assert pymol.cmd.count_atoms('5j96') == num_atoms
+    assert pymol.cmd.count_states('5j96_assem_1') == 60
+    assert plugin.BinaryCif.get('5j96') is None
+    # Later downloads are mmCIF right away.
+    assert not plugin.BinaryCif.use_native_reader
+    assert plugin._get_structure_url('5j96')[1] == 'cif'
+
+
+def start_batch_worker_with_web_cache():
+    """Batch worker initializer which serves web data from the web cache."""
+    pymol.plugins.pref_save = lambda *args, **kwargs: None
+    plugin._start_batch_worker()
+    plugin.structure_cache.path = None
+    plugin.snapshot_cache.path = None
+    plugin.title_cache.path = None
+
+    class Options(object):
+        webcache_fetch = False
+
+    class Config(object):
+        option = Options()
+
+    web_cache = WebCache(Config(), plugin.pdb._fetcher.get_data,
+                         pymol.cmd.file_read)
+    web_cache.load_from_dir(os.path.join(os.getcwd(), WEBCACHE_PATH))
+    plugin.pdb._fetcher.get_data = web_cache.access_plugin_url
+    pymol.cmd.file_read = web_cache.access_pymol_url
+    plugin._read_raw_file = web_cache.access_raw_url
+
+
+def test_batch_analysis(tmpdir):
+    """Tests batch analysis of several entries in this process."""
+    output_dir = str(tmpdir)
+    results = plugin.PDB_Batch_Analysis('3l2p bogus', 'molecules', output_dir,
+                                        0)
+    assert [x['pdbid'] for x in results] == ['3l2p', 'bogus']
+    assert results[0]['status'] == 'ok'
+    assert os.path.isfile(os.path.join(output_dir, '3l2p.pse'))
+    assert results[1]['status'] == 'failed'
+    with open(os.path.join(output_dir, 'batch_report.json')) as file:
+        report = json.load(file)
+    assert report['num_entries'] == 2
+    assert report['num_failed'] == 1
+
+    # Object files instead of a session, started from the command line.
+    plugin.main([
+        'batch=3l2p', 'method=molecules', 'output_dir=' + output_dir,
+        'processes=0', 'output_format=cif'
+    ])
+    object_files = os.listdir(os.path.join(output_dir, '3l2p'))
+    assert '3l2p.cif' in object_files
+    assert len(object_files) == results[0]['num_objects']
+
+
+def test_batch_analysis_processes(tmpdir):
+    """Tests batch analysis in a pool of worker processes."""
+    output_dir = str(tmpdir)
+    pymol.cmd.fragment('ala')
+    results = plugin._run_batch(['3l2p', '3mzw', '5j96'],
+                                'molecules',
+                                output_dir,
+                                processes=2,
+                                initializer=start_batch_worker_with_web_cache)
+    assert [x['status'] for x in results] == ['ok'] * 3
+    for pdbid in ('3l2p', '3mzw', '5j96'):
+        assert os.path.isfile(os.path.join(output_dir, pdbid + '.pse'))
+    # The session of this process is left alone.
+    assert pymol.cmd.get_object_list() == ['ala']
+
+
+def start_test_worker():
+    """Batch worker initializer without PyMOL."""
+
+
+def crashing_worker(task):
+    """Batch worker which dies on entry 'dead'."""
+    if task[0] == 'dead':
+        os._exit(1)
+    return plugin._new_batch_result(task[0])
+
+
+def test_batch_worker_crash(tmpdir, monkeypatch):
+    """Tests that a crashing worker process doesn't stall the batch."""
+    monkeypatch.setattr(plugin, 'batch_task_timeout', 5)
+    results = plugin._run_batch(['ok1', 'dead', 'ok2', 'ok3'],
+                                output_dir=str(tmpdir),
+                                processes=2,
+                                worker=crashing_worker,
+                                initializer=start_test_worker)
+    assert [x['pdbid'] for x in results] == ['ok1', 'dead', 'ok2', 'ok3']
+    assert [x['status'] for x in results] == ['ok', 'failed', 'ok', 'ok']
+    assert 'worker process may have died' in results[1]['error']
+
+
+def read_png_size(file_name):
+    """Returns (width, height) of a PNG image."""
+    with open(file_name, 'rb') as file:
+        header = file.read(24)
+    assert header.startswith(b'\x89PNG')
+    return (int(codecs.encode(header[16:20], 'hex'),
+                16), int(codecs.encode(header[20:24], 'hex'), 16))
+
+
+def test_render_images(tmpdir, monkeypatch):
+    """Tests rendering images of all views in worker processes."""
+    output_dir = str(tmpdir)
+    pymol.cmd.fragment('ala')
+    results = plugin._run_render(['3mzw'],
+                                 plugin.RENDER_VIEWS,
+                                 output_dir,
+                                 width=80,
+                                 height=60,
+                                 processes=2,
+                                 initializer=start_batch_worker_with_web_cache)
+    images = [os.path.basename(x['image']) for x in results]
+    assert images == [
+        '3mzw_assem_1.png', '3mzw_domains.png', '3mzw_molecules.png',
+        '3mzw_validation.png'
+    ]
+    for result in results:
+        assert result['status'] == 'ok'
+        assert read_png_size(result['image']) == (80, 60)
+    # The session of this process is left alone.
+    assert pymol.cmd.get_object_list() == ['ala']
+
+    # The entry is loaded once for all views.
+    loads = []
+    structure_load = plugin.StructureDownload.load
+    monkeypatch.setattr(
+        plugin.StructureDownload, 'load',
+        lambda self, *args: loads.append(args) or structure_load(self, *args))
+    results = plugin._run_render(['3mzw'], ['validation', 'domains'],
+                                 output_dir,
+                                 width=80,
+                                 height=60,
+                                 processes=0)
+    assert len(loads) == 1
+    assert [x['status'] for x in results] == ['ok'] * 2
+    # Each scene only shows the objects of its view.
+    pymol.cmd.load(os.path.join(output_dir, 'scenes', '3mzw_validation.pse'))
+    assert pymol.cmd.get_names('objects', enabled_only=1) == ['3mzw']
+    pymol.cmd.load(os.path.join(output_dir, 'scenes', '3mzw_domains.pse'))
+    enabled = pymol.cmd.get_names('objects', enabled_only=1)
+    assert 'CATH_3.80.20.20_3mzwA01' in enabled
+    assert 'NACETYLDGLUCOSAMINE' in enabled
+
+    # Failures are reported per view, also when rendering in this process.
+    results = plugin.PDB_Render_Images('bogus', 'molecules', output_dir, 80, 60,
+                                       0)
+    assert [x['status'] for x in results] == ['failed']
+    with pytest.raises(pymol.CmdException):
+        plugin.PDB_Render_Images('3mzw', 'bogus', output_dir)
+
+
+def get_phase_names(phase):
+    """Returns the names of phase and all its sub-phases."""
+    names = [phase['name']]
+    for sub_phase in phase['phases']:
+        names.extend(get_phase_names(sub_phase))
+    return names
+
+
+def test_profiler():
+    """Tests nesting of phases and counters of the Profiler."""
+    profiler = plugin.Profiler()
+    with profiler.phase('ignored'):  # not started
+        profiler.count('ignored')
+    profiler.start()
+    for _ in range(2):
+        with profiler.phase('outer'):
+            with profiler.phase('inner'):
+                profiler.count('things', 3)
+    thread = threading.Thread(target=lambda: profiler.count('things'))
+    thread.start()
+    thread.join()
+    report = profiler.stop()
+    assert get_phase_names(report['phases']) == ['total', 'outer', 'inner']
+    outer = report['phases']['phases'][0]
+    assert outer['calls'] == 2
+    assert outer['phases'][0]['seconds'] <= outer['seconds']
+    assert report['counters'] == {'things': 7}
+    assert 'outer' in plugin.Profiler.format_report(report)
+
+
+def test_profile(tmpdir, capsys):
+    """Tests the per-phase profile of an entry analysis."""
+    output_file = str(tmpdir.join('profile.json'))
+    # Commands of other threads are not counted.
+    done = threading.Event()
+
+    def issue_commands():
+        while not done.is_set():
+            plugin.cmd.get_version()
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=issue_commands)
+    thread.start()
+    try:
+        report = plugin.PDB_Profile('3mzw', 'all', output_file)
+    finally:
+        done.set()
+        thread.join()
+    assert 'cmd.get_version' not in report['counters']
+    assert not plugin.cmd.observers
+    phase_names = get_phase_names(report['phases'])
+    for name in ('summary fetch', 'molecules', 'sequences', 'structure load',
+                 'molecules show', 'selection building', 'create objects',
+                 'domains show', 'domain mapping', 'assemblies',
+                 'validation show', 'validation tally'):
+        assert name in phase_names
+    counters = report['counters']
+    assert counters['objects created'] == len(pymol.cmd.get_names('objects'))
+    assert counters['pymol commands'] >= counters['cmd.create'] > 1
+    assert 'structure load' in capsys.readouterr().out
+    with open(output_file) as f:
+        assert json.load(f) == json.loads(json.dumps(report))
+
+    # Nothing is collected outside of PDB_Profile.
+    pymol.cmd.reinitialize()
+    plugin.PDB_Analysis_Molecules('3mzw')
+    assert not plugin.profiler.enabled
+
+
+def test_analysis_context():
+    """Tests that the analyses of entries keep their data apart."""
+    many = plugin.AnalysisContext('many')
+    many.atom_count = plugin.LevelOfDetail.budget
+    few = plugin.Molecules('3l2p')
+    assert few.context.pdbid == '3l2p'
+    assert few.context.molecules and few.context.sequences is few.sequences
+    assert 0 < few.context.polymer_count <= 50
+    assert plugin.get_polymer_display_type(many, 'A', 'polypeptide',
+                                           100) == 'ribbon'
+    assert plugin.get_polymer_display_type(few.context, 'A', 'polypeptide',
+                                           100) == 'cartoon'
+    # Segments of large entries keep their own representations.
+    assert plugin.get_polymer_display_type(many, 'A', 'polypeptide',
+                                           10) == 'sticks'
+    assert plugin.get_polymer_display_type(many, 'A', 'polysaccharide(D)',
+                                           100) == 'sticks'
+    many.ca_p_only_segments.add('B')
+    assert plugin.get_polymer_display_type(many, 'B', 'polypeptide',
+                                           100) == 'ca_p_ribbon'
+    # Analyzing another entry does not reuse the data of the first one.
+    other = plugin.Molecules('3mzw')
+    assert other.context is not few.context
+    assert other.molecules != few.molecules
+    assert set(
+        plugin.AnalysisContext._contexts) >= {many, few.context, other.context}
+
+
+def test_level_of_detail(monkeypatch):
+    """Tests keeping the geometry of the scene within budget."""
+    plugin.PDB_Analysis_Molecules('3l2p')
+    assert pymol.cmd.count_atoms('rep cartoon') > 0
+    assert plugin.level_of_detail.level == 0
+    atoms = pymol.cmd.count_atoms('rep cartoon')
+    cost = plugin.level_of_detail.get_scene_cost()
+    assert cost >= atoms * plugin.LevelOfDetail.COSTS['cartoon']
+
+    # The next entry does not fit in the budget as a cartoon.
+    monkeypatch.setattr(plugin.LevelOfDetail, 'budget', cost + 1000)
+    plugin.PDB_Analysis_Molecules('3mzw')
+    assert pymol.cmd.count_atoms('rep cartoon') == atoms
+    assert pymol.cmd.count_atoms('rep ribbon') > 0
+
+    # Slow redraws step the objects of the plugin down, but not the user's.
+    pymol.cmd.create('user_copy', 'rep cartoon')
+    user_atoms = pymol.cmd.count_atoms('user_copy and rep cartoon')
+    assert user_atoms > 0
+    redraw_times = [1.0, 0.01]
+    monkeypatch.setattr(plugin.level_of_detail, 'measure_redraw',
+                        lambda: redraw_times.pop(0))
+    assert plugin.level_of_detail.adapt() == 1
+    assert pymol.cmd.count_atoms('rep cartoon') == user_atoms
+    assert pymol.cmd.count_atoms('rep ribbon') > atoms
+    pymol.cmd.delete('user_copy')
+    redraw_times.append(1.0)
+    assert plugin.level_of_detail.adapt() == 2
+    assert not redraw_times
+    names = pymol.cmd.get_object_list('rep ribbon')
+    assert set(
+        int(pymol.cmd.get('ribbon_sampling', name)) for name in names) == {1}
+    # Later entries start at the reduced detail while redrawing is slow...
+    redraw_times.append(0.05)
+    pymol.cmd.reinitialize()
+    plugin.PDB_Analysis_Molecules('3l2p')
+    assert pymol.cmd.count_atoms('rep cartoon') == 0
+    assert pymol.cmd.get_object_list('rep ribbon')
+    assert plugin.level_of_detail.level == 2
+    # ...and at full detail again once it is fast.
+    redraw_times.extend([0.01, 0.01])
+    pymol.cmd.reinitialize()
+    plugin.PDB_Analysis_Molecules('3l2p')
+    assert pymol.cmd.count_atoms('rep cartoon') > 0
+    assert plugin.level_of_detail.level == 0
+    assert not redraw_times
+
+    # Analyses outside the GUI thread leave measuring redraws to update(),
+    # which the GUI calls from its timer.
+    level_of_detail = plugin.level_of_detail
+    level_of_detail.level = 1
+    levels = []
+    thread = threading.Thread(target=lambda: levels.extend(
+        [level_of_detail.recover(),
+         level_of_detail.adapt()]))
+    thread.start()
+    thread.join(10)
+    assert levels == [1, 1]
+    redraw_times.extend([1.0, 1.0])
+    level_of_detail.update()
+    assert level_of_detail.level == 2
+    assert not redraw_times
+    level_of_detail.update()  # nothing more to measure
+
+
+def test_memory_report():
+    """Tests the memory accounting of the analysis state."""
+    shared = ['x' * 1000]
+    assert plugin._get_deep_size(
+        [shared, shared]) == (sys.getsizeof([shared, shared]) +
+                              sys.getsizeof(shared) + sys.getsizeof(shared[0]))
+
+    report = plugin.PDB_Memory('3mzw', 'domains', 5)
+    # The context of the last analysis is kept for the report.
+    assert plugin.AnalysisContext._last.pdbid == '3mzw'
+    assert report['state']['AnalysisContext._contexts'] > sys.getsizeof([])
+    assert report['state_bytes'] == sum(report['state'].values())
+    objects = report['objects']
+    assert objects['3mzw'] == pymol.cmd.count_atoms('3mzw')
+    assert report['copied_atoms'] == sum(objects.values()) - objects['3mzw']
+    assert report['copied_atoms'] > 0
+    if tracemalloc:
+        assert 0 < len(report['allocations']) <= 5
+        assert report['peak_bytes'] > 0
+
+    # Without an entry only the current state is reported.
+    report = plugin.PDB_Memory()
+    assert 'allocations' not in report
+    assert report['objects']['3mzw'] == objects['3mzw']
+
+
+def test_memory_report_after_analysis():
+    """Tests that the memory report includes the last analysis' context."""
+    plugin.PDBe_startup('3mzw', 'molecules')
+    context_bytes = plugin.get_memory_report()['state'][
+        'AnalysisContext._contexts']
+    assert context_bytes > plugin._get_deep_size([plugin.AnalysisContext('x')])
+
+
+def test_synthetic_entry(synthetic_entry):
+    """Tests the analysis of a generated entry served by the web cache."""
+    entry = synthetic_entry(chains=6,
+                            residues=60,
+                            entities=2,
+                            ligands=3,
+                            domains=2,
+                            outliers=4,
+                            gap_every=25)
+    plugin.PDB_Analysis_Molecules(entry.pdbid)
+    assert pymol.cmd.count_atoms(entry.pdbid) == 6 * 60 * 4 + 3
+    assert pymol.cmd.count_atoms('Synthetic_protein_1') == 3 * 60 * 4
+    assert pymol.cmd.count_atoms('ZINC_ION') == 3
+    # The numbering gaps split each chain into 3 ranges.
+    ranges = plugin.Molecules(entry.pdbid).sequences.get_ranges('A', 1, 60)
+    bounds = [(x.start_residue_num, x.end_residue_num) for x in ranges]
+    assert bounds == [('1', '25'), ('36', '60'), ('71', '80')]
+
+    pymol.cmd.reinitialize()
+    plugin.PDB_Analysis_Domains(entry.pdbid)
+    names = pymol.cmd.get_names('objects')
+    assert len([x for x in names if x.startswith('CATH_')]) == 6 * 2
+    assert len([x for x in names if x.startswith('Pfam_')]) == 2
+
+    pymol.cmd.reinitialize()
+    plugin.PDB_Analysis_Validation(entry.pdbid)
+    colors = {}
+    pymol.cmd.iterate('%s and name CA and chain A' % entry.pdbid,
+                      'colors[int(resi)] = color',
+                      space={'colors': colors})
+    outliers = set(
+        colors[entry.get_author_residue_number(n)] for n in (1, 16, 31, 46))
+    assert colors[2] not in outliers
+
+
+# ----- Benchmarks -----
+
+# Entries recorded in the web cache. Analyses needing data that wasn't recorded
+# are skipped.
+BENCHMARK_ENTRIES = ('1a1q', '1b2m', '1f0d', '2gc2', '3b43', '3jcd', '3l2p',
+                     '3mxw', '3mzw', '5j96', '6a5j')
+BENCHMARK_METHODS = ('molecules', 'domains', 'validation', 'assemblies', 'all')
+# Measures compared with the baseline and the absolute increase they need on
+# top of the relative threshold to count as regression, so tiny values don't
+# trip over noise.
+BENCHMARK_MEASURES = {
+    'seconds': 0.01,
+    'python_peak_bytes': 64 * 1024,
+    'pymol_commands': 0,
+    'state_bytes': 16 * 1024,
+    'copied_atoms': 0,
+}
+
+
+def calibrate_benchmarks(rounds=5):
+    """Returns the seconds a fixed workload takes on this machine."""
+    seconds = []
+    for _ in range(rounds):
+        start = time.time()
+        pymol.cmd.reinitialize()
+        pymol.cmd.load('tests/data/3mxw.cif', '3mxw')
+        pymol.cmd.select('calibrate', 'chain A and resi 1-100')
+        json.loads(json.dumps([{'residue_number': i} for i in range(20000)]))
+        seconds.append(time.time() - start)
+    pymol.cmd.reinitialize()
+    return min(seconds)
+
+
+@pytest.fixture(scope='session')
+def benchmark_results(pytestconfig):
+    """Collects benchmark results and writes them out at the end.
+
+    Times are compared with the baseline after scaling them by the speed of the
+    machine relative to the baseline's machine, as measured by a calibration
+    workload.
+    """
+    # --- setup ---
+    option = pytestconfig.option
+    calibration = calibrate_benchmarks() if option.benchmark else None
+    baseline = {}
+    speed = 1.0  # baseline machine speed relative to this one
+    if option.benchmark and option.benchmark_baseline:
+        with open(option.benchmark_baseline) as f:
+            baseline_output = json.load(f)
+        baseline = baseline_output['results']
+        speed = calibration / baseline_output['calibration_seconds']
+    results = {}
+
+    yield results, baseline, speed  # each test runs here
+
+    # --- teardown ---
+    if option.benchmark_output and results:
+        with open(option.benchmark_output, 'w') as f:
+            output = {
+                'calibration_seconds': calibration,
+                'rounds': option.benchmark_rounds,
+                'results': results,
+            }
+            json.dump(output, f, indent=2, sort_keys=True)
+
+
+def measure_analysis(pdbid, method, trace_memory=False):
+    """Returns wall time, peak python memory and PyMOL command count."""
+    pymol.cmd.reinitialize()
+    plugin.analysis_cache.clear()  # measure the analysis, not its replay
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        report = plugin.PDB_Profile(pdbid, method)
+        peak_bytes = tracemalloc.get_traced_memory(
+        )[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    phase_seconds = {}  # phase name -> seconds summed over the phase tree
+    phases = [report['phases']]
+    while phases:
+        phase = phases.pop()
+        phase_seconds[phase['name']] = (phase_seconds.get(phase['name'], 0) +
+                                        phase['seconds'])
+        phases.extend(phase['phases'])
+    return {
+        'seconds': report['phases']['seconds'],
+        'phase_seconds': phase_seconds,
+        'python_peak_bytes': peak_bytes,
+        'pymol_commands': report['counters'].get('pymol commands', 0),
+    }
+
+
+def record_benchmark(pytestconfig, benchmark_results, key, result):
+    """Records the result of benchmark key; fails if it regressed."""
+    option = pytestconfig.option
+    results, baseline, speed = benchmark_results
+    results[key] = result
+    regressions = []
+    for measure, min_increase in sorted(BENCHMARK_MEASURES.items()):
+        old, new = baseline.get(key, {}).get(measure), result.get(measure)
+        if old is None or new is None:
+            continue
+        if measure == 'seconds':
+            old *= speed
+        if (new > old * (1 + option.benchmark_threshold) and
+                new - old > min_increase):
+            regressions.append('%s: %s -> %s' % (measure, old, new))
+    assert not regressions, key + ' regressed: ' + ', '.join(regressions)
+
+
+@pytest.mark.parametrize('method', BENCHMARK_METHODS)
+@pytest.mark.parametrize('pdbid', BENCHMARK_ENTRIES)
+def test_benchmark(pdbid, method, pytestconfig, benchmark_results, monkeypatch):
+    """Replays an analysis from the web cache and measures its cost."""
+    option = pytestconfig.option
+    if not option.benchmark:
+        pytest.skip('benchmarks only run with --benchmark')
+    # Measure the analysis, not debug logging or the structure cache.
+    logging.getLogger().setLevel(logging.WARNING)
+    monkeypatch.setattr(plugin.structure_cache, 'path', None)
+    try:
+        rounds = [
+            measure_analysis(pdbid, method)
+            for _ in range(option.benchmark_rounds)
+        ]
+        # Tracing memory slows python down, so it gets a round of its own.
+        memory = measure_analysis(pdbid, method, trace_memory=bool(tracemalloc))
+        state = plugin.get_memory_report()
+    except Exception as e:
+        if 'Missing in webcache' in str(e):
+            pytest.skip('%s %s not recorded in web cache' % (pdbid, method))
+        raise
+
+    record_benchmark(
+        pytestconfig, benchmark_results, '%s/%s' % (pdbid, method), {
+            'seconds': min(x['seconds'] for x in rounds),
+            'round_seconds': [x['seconds'] for x in rounds],
+            'python_peak_bytes': memory['python_peak_bytes'],
+            'pymol_commands': memory['pymol_commands'],
+            'state_bytes': state['state_bytes'],
+            'copied_atoms': state['copied_atoms'],
+        })
+
+
+# Number of chains of synthetic entries. Ribosomes and capsids have hundreds of
+# chains, but domains and validation currently scale quadratically, which makes
+# larger sizes too slow to run routinely.
+SYNTHETIC_SCALES = (10, 20, 40)
+SYNTHETIC_PHASES = ('sequences', 'molecules show', 'domains show',
+                    'validation show')
+
+
+@pytest.mark.parametrize('chains', SYNTHETIC_SCALES)
+def test_benchmark_scaling(chains, pytestconfig, benchmark_results,
+                           synthetic_entry, monkeypatch):
+    """Measures the analysis phases of a synthetic entry of the given size."""
+    option = pytestconfig.option
+    if not option.benchmark:
+        pytest.skip('benchmarks only run with --benchmark')
+    logging.getLogger().setLevel(logging.WARNING)
+    monkeypatch.setattr(plugin.structure_cache, 'path', None)
+    entry = synthetic_entry(chains=chains,
+                            residues=200,
+                            entities=max(1, chains // 5),
+                            ligands=chains,
+                            domains=4,
+                            outliers=10,
+                            gap_every=50)
+    rounds = [
+        measure_analysis(entry.pdbid, 'all')
+        for _ in range(option.benchmark_rounds)
+    ]
+    for phase in SYNTHETIC_PHASES:
+        seconds = [x['phase_seconds'][phase] for x in rounds]
+        record_benchmark(pytestconfig, benchmark_results,
+                         'synthetic-%d/%s' % (chains, phase), {
+                             'seconds': min(seconds),
+                             'round_seconds': seconds,
+                         })
+
+
 # ----- keep this test last -----
 @pytest.mark.skipif(not web_cache, reason='web cache disabled')
 def test_print_web_cache_stats(web_cache, capsys):